@@ -1,8 +1,6 @@
 #app_server/api/consumers.py
-from .models import ChatMessage
 
 from channels.generic.websocket import AsyncWebsocketConsumer
-from rest_framework_simplejwt.tokens import AccessToken
 from django.contrib.auth import get_user_model
 from django.conf import settings
 from channels.db import database_sync_to_async 
@@ -12,42 +10,102 @@ import asyncio
 # AI 서비스 파일 임포트 (통합된 파일 사용)
 from services.ai_persona_service import AIPersonaService 
 
-from services.emotion_service import analyze_emotion
+from services.emotion_service import analyze_emotion_async
+from services.history_service import ConversationHistory, fetch_recent_history_messages
+from services.summary_service import conversation_summarizer, load_summary
+from services.message_store import chat_message_store
+from services.proactive_service import proactive_pregenerator
+from services.affinity_service import affinity_engine
 
-@database_sync_to_async
-def save_message(user, content, sender):
-    ChatMessage.objects.create(user=user, content=content, sender=sender)
+async def save_message(user, content, sender):
+    # 단건 INSERT 대신 프로세스 전역 write-behind 큐에 넣고, bulk_create로 모아서 저장
+    await chat_message_store.enqueue(user, content, sender, durable=settings.CHAT_MESSAGE_DURABLE_WRITES)
+    # 대화가 바뀌었음을 기록. 능동적 메시지는 대화가 멈춘 뒤 백그라운드에서 한 번만 다시 준비
+    proactive_pregenerator.mark_chatted(user.id, user.username)
 
 
 User = get_user_model()
 
+
+def _clamp_setting(value, value_range, default):
+    """클라이언트가 보낸 값을 정수로 변환하고 허용 범위 안으로 제한합니다."""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return default
+    low, high = value_range
+    return max(low, min(high, value))
+
+
+class StreamCoalescer:
+    """
+    스트리밍 청크를 버퍼에 모았다가, 첫 청크가 들어온 뒤 flush_interval_ms가 지나거나
+    버퍼가 flush_bytes 이상이 되면(먼저 오는 쪽) 하나의 'chat_message' 프레임으로 전송합니다.
+    글자/토큰 단위 청크마다 json.dumps + send 하던 것을 몇 개의 프레임으로 줄입니다.
+    """
+    def __init__(self, send, flush_interval_ms: int, flush_bytes: int):
+        self._send = send
+        self._flush_interval = flush_interval_ms / 1000
+        self._flush_bytes = flush_bytes
+        self._buffer = []
+        self._buffered_bytes = 0
+        self._timer = None
+        self._timer_task = None
+        # 타이머 flush와 크기 flush가 겹쳐도 프레임 순서가 유지되도록 전송을 직렬화
+        self._send_lock = asyncio.Lock()
+
+    async def add(self, chunk: str):
+        self._buffer.append(chunk)
+        self._buffered_bytes += len(chunk.encode('utf-8'))
+
+        if self._buffered_bytes >= self._flush_bytes or self._flush_interval <= 0:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self._flush_interval, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._timer_task = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._buffer:
+            return
+
+        message = "".join(self._buffer)
+        self._buffer = []
+        self._buffered_bytes = 0
+
+        async with self._send_lock:
+            await self._send(text_data=json.dumps({
+                "type": "chat_message",
+                "message": message
+            }))
+
+    async def close(self):
+        """남은 버퍼를 모두 전송하고 대기 중인 타이머 전송이 끝날 때까지 기다립니다."""
+        await self.flush()
+        if self._timer_task is not None:
+            await self._timer_task
+            self._timer_task = None
+
+
 class ChatConsumer(AsyncWebsocketConsumer):
     #  연결 수립 (인증 및 초기 설정)
     async def connect(self):
         """WebSocket 연결을 수락하고 JWT 인증 및 사용자 데이터를 로드합니다."""
         self.ai_service = None
+        # 스트리밍 프레임 병합 설정 (클라이언트가 'stream_config'로 변경 가능)
+        self.stream_flush_interval_ms = settings.CHAT_STREAM_FLUSH_INTERVAL_MS
+        self.stream_flush_bytes = settings.CHAT_STREAM_FLUSH_BYTES
         try:
-            # Flutter에서 보낸 쿼리 파라미터(token)에서 JWT 토큰 추출
-            query_string = self.scope['query_string'].decode()
-            if 'token=' not in query_string:
-                raise ValueError("토큰 쿼리 파라미터가 누락되었습니다.")
-
-            token = query_string.split('token=')[1].split('&')[0]
-            if not token:
-                raise ValueError("토큰 없음")
-
-            # JWT 토큰 검증 및 사용자 로드
-            access_token = AccessToken(token)
-            user_id = access_token['user_id']
-            
-            # 핵심: database_sync_to_async를 사용하여 DB에서 User 및 ai_profile 동시 로드
-            self.user = await database_sync_to_async(
-                # select_related('ai_profile')를 사용하여 호감도 정보가 포함된 ai_profile Eager Loading
-                User.objects.select_related('ai_profile').get
-                )(pk=user_id)
-            
-            if not self.user.is_active:
-                raise ValueError("비활성화된 사용자")
+            # JWTAuthMiddleware가 쿼리 파라미터(token)의 JWT를 검증하고
+            # User 및 ai_profile(호감도 정보)을 캐시된 스냅샷으로 scope에 넣어 둠
+            self.user = self.scope['user']
+            if not self.user.is_authenticated:
+                raise ValueError(self.scope.get('auth_error') or "인증되지 않은 사용자")
 
             # ai_profile 로드 확인 (페르소나 적용에 필수)
             if not hasattr(self.user, 'ai_profile') or self.user.ai_profile is None:
@@ -69,7 +127,22 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 print("OPENAI_API_KEY가 settings에 설정되지 않았습니다. API 호출은 실패할 수 있습니다.") 
             
             # 로드된 self.user 객체를 서비스에 전달 (호감도 점수 포함)
-            self.ai_service = AIPersonaService(self.user, api_key)
+            self.ai_service = AIPersonaService(self.user)
+
+            # 이전 연결에서 아직 기록되지 않은 이 사용자의 메시지가 있으면 먼저 저장한 뒤 기록을 읽음
+            # (다른 사용자의 대기 행은 배치로 모이도록 그대로 둠)
+            await chat_message_store.flush(self.user.id)
+
+            # 누적 대화 요약 로드 (요약에 이미 반영된 메시지는 대화 기록에서 제외)
+            summary, summarized_through = await database_sync_to_async(load_summary)(self.user.id)
+            self.ai_service.conversation_summary = summary
+
+            # 서버 측 대화 기록 링 버퍼: 연결 시 DB에서 한 번만 채우고 이후 턴마다 갱신
+            self.history = ConversationHistory(settings.CHAT_HISTORY_MAX_MESSAGES, settings.CHAT_HISTORY_TOKEN_BUDGET)
+            self.history.seed(await database_sync_to_async(fetch_recent_history_messages)(
+                self.user, settings.CHAT_HISTORY_MAX_MESSAGES, summarized_through
+            ))
+            proactive_pregenerator.mark_active(self.user.id, self.user.username)
             print(f"WebSocket 연결 성공 및 서비스 초기화: User {self.user.username}")
         except Exception as e:
             print(f"AI 서비스 초기화 오류: {e}")
@@ -81,18 +154,34 @@ class ChatConsumer(AsyncWebsocketConsumer):
         if not self.ai_service:
             await self.send(text_data=json.dumps({"type": "error", "message": "Service not initialized."}))
             return
+
+        emotion_task = None
             
         try:
             data = json.loads(text_data)
             message_type = data.get('type') 
             user_message = data.get('message')
+
+            if message_type == 'stream_config':
+                await self._apply_stream_config(data)
+                return
             
             if message_type != 'chat_message' or not user_message:
                 await self.send(text_data=json.dumps({"type": "error", "message": "Invalid message format."}))
                 return
 
-            #AI 서비스 호출 및 스트리밍
-            stream_generator = self.ai_service.get_ai_response_stream(user_message)
+            # 감정 분석은 answer 문자열이 완성되는 즉시 시작 (explanation 생성 시간과 겹치도록)
+            def start_emotion_analysis(answer_text):
+                nonlocal emotion_task
+                if emotion_task is None:
+                    emotion_task = asyncio.ensure_future(analyze_emotion_async(answer_text))
+
+            #AI 서비스 호출 및 스트리밍 (토큰 예산에 맞춰 자른 서버 측 대화 기록 사용)
+            history = self.history.trimmed()
+            stream_generator = self.ai_service.get_ai_response_stream(
+                user_message, history, on_answer_complete=start_emotion_analysis
+            )
+            self.history.append('user', user_message)
 
             # AI 응답 청크를 조립(저장)하기 위한 변수
             full_ai_response_chunks = []
@@ -100,24 +189,34 @@ class ChatConsumer(AsyncWebsocketConsumer):
             # 사용자 메시지 DB 저장
             await save_message(self.user, user_message, 'user')
             
-            # 스트림 처리
-            async for chunk in stream_generator:
-                await self.send(text_data=json.dumps({
-                    "type": "chat_message",
-                    "message": chunk
-                }))
+            # 스트림 처리 (청크를 모아 시간/크기 기준으로 프레임 병합 전송)
+            coalescer = StreamCoalescer(self.send, self.stream_flush_interval_ms, self.stream_flush_bytes)
+            try:
+                async for chunk in stream_generator:
+                    await coalescer.add(chunk)
 
-                # 서버에 청크 저장 (조립)
-                full_ai_response_chunks.append(chunk)
+                    # 서버에 청크 저장 (조립)
+                    full_ai_response_chunks.append(chunk)
+            finally:
+                # 스트림이 중간에 실패해도 남은 버퍼/타이머 전송을 여기서 끝내,
+                # 오류 경로의 message_complete 뒤에 chat_message 프레임이 도착하지 않도록 함
+                await coalescer.close()
 
             # 스트리밍 완료 후, 모든 청크를 하나의 문자열로 결합
             final_bot_message = "".join(full_ai_response_chunks)
+            self.history.append('assistant', final_bot_message)
 
-            # AI 메시지 DB 저장
-            await save_message(self.user, final_bot_message, 'ai')
+            # answer 완성 신호가 없었던 경우(오류 메시지 등)에는 전체 응답으로 지금 시작
+            start_emotion_analysis(final_bot_message)
 
-            # 최종 응답 텍스트로 감정 분석 (동기 함수이므로 비동기 래퍼 사용)
-            emotion_label = await database_sync_to_async(analyze_emotion)(final_bot_message)
+            # AI 메시지 DB 저장과 (이미 진행 중인) 감정 분석을 함께 기다림
+            # 감정 분석은 AsyncOpenAI로 이벤트 루프에서 직접 await (공유 스레드 직렬화 회피)
+            _, emotion_label = await asyncio.gather(
+                save_message(self.user, final_bot_message, 'ai'),
+                emotion_task,
+            )
+            # 응답 감정/대화 빈도로 호감도 변화량 누적 (주기적으로 일괄 저장)
+            affinity_engine.record(self.user.id, emotion_label)
                 
             # 감정(emotion)이 포함된 응답 완료 신호 전송
             await self.send(text_data=json.dumps({
@@ -125,16 +224,55 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 "emotion": emotion_label  # Flutter가 기다리던값
             }))
 
+            # 대화가 길어졌으면 오래된 턴을 요약으로 접는 작업을 백그라운드로 예약 (응답 경로 밖)
+            self._schedule_summary()
+
             
         except Exception as e:
             error_message = f"AI 처리 오류 발생: {e}"
             print(error_message)
+            if emotion_task is not None and not emotion_task.done():
+                emotion_task.cancel()
             # 오류 발생 시 '슬픔' 감정을 전송
             await self.send(text_data=json.dumps({
                 "type": "message_complete", # 에러 대신 complete를 보내야 Flutter가 대기 상태를 풂
                 "emotion": "슬픔"
             }))
 
+    def _schedule_summary(self):
+        trigger = min(settings.CHAT_SUMMARY_TRIGGER_MESSAGES, settings.CHAT_HISTORY_MAX_MESSAGES)
+        if len(self.history) < trigger:
+            return
+
+        appended_at_schedule = self.history.total_appended
+
+        def on_summary_updated(summary):
+            # 요약 작업 중에 추가된 메시지는 요약에 포함되지 않았으므로 함께 남겨둡니다.
+            self.ai_service.conversation_summary = summary
+            self.history.keep_last(
+                settings.CHAT_SUMMARY_KEEP_RECENT + self.history.total_appended - appended_at_schedule
+            )
+
+        conversation_summarizer.schedule(self.user.id, on_summary_updated)
+
+    async def _apply_stream_config(self, data):
+        """클라이언트가 요청한 프레임 병합 값을 허용 범위 안에서 적용하고, 확정된 값을 응답합니다."""
+        self.stream_flush_interval_ms = _clamp_setting(
+            data.get('flush_interval_ms', self.stream_flush_interval_ms),
+            settings.CHAT_STREAM_FLUSH_INTERVAL_MS_RANGE,
+            self.stream_flush_interval_ms,
+        )
+        self.stream_flush_bytes = _clamp_setting(
+            data.get('flush_bytes', self.stream_flush_bytes),
+            settings.CHAT_STREAM_FLUSH_BYTES_RANGE,
+            self.stream_flush_bytes,
+        )
+        await self.send(text_data=json.dumps({
+            "type": "stream_config",
+            "flush_interval_ms": self.stream_flush_interval_ms,
+            "flush_bytes": self.stream_flush_bytes,
+        }))
+
     # 💡 3. 연결 해제
     async def disconnect(self, close_code):
         """WebSocket 연결이 종료될 때 호출됩니다."""
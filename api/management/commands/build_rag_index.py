@@ -0,0 +1,82 @@
+# app_server/api/management/commands/build_rag_index.py
+# 역할: 지식 문서(.txt/.md 파일 또는 디렉터리)를 잘라 RAG 벡터 인덱스(embeddings.npy/documents.json)를 만듭니다.
+# RAG 인덱스는 모든 사용자의 프롬프트에 공통으로 쓰이므로, 사용자별 기록(UserActivity/ChatMessage)은 넣지 않습니다.
+# 인덱스는 워커가 시작할 때 열리므로, 다시 만든 뒤에는 Daphne 워커를 재시작해야 반영됩니다.
+#   python manage.py build_rag_index docs/knowledge            # 디렉터리 안의 .txt/.md 전체로 다시 만들기
+#   python manage.py build_rag_index extra.md --append         # 기존 인덱스에 추가
+#   python manage.py build_rag_index docs --index-dir /srv/rag # RAG_INDEX_DIR 대신 다른 위치에 만들기
+
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from services.rag_service import RAGService
+
+DOCUMENT_SUFFIXES = ('.txt', '.md')
+
+
+def split_into_chunks(text, max_chars):
+    """빈 줄로 구분된 문단을 max_chars 이하의 조각으로 묶습니다. 긴 문단은 글자 수로 자릅니다."""
+    chunks, current = [], ''
+    for paragraph in (p.strip() for p in text.split('\n\n')):
+        if not paragraph:
+            continue
+        while len(paragraph) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ''
+            chunks.append(paragraph[:max_chars])
+            paragraph = paragraph[max_chars:].strip()
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            chunks.append(current)
+            current = ''
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class Command(BaseCommand):
+    help = "지식 문서 파일로 RAG 벡터 인덱스를 만듭니다."
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="문서 파일 또는 디렉터리 (.txt/.md)")
+        parser.add_argument('--append', action='store_true',
+                            help="기존 인덱스를 지우지 않고 문서를 추가")
+        parser.add_argument('--index-dir', default=None,
+                            help="인덱스 저장 위치 (기본: RAG_INDEX_DIR 또는 rag_index/)")
+        parser.add_argument('--chunk-chars', type=int, default=800)
+
+    def _collect_files(self, paths):
+        files = []
+        for raw in paths:
+            path = Path(raw)
+            if path.is_dir():
+                files.extend(sorted(p for p in path.rglob('*') if p.is_file() and p.suffix in DOCUMENT_SUFFIXES))
+            elif path.is_file():
+                files.append(path)
+            else:
+                raise CommandError(f"No such file or directory: {raw}")
+        return files
+
+    def handle(self, *args, paths=(), append=False, index_dir=None, chunk_chars=800, **options):
+        if chunk_chars <= 0:
+            raise CommandError("--chunk-chars must be positive.")
+
+        files = self._collect_files(paths)
+        chunks = []
+        for path in files:
+            chunks.extend(split_into_chunks(path.read_text(encoding='utf-8'), chunk_chars))
+        if not chunks:
+            raise CommandError("No document text found; the index was left unchanged.")
+
+        rag = RAGService(None, {}, index_dir=index_dir)
+        if append:
+            rag.add_documents(chunks)
+        else:
+            rag.replace_documents(chunks)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {len(chunks)} chunks from {len(files)} files into {rag.index_dir} "
+            f"({len(rag)} documents total)."
+        ))
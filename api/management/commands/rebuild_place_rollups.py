@@ -0,0 +1,49 @@
+# app_server/api/management/commands/rebuild_place_rollups.py
+# 역할: UserActivity 전체로부터 UserPlaceVisitDaily(사용자/장소/날짜별 방문 집계)를 다시 만듭니다.
+# bulk_create/update()처럼 시그널을 거치지 않는 방식으로 활동 기록을 바꾼 뒤나, 집계가 어긋났을 때 실행합니다.
+#   python manage.py rebuild_place_rollups            # 전체 사용자
+#   python manage.py rebuild_place_rollups --user 3   # 특정 사용자만
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import Trim
+
+from api.models import UserActivity, UserPlaceVisitDaily
+
+
+class Command(BaseCommand):
+    help = "UserActivity 기록으로 장소 방문 집계(UserPlaceVisitDaily)를 다시 만듭니다."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids',
+                            help="이 사용자 id만 다시 집계 (여러 번 지정 가능)")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, user_ids=None, batch_size=1000, **options):
+        activities = UserActivity.objects.all()
+        rollups = UserPlaceVisitDaily.objects.all()
+        if user_ids:
+            activities = activities.filter(user_id__in=user_ids)
+            rollups = rollups.filter(user_id__in=user_ids)
+
+        rows = (
+            activities.annotate(place_key=Trim('place')).exclude(place_key='')
+            .values('user_id', 'place_key', 'activity_date').annotate(visits=Count('id')).order_by()
+        )
+
+        # 재집계 중에 읽는 쪽이 빈 집계를 보지 않도록 삭제와 생성을 한 트랜잭션으로 처리
+        with transaction.atomic():
+            deleted, _ = rollups.delete()
+            created = UserPlaceVisitDaily.objects.bulk_create(
+                [
+                    UserPlaceVisitDaily(user_id=row['user_id'], place=row['place_key'],
+                                        visit_date=row['activity_date'], visit_count=row['visits'])
+                    for row in rows.iterator()
+                ],
+                batch_size=batch_size,
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt place rollups: removed {deleted} rows, created {len(created)} rows."
+        ))
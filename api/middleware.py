@@ -0,0 +1,126 @@
+# app_server/api/middleware.py
+# 역할: WebSocket 연결용 JWT 인증 미들웨어입니다.
+# - 쿼리 스트링의 token= 값을 검증하고 scope['user']에 사용자(ai_profile 포함)를 넣습니다.
+# - 사용자+프로필 스냅샷(최소 필드)을 user_id별로 Django 캐시(L1+Redis)에 TTL 동안 보관하므로,
+#   배포/네트워크 끊김 후 재연결이 몰려도 소켓마다 DB 조회를 하지 않습니다.
+# - User/Profile이 저장되면 post_save 시그널로 캐시를 지웁니다 (다른 프로세스의 L1은 pub/sub으로 무효화).
+# 세션을 쓰지 않으므로 AuthMiddlewareStack의 세션 테이블 조회도 하지 않습니다.
+
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import AccessToken
+from services.user_snapshot import invalidate_user_snapshot, ws_user_cache_key
+from user_profile_app.models import Profile
+
+User = get_user_model()
+
+
+def _load_user_snapshot(user_id):
+    """
+    DB에서 사용자+프로필을 읽어 캐시에 넣을 최소 필드만 dict로 반환합니다. 없으면 None.
+    비밀번호 해시 등 나머지 필드는 공유 캐시(Redis)에 올리지 않습니다.
+    """
+    user = User.objects.select_related('ai_profile').filter(pk=user_id).first()
+    if user is None:
+        return None
+
+    profile = getattr(user, 'ai_profile', None)
+    return {
+        'id': user.pk,
+        'username': user.get_username(),
+        'is_active': user.is_active,
+        'profile': None if profile is None else {
+            'id': profile.pk,
+            'affinity_score': profile.affinity_score,
+            'preferred_style': profile.preferred_style,
+        },
+    }
+
+
+def _build_user(snapshot):
+    """스냅샷으로 저장되지 않은 User/Profile 인스턴스를 만듭니다. (ai_profile 접근 시 추가 쿼리 없음)"""
+    user = User(id=snapshot['id'], username=snapshot['username'], is_active=snapshot['is_active'])
+    profile = snapshot['profile']
+    if profile is None:
+        # 프로필이 없다는 사실도 캐시해 두어, ai_profile 접근이 DB 조회 대신 RelatedObjectDoesNotExist를 냄
+        User.ai_profile.related.set_cached_value(user, None)
+    else:
+        user.ai_profile = Profile(user_id=user.pk, **profile)
+    return user
+
+
+async def get_user_snapshot(user_id):
+    """
+    user_id의 User(ai_profile 포함) 스냅샷을 반환합니다. 없으면 None.
+    캐시에는 최소 필드만 담긴 dict를 두고, 연결마다 새 인스턴스를 만들어 돌려줍니다 (한 연결의 수정이 다른 연결에 보이지 않음).
+    """
+    key = ws_user_cache_key(user_id)
+    snapshot = await cache.aget(key)
+    if snapshot is None:
+        # Channels 인증 미들웨어와 같이 database_sync_to_async로 조회해야 요청 사이클 밖에서도
+        # 작업 후 오래되었거나 끊긴 DB 연결이 정리됨 (CONN_MAX_AGE 사용 시 연결 누수 방지)
+        snapshot = await database_sync_to_async(_load_user_snapshot)(user_id)
+        if snapshot is None:
+            return None
+        await cache.aset(key, snapshot, settings.WS_USER_CACHE_TTL)
+    return _build_user(snapshot)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def _invalidate_user_on_change(sender, instance, **kwargs):
+    invalidate_user_snapshot(instance.pk)
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def _invalidate_profile_on_change(sender, instance, **kwargs):
+    invalidate_user_snapshot(instance.user_id)
+
+
+def _token_from_scope(scope):
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    values = query.get('token')
+    return values[0] if values else None
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    ws://.../ws/chat/?token=<access token>
+    인증에 실패하면 scope['user']는 AnonymousUser이고, 이유는 scope['auth_error']에 남습니다.
+    """
+    async def __call__(self, scope, receive, send):
+        # 상위 scope에 영향을 주지 않도록 복사
+        scope = dict(scope)
+        scope['user'], scope['auth_error'] = await self.authenticate(scope)
+        return await super().__call__(scope, receive, send)
+
+    async def authenticate(self, scope):
+        token = _token_from_scope(scope)
+        if not token:
+            return AnonymousUser(), "토큰 쿼리 파라미터가 누락되었습니다."
+
+        try:
+            user_id = AccessToken(token)['user_id']
+        except (TokenError, KeyError) as e:
+            return AnonymousUser(), f"유효하지 않은 토큰: {e}"
+
+        user = await get_user_snapshot(user_id)
+        if user is None:
+            return AnonymousUser(), "사용자를 찾을 수 없습니다."
+        if not user.is_active:
+            return AnonymousUser(), "비활성화된 사용자"
+        return user, None
+
+
+def JWTAuthMiddlewareStack(inner):
+    return JWTAuthMiddleware(inner)
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-17 00:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_conversationsummary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['user', 'timestamp', 'id'], name='chatmsg_user_ts_id_idx'),
+        ),
+    ]
@@ -0,0 +1,91 @@
+# Generated by Django 5.2.7 on 2026-10-17 00:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# 기억 검색 색인 (services/memory_search.py 참고)
+# - SQLite: search_tokens를 담는 FTS5 외부 콘텐츠 테이블 + 동기화 트리거
+# - PostgreSQL: to_tsvector('simple', search_tokens) GIN 인덱스
+# 그 밖의 DB(또는 FTS5가 없는 SQLite)에서는 아무것도 만들지 않고 검색 시 LIKE로 대체합니다.
+# ⚠️ SQLite에서 이후 마이그레이션이 api_useractivity 테이블을 재생성하면 트리거가 사라지므로,
+#    그런 마이그레이션 뒤에는 이 트리거를 다시 만들고 memory_search.rebuild_search_index()를 실행해야 합니다.
+SQLITE_FTS_SQL = [
+    "CREATE VIRTUAL TABLE api_useractivity_fts USING fts5("
+    "search_tokens, content='api_useractivity', content_rowid='id')",
+    "CREATE TRIGGER api_useractivity_fts_ai AFTER INSERT ON api_useractivity BEGIN "
+    "INSERT INTO api_useractivity_fts(rowid, search_tokens) VALUES (new.id, new.search_tokens); END",
+    "CREATE TRIGGER api_useractivity_fts_ad AFTER DELETE ON api_useractivity BEGIN "
+    "INSERT INTO api_useractivity_fts(api_useractivity_fts, rowid, search_tokens) "
+    "VALUES ('delete', old.id, old.search_tokens); END",
+    "CREATE TRIGGER api_useractivity_fts_au AFTER UPDATE ON api_useractivity BEGIN "
+    "INSERT INTO api_useractivity_fts(api_useractivity_fts, rowid, search_tokens) "
+    "VALUES ('delete', old.id, old.search_tokens); "
+    "INSERT INTO api_useractivity_fts(rowid, search_tokens) VALUES (new.id, new.search_tokens); END",
+]
+SQLITE_FTS_DROP_SQL = [
+    "DROP TRIGGER IF EXISTS api_useractivity_fts_ai",
+    "DROP TRIGGER IF EXISTS api_useractivity_fts_ad",
+    "DROP TRIGGER IF EXISTS api_useractivity_fts_au",
+    "DROP TABLE IF EXISTS api_useractivity_fts",
+]
+POSTGRES_GIN_SQL = [
+    "CREATE INDEX activity_search_gin_idx ON api_useractivity "
+    "USING gin (to_tsvector('simple', search_tokens))",
+]
+POSTGRES_GIN_DROP_SQL = ["DROP INDEX IF EXISTS activity_search_gin_idx"]
+
+
+def _execute(schema_editor, statements):
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        _execute(schema_editor, POSTGRES_GIN_SQL)
+    elif vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+            fts5_available = bool(cursor.fetchone()[0])
+        if fts5_available:
+            _execute(schema_editor, SQLITE_FTS_SQL)
+        else:
+            print("\n  SQLite was built without FTS5; memory search will fall back to LIKE queries.")
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        _execute(schema_editor, POSTGRES_GIN_DROP_SQL)
+    elif vendor == 'sqlite':
+        _execute(schema_editor, SQLITE_FTS_DROP_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_chatmessage_user_timestamp_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('activity_date', models.DateField(blank=True, null=True)),
+                ('place', models.CharField(blank=True, default='', max_length=255)),
+                ('companion', models.CharField(blank=True, default='', max_length=255)),
+                ('memo', models.TextField(blank=True, default='')),
+                ('search_tokens', models.TextField(blank=True, default='', editable=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activities', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'activity_date'], name='activity_user_date_idx')],
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.7 on 2026-10-17 00:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Trim
+
+
+def backfill_place_rollups(apps, schema_editor):
+    # 이미 저장된 활동 기록으로 방문 집계를 채움 (이후에는 UserActivity 저장/삭제 시 증분 갱신)
+    UserActivity = apps.get_model('api', 'UserActivity')
+    UserPlaceVisitDaily = apps.get_model('api', 'UserPlaceVisitDaily')
+    rows = (
+        UserActivity.objects.annotate(place_key=Trim('place')).exclude(place_key='')
+        .values('user_id', 'place_key', 'activity_date').annotate(visits=Count('id')).order_by()
+    )
+    UserPlaceVisitDaily.objects.bulk_create(
+        [
+            UserPlaceVisitDaily(user_id=row['user_id'], place=row['place_key'],
+                                visit_date=row['activity_date'], visit_count=row['visits'])
+            for row in rows.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_useractivity'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserPlaceVisitDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('place', models.CharField(max_length=255)),
+                ('visit_date', models.DateField(blank=True, null=True)),
+                ('visit_count', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='place_visit_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'visit_date'], name='place_visit_user_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'place', 'visit_date'), name='place_visit_daily_uniq')],
+            },
+        ),
+        migrations.RunPython(backfill_place_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-17 03:10
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_undated_duplicates(apps, schema_editor):
+    # 제약을 추가하기 전에, 동시 생성으로 중복된 날짜 미상 행을 하나로 합침
+    UserPlaceVisitDaily = apps.get_model('api', 'UserPlaceVisitDaily')
+    duplicates = (
+        UserPlaceVisitDaily.objects.filter(visit_date__isnull=True)
+        .values('user_id', 'place').annotate(rows=Count('id'), keep_id=Min('id'), visits=Sum('visit_count'))
+        .filter(rows__gt=1).order_by()
+    )
+    for row in duplicates.iterator():
+        group = UserPlaceVisitDaily.objects.filter(user_id=row['user_id'], place=row['place'], visit_date__isnull=True)
+        group.exclude(pk=row['keep_id']).delete()
+        group.filter(pk=row['keep_id']).update(visit_count=row['visits'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_userplacevisitdaily'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_undated_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='userplacevisitdaily',
+            constraint=models.UniqueConstraint(condition=models.Q(('visit_date__isnull', True)), fields=('user', 'place'), name='place_visit_undated_uniq'),
+        ),
+    ]
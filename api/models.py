@@ -1,6 +1,12 @@
 # app_server/api/models.py
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from services.search_tokenizer import build_search_tokens
 
 User = get_user_model()
 
@@ -19,7 +25,131 @@ class ChatMessage(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField()
     sender = models.CharField(max_length=10, choices=[('user', 'User'), ('ai', 'AI')])
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # 저장 시각이 아니라 객체 생성(write-behind 큐에 넣은) 시각. 재시도로 늦게 저장되어도 대화 순서가 유지됨
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            # 사용자별 최신순 조회 / 키셋(cursor) 페이지네이션용 복합 인덱스
+            models.Index(fields=['user', 'timestamp', 'id'], name='chatmsg_user_ts_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username}: {self.content[:30]}"
+
+
+class ConversationSummary(models.Model):
+    # 오래된 대화를 접어 넣은 사용자별 누적(rolling) 요약
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='conversation_summary')
+    summary = models.TextField(blank=True, default='')
+    # 요약에 반영된 마지막 ChatMessage id (이 id 이하의 메시지는 요약에 포함되어 있음)
+    last_message_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username} 요약 (~#{self.last_message_id})"
+
+
+class UserActivity(models.Model):
+    # 사용자의 활동 기록(기억): 언제, 어디서, 누구와, 무엇을
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='activities')
+    activity_date = models.DateField(null=True, blank=True)
+    place = models.CharField(max_length=255, blank=True, default='')
+    companion = models.CharField(max_length=255, blank=True, default='')
+    memo = models.TextField(blank=True, default='')
+    # 검색용 문자 bigram 문서 (place/companion/memo로 save() 시 자동 생성, FTS5/GIN 색인 대상)
+    # ⚠️ bulk_create/update()는 save()와 시그널을 거치지 않으므로 search_tokens를 직접 채우고,
+    #    장소 방문 집계는 rebuild_place_rollups 명령으로 다시 만들어야 합니다.
+    search_tokens = models.TextField(blank=True, default='', editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # 사용자별 최근 활동 조회 / 기간 필터용
+            models.Index(fields=['user', 'activity_date'], name='activity_user_date_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 저장/삭제 시 이전 (장소, 날짜)의 방문 집계를 되돌리기 위해 기억
+        instance._rollup_key = instance.rollup_key()
+        return instance
+
+    def rollup_key(self):
+        return (self.place or '').strip(), self.activity_date
+
+    def save(self, *args, **kwargs):
+        self.search_tokens = build_search_tokens(self.place, self.companion, self.memo)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'place', 'companion', 'memo'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'search_tokens'}
+        # 활동 저장과 post_save의 방문 집계 갱신을 한 트랜잭션으로 묶음
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.user.username}: {self.activity_date} {self.place}"
+
+
+class UserPlaceVisitDaily(models.Model):
+    # 사용자/장소/날짜별 방문 횟수 집계 (UserActivity 저장/삭제 시 증분 갱신)
+    # 장소 선호도/추천이 전체 활동 기록 대신 이 작은 테이블만 읽도록 합니다.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='place_visit_rollups')
+    place = models.CharField(max_length=255)
+    # 날짜 미상 활동은 NULL (기간 필터에는 포함되지 않음)
+    visit_date = models.DateField(null=True, blank=True)
+    visit_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'place', 'visit_date'], name='place_visit_daily_uniq'),
+            # NULL은 서로 다른 값으로 취급되어 위 제약이 날짜 미상 행에는 걸리지 않으므로 부분 유니크 인덱스로 보완
+            # (nulls_distinct=False는 PostgreSQL 15+에서만 지원되어 SQLite에서는 무시됨)
+            models.UniqueConstraint(fields=['user', 'place'], condition=models.Q(visit_date__isnull=True),
+                                    name='place_visit_undated_uniq'),
+        ]
+        indexes = [
+            # 최근 N일 방문 집계용
+            models.Index(fields=['user', 'visit_date'], name='place_visit_user_date_idx'),
+        ]
+
+    @classmethod
+    def add_visits(cls, user_id, place: str, visit_date, delta: int):
+        """(user, place, visit_date) 행의 방문 횟수를 delta만큼 원자적으로 바꾸고, 0 이하가 된 행은 지웁니다."""
+        if not place or not delta:
+            return
+        rows = cls.objects.filter(user_id=user_id, place=place, visit_date=visit_date)
+        with transaction.atomic():
+            if delta > 0 and not rows.update(visit_count=F('visit_count') + delta):
+                # 처음 방문한 (장소, 날짜): 동시에 다른 요청이 먼저 만들었으면 증가로 대체
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(user_id=user_id, place=place, visit_date=visit_date, visit_count=delta)
+                except IntegrityError:
+                    rows.update(visit_count=F('visit_count') + delta)
+            elif delta < 0:
+                # 먼저 지울 행을 지우고 나머지를 줄여야, 줄어든 행이 다시 삭제 대상이 되지 않음
+                rows.filter(visit_count__lte=-delta).delete()
+                rows.update(visit_count=F('visit_count') + delta)
+
+    def __str__(self):
+        return f"{self.user.username}: {self.place} {self.visit_date} x{self.visit_count}"
+
+
+@receiver(post_save, sender=UserActivity)
+def _update_place_rollup_on_save(sender, instance, created, **kwargs):
+    old_key = None if created else getattr(instance, '_rollup_key', None)
+    new_key = instance.rollup_key()
+    if old_key == new_key:
+        return
+    if old_key is not None:
+        UserPlaceVisitDaily.add_visits(instance.user_id, *old_key, -1)
+    UserPlaceVisitDaily.add_visits(instance.user_id, *new_key, 1)
+    instance._rollup_key = new_key
+
+
+@receiver(post_delete, sender=UserActivity)
+def _update_place_rollup_on_delete(sender, instance, **kwargs):
+    key = getattr(instance, '_rollup_key', None) or instance.rollup_key()
+    UserPlaceVisitDaily.add_visits(instance.user_id, *key, -1)
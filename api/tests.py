@@ -0,0 +1,636 @@
+# app_server/api/tests.py
+# 실행: python manage.py test api
+
+import asyncio
+import io
+import json
+import tempfile
+import time
+import uuid
+from contextlib import redirect_stdout
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, transaction
+from django.db import OperationalError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from app_server.cache_backends import TwoTierCache
+from api.middleware import get_user_snapshot, invalidate_user_snapshot, ws_user_cache_key
+from api.models import ChatMessage, ConversationSummary, UserPlaceVisitDaily
+from services.affinity_service import AffinityEngine
+from services.ai_persona_service import StreamingAnswerParser
+from services.emotion_service import EmotionAnalyzer
+from services.llm_client import llm_clients
+from services.llm_scheduler import PRIORITY_CHAT, PRIORITY_EMOTION, PRIORITY_PROACTIVE, LLMScheduler
+from services.message_store import ChatMessageWriteBehind
+from services.rag_service import RAGService
+from services.summary_service import ConversationSummarizer, load_summary
+from user_profile_app.models import Profile
+
+User = get_user_model()
+
+
+def _feed_in_chunks(parser, text, size):
+    """text를 size 글자씩 잘라 파서에 넣고, 스트리밍된 answer 조각을 이어 붙여 반환합니다."""
+    return "".join(parser.feed(text[i:i + size]) for i in range(0, len(text), size))
+
+
+class StreamingAnswerParserTests(SimpleTestCase):
+
+    def test_answer_streams_before_explanation(self):
+        parser = StreamingAnswerParser()
+        self.assertEqual(parser.feed('{"answer": "안녕'), "안녕")
+        self.assertTrue(parser.answer_started)
+        self.assertFalse(parser.answer_complete)
+        self.assertEqual(parser.feed('하세요", "explan'), "하세요")
+        self.assertTrue(parser.answer_complete)
+        parser.feed('ation": "인사"}')
+        self.assertEqual(parser.answer, "안녕하세요")
+        self.assertEqual(parser.explanation, "인사")
+
+    def test_escapes_split_across_chunks(self):
+        answer = '따옴표 " 역슬래시 \\ 슬래시 / 줄바꿈\n탭\t끝'
+        payload = json.dumps({"answer": answer, "explanation": "x"}, ensure_ascii=False)
+        # 1글자 단위로 잘라 모든 이스케이프가 청크 경계에 걸리도록 함
+        for size in (1, 2, 3, 7):
+            with self.subTest(chunk_size=size):
+                parser = StreamingAnswerParser()
+                self.assertEqual(_feed_in_chunks(parser, payload, size), answer)
+                self.assertEqual(parser.answer, answer)
+
+    def test_unicode_escapes_and_surrogate_pairs_split_across_chunks(self):
+        answer = "웃음 😀 하트 ❤ 끝"
+        # ensure_ascii=True: 한글은 \uXXXX, 이모지는 😀 서로게이트 쌍으로 인코딩됨
+        payload = json.dumps({"answer": answer, "explanation": "😀"})
+        self.assertIn("\\ud83d\\ude00", payload)
+        for size in (1, 3, 5, 6, 13):
+            with self.subTest(chunk_size=size):
+                parser = StreamingAnswerParser()
+                self.assertEqual(_feed_in_chunks(parser, payload, size), answer)
+                self.assertEqual(parser.explanation, "😀")
+
+    def test_escaped_key_and_prefix_text(self):
+        parser = StreamingAnswerParser()
+        streamed = _feed_in_chunks(parser, '```json\n{"\\u0061nswer": "ok"}```', 4)
+        self.assertEqual(streamed, "ok")
+        self.assertTrue(parser.answer_complete)
+
+    def test_missing_answer_field(self):
+        parser = StreamingAnswerParser()
+        payload = '{"explanation": "설명만", "extra": {"nested": ["}", "\\"", 1]}, "n": 3}'
+        self.assertEqual(_feed_in_chunks(parser, payload, 2), "")
+        self.assertFalse(parser.answer_started)
+        self.assertFalse(parser.answer_complete)
+        self.assertEqual(parser.answer, "")
+        self.assertEqual(parser.explanation, "설명만")
+        # 스트림에서 answer를 찾지 못하면 raw_text로 기존 복구 경로를 탐
+        self.assertEqual(parser.raw_text, payload)
+
+    def test_answer_after_skipped_values(self):
+        parser = StreamingAnswerParser()
+        payload = '{"meta": {"a": [1, {"b": "]"}]}, "score": 0.5, "answer": "뒤에 옴"}'
+        self.assertEqual(_feed_in_chunks(parser, payload, 3), "뒤에 옴")
+
+
+class ChatHistoryViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('history', 'h@example.com', 'pw12345!!')
+        other = User.objects.create_user('other', 'o@example.com', 'pw12345!!')
+        self.messages = [
+            ChatMessage.objects.create(user=self.user, content=f"메시지 {i}", sender='user' if i % 2 else 'ai')
+            for i in range(5)
+        ]
+        ChatMessage.objects.create(user=other, content="다른 사용자", sender='user')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+
+    def _get(self, **params):
+        return self.client.get('/api/chat/history/', params)
+
+    def test_cursor_paging_walks_all_messages_newest_first(self):
+        pages = []
+        cursor = None
+        while True:
+            params = {'limit': 2}
+            if cursor:
+                params['cursor'] = cursor
+            response = self._get(**params)
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            pages.append([message['id'] for message in body['messages']])
+            cursor = body['next_cursor']
+            self.assertEqual(body['has_more'], cursor is not None)
+            if not cursor:
+                break
+
+        ids = [message.id for message in self.messages]
+        # 페이지는 최신 페이지부터, 페이지 안에서는 오래된 순
+        self.assertEqual(pages, [ids[3:5], ids[1:3], ids[0:1]])
+
+    def test_invalid_cursor_returns_400(self):
+        for cursor in ('not-a-cursor', 'W10', 'WyJ4IiwgMV0'):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self._get(cursor=cursor).status_code, 400)
+
+    def test_matching_if_none_match_returns_304(self):
+        first = self._get(limit=3)
+        etag = first['ETag']
+        self.assertTrue(etag)
+
+        cached = self.client.get('/api/chat/history/', {'limit': 3}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached['ETag'], etag)
+
+        # 새 메시지가 생기면 첫 페이지의 ETag가 바뀜
+        ChatMessage.objects.create(user=self.user, content="새 메시지", sender='user')
+        changed = self.client.get('/api/chat/history/', {'limit': 3}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], etag)
+
+    def test_requires_authentication(self):
+        self.client.credentials()
+        self.assertEqual(self._get().status_code, 401)
+
+
+class UserSnapshotTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('snap', 's@example.com', 'pw12345!!')
+        # 프로필은 사용자 생성 시그널로 만들어짐
+        Profile.objects.filter(user=self.user).update(affinity_score=42, preferred_style='formal')
+        invalidate_user_snapshot(self.user.pk)
+
+    async def test_snapshot_caches_minimal_fields_and_rebuilds_profile(self):
+        user = await get_user_snapshot(self.user.pk)
+        self.assertEqual((user.pk, user.username, user.is_active), (self.user.pk, 'snap', True))
+        self.assertEqual(user.ai_profile.affinity_score, 42)
+        self.assertEqual(user.ai_profile.preferred_style, 'formal')
+
+        cached = await cache.aget(ws_user_cache_key(self.user.pk))
+        self.assertNotIn('password', repr(cached))
+        self.assertNotIn(self.user.password, repr(cached))
+
+        # 캐시 적중 시에도 연결마다 독립된 인스턴스
+        again = await get_user_snapshot(self.user.pk)
+        again.ai_profile.affinity_score = 0
+        self.assertEqual((await get_user_snapshot(self.user.pk)).ai_profile.affinity_score, 42)
+
+    def test_cache_errors_do_not_break_user_saves(self):
+        with mock.patch.object(cache, 'delete', side_effect=ConnectionError("redis down")), \
+                redirect_stdout(io.StringIO()) as output:
+            user = User.objects.create_user('outage', 'out@example.com', 'pw12345!!')
+            Profile.objects.filter(user=user).update(affinity_score=1)
+            user.ai_profile.save()
+        self.assertIn("Failed to invalidate WS user snapshot", output.getvalue())
+
+    async def test_missing_profile_and_missing_user(self):
+        await Profile.objects.filter(user_id=self.user.pk).adelete()
+        user = await get_user_snapshot(self.user.pk)
+        self.assertIsNone(getattr(user, 'ai_profile', None))
+        self.assertIsNone(await get_user_snapshot(self.user.pk + 1000))
+
+
+class UserPlaceVisitDailyTests(TestCase):
+
+    def test_undated_visits_share_one_row(self):
+        user = User.objects.create_user('visits', 'v@example.com', 'pw12345!!')
+        UserPlaceVisitDaily.add_visits(user.pk, '카페', None, 1)
+        UserPlaceVisitDaily.add_visits(user.pk, '카페', None, 2)
+        self.assertEqual(
+            list(UserPlaceVisitDaily.objects.filter(user=user).values_list('visit_date', 'visit_count')),
+            [(None, 3)],
+        )
+        # 날짜가 NULL이어도 (user, place) 중복 행은 제약으로 막힘
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            UserPlaceVisitDaily.objects.create(user=user, place='카페', visit_date=None, visit_count=1)
+
+
+class TwoTierCacheTests(SimpleTestCase):
+
+    def _make_cache(self, location):
+        # 테스트마다 별도 채널을 써서 프로세스 전역 L1/카운터를 공유하지 않게 함
+        params = {"OPTIONS": {"L1_TTL": 60, "INVALIDATION_CHANNEL": f"test:{uuid.uuid4().hex}"}}
+        cache_instance = TwoTierCache(location, params)
+        patcher = mock.patch.object(TwoTierCache, "_ensure_listener")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return cache_instance
+
+    def test_l2_outage_degrades_to_l1(self):
+        # 아무도 듣지 않는 포트: 모든 Redis 호출이 연결 오류로 실패
+        down = self._make_cache("redis://127.0.0.1:1/0")
+        with redirect_stdout(io.StringIO()):
+            down.set("k", 1)
+            self.assertEqual(down.get("k"), 1)
+            self.assertTrue(down.has_key("k"))
+            self.assertFalse(down.has_key("missing"))
+            self.assertTrue(down.touch("k", 30))
+            self.assertEqual(down.incr("k"), 2)
+            self.assertTrue(down.add("lock", "a"))
+            self.assertFalse(down.add("lock", "b"))
+            down.delete("k")
+            self.assertIsNone(down.get("k"))
+            down.clear()
+            self.assertIsNone(down.get("lock"))
+
+            async def async_ops():
+                await down.aset("ak", "v")
+                added = await down.aadd("ak", "other")
+                value = await down.aget("ak")
+                await down.adelete("ak")
+                return added, value, await down.aget("ak")
+
+            self.assertEqual(asyncio.run(async_ops()), (False, "v", None))
+        self.assertGreater(down.stats()["l2"]["errors"], 0)
+
+    def test_invalidation_from_other_process_drops_l1_copy(self):
+        local = self._make_cache("")
+        local.set("k", "v")
+        full_key = local.make_and_validate_key("k")
+
+        # 자신이 보낸 메시지는 무시
+        local._on_invalidation(f"{local._tier.origin}:{full_key}".encode())
+        self.assertEqual(local.get("k"), "v")
+
+        local._on_invalidation(f"other-origin:{full_key}".encode())
+        self.assertIsNone(local.get("k"))
+        self.assertEqual(local.stats()["invalidations_received"], 1)
+
+    def test_l1_only_add_is_check_and_set(self):
+        local = self._make_cache("")
+        self.assertTrue(local.add("k", 1))
+        self.assertFalse(local.add("k", 2))
+        self.assertEqual(local.get("k"), 1)
+
+
+class AffinityEngineTests(TransactionTestCase):
+    # flush()는 별도 스레드의 DB 연결로 저장하므로 트랜잭션으로 감싸지 않는 TransactionTestCase 사용
+
+    def setUp(self):
+        self.user = User.objects.create_user('affinity', 'a@example.com', 'pw12345!!')
+        Profile.objects.filter(user=self.user).update(affinity_score=10)
+        self.engine = AffinityEngine(flush_interval_seconds=3600, messages_per_bonus=1000,
+                                     max_delta_per_flush=5, bonus_idle_seconds=3600)
+
+    async def _score(self):
+        return await Profile.objects.filter(user=self.user).values_list('affinity_score', flat=True).aget()
+
+    async def test_delta_above_cap_is_carried_to_next_flush(self):
+        for _ in range(6):
+            self.engine.record(self.user.pk, "행복")   # +12
+
+        scores = []
+        for _ in range(3):
+            await self.engine.flush()
+            scores.append(await self._score())
+        self.assertEqual(scores, [15, 20, 22])
+        self.assertEqual(dict(self.engine._pending), {})
+
+    async def test_db_failure_restores_deltas(self):
+        real_write = self.engine._write
+        calls = []
+
+        def failing_once(deltas):
+            calls.append(deltas)
+            if len(calls) == 1:
+                raise OperationalError("db down")
+            return real_write(deltas)
+
+        with mock.patch.object(self.engine, '_write', side_effect=failing_once), \
+                redirect_stdout(io.StringIO()):
+            self.engine.record(self.user.pk, "놀람")
+            await self.engine.flush()
+            self.assertEqual(dict(self.engine._pending), {self.user.pk: 1})
+            self.assertEqual(await self._score(), 10)
+
+            await self.engine.flush()
+        self.assertEqual(await self._score(), 11)
+        self.assertEqual(self.engine.stats["failed_flushes"], 1)
+
+    async def test_cache_failure_after_commit_does_not_reapply(self):
+        with mock.patch('services.affinity_service.invalidate_user_snapshot',
+                        side_effect=ConnectionError("redis down")), redirect_stdout(io.StringIO()):
+            self.engine.record(self.user.pk, "행복")
+            await self.engine.flush()
+            await self.engine.flush()
+        self.assertEqual(await self._score(), 12)
+        self.assertEqual(dict(self.engine._pending), {})
+
+    def test_bonus_counter_is_reset_and_idle_users_evicted(self):
+        engine = AffinityEngine(flush_interval_seconds=3600, messages_per_bonus=3,
+                                max_delta_per_flush=5, bonus_idle_seconds=0)
+
+        async def record_turns():
+            for _ in range(3):
+                engine.record(1, "중립")
+            engine.record(2, "중립")
+
+        asyncio.run(record_turns())
+        self.assertEqual(dict(engine._pending), {1: 1})
+        self.assertEqual(list(engine._message_counts), [2])
+        engine._take_pending()
+        self.assertEqual(engine._message_counts, {})
+
+
+class _FakeCompletions:
+    def __init__(self):
+        self.prompts = []
+
+    async def create(self, messages, **kwargs):
+        self.prompts.append(messages[-1]["content"])
+        reply = mock.Mock()
+        reply.choices = [mock.Mock(message=mock.Mock(content=f"요약 {len(self.prompts)}"))]
+        reply.usage = None
+        return reply
+
+
+class ConversationSummarizerTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('summary', 's@example.com', 'pw12345!!')
+        self.messages = ChatMessage.objects.bulk_create(
+            ChatMessage(user=self.user, content=f"메시지 {i}", sender='user') for i in range(30)
+        )
+        self.completions = _FakeCompletions()
+        client = mock.Mock()
+        client.chat.completions = self.completions
+        patcher = mock.patch('services.summary_service.get_async_client', return_value=client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _summarizer(self, **overrides):
+        options = dict(trigger_messages=12, keep_recent=4, model="test", max_tokens=50,
+                       batch_messages=10, input_token_budget=10000)
+        options.update(overrides)
+        return ConversationSummarizer(**options)
+
+    def test_long_backlog_is_folded_in_bounded_passes(self):
+        with redirect_stdout(io.StringIO()):
+            summary = asyncio.run(self._summarizer().update(self.user.pk))
+
+        self.assertEqual(summary, "요약 3")
+        # 10 + 10 + 6개를 차례로 접고, 최근 4개는 남김
+        self.assertEqual([prompt.count("메시지 ") for prompt in self.completions.prompts], [10, 10, 6])
+        self.assertIn("요약 2", self.completions.prompts[2])
+        self.assertEqual(load_summary(self.user.pk), ("요약 3", self.messages[-5].id))
+
+    def test_token_budget_limits_each_pass(self):
+        with redirect_stdout(io.StringIO()):
+            asyncio.run(self._summarizer(batch_messages=100, input_token_budget=40).update(self.user.pk))
+        folded = [prompt.count("메시지 ") for prompt in self.completions.prompts]
+        self.assertTrue(all(count < 26 for count in folded))
+        self.assertEqual(sum(folded), 26)
+
+    def test_below_trigger_does_nothing(self):
+        ChatMessage.objects.filter(id__gt=self.messages[5].id).delete()
+        self.assertIsNone(asyncio.run(self._summarizer().update(self.user.pk)))
+        self.assertFalse(ConversationSummary.objects.exists())
+
+
+class ChatMessageWriteBehindTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('writer', 'w@example.com', 'pw12345!!')
+        self.other = User.objects.create_user('writer2', 'w2@example.com', 'pw12345!!')
+        # 타이머가 테스트 도중 flush하지 않도록 간격을 길게 두고 flush()를 직접 호출
+        self.store = ChatMessageWriteBehind(flush_interval_ms=60000, flush_rows=100, max_attempts=3)
+        self.failures = {}
+        real_write = self.store._write
+
+        def write(rows):
+            for row in rows:
+                if self.failures.get(row.content, 0):
+                    self.failures[row.content] -= 1
+                    raise OperationalError(f"cannot write {row.content}")
+            real_write(rows)
+
+        self.store._write = write
+
+    def _contents(self, **filters):
+        return list(ChatMessage.objects.filter(**filters).order_by('-timestamp', '-id').values_list('content', flat=True))
+
+    def test_failing_row_is_isolated_retried_and_dropped(self):
+        self.failures['bad'] = 99
+
+        async def scenario():
+            for content in ('a', 'b', 'bad', 'c', 'd'):
+                await self.store.enqueue(self.user, content, 'user')
+            for _ in range(3):
+                await self.store.flush()
+
+        with redirect_stdout(io.StringIO()) as output:
+            asyncio.run(scenario())
+        self.assertEqual(self._contents(), ['d', 'c', 'b', 'a'])
+        self.assertEqual(self.store._pending, [])
+        self.assertEqual(self.store.stats['dropped_rows'], 1)
+        self.assertIn("dropping row after 3 failed attempts", output.getvalue())
+
+    def test_durable_waiter_sees_only_its_own_failure(self):
+        # 전체 배치 1회 + 분할 후 단건 1회 실패
+        self.failures['bad'] = 2
+
+        async def scenario():
+            good = asyncio.ensure_future(self.store.enqueue(self.user, 'good', 'user', durable=True))
+            bad = asyncio.ensure_future(self.store.enqueue(self.user, 'bad', 'user', durable=True))
+            await asyncio.sleep(0)
+            await self.store.flush()
+            return await asyncio.gather(good, bad, return_exceptions=True)
+
+        with redirect_stdout(io.StringIO()):
+            good, bad = asyncio.run(scenario())
+        self.assertIsNone(good)
+        self.assertIsInstance(bad, OperationalError)
+        self.assertEqual(self._contents(), ['good'])
+
+    def test_retried_row_keeps_enqueue_order(self):
+        self.failures['first'] = 1
+
+        async def scenario():
+            await self.store.enqueue(self.user, 'first', 'user')
+            await self.store.flush()
+            await self.store.enqueue(self.user, 'second', 'ai')
+            await self.store.flush()
+
+        with redirect_stdout(io.StringIO()):
+            asyncio.run(scenario())
+        # 'first'가 나중에 저장(더 큰 id)되어도 enqueue 시각 기준 순서는 유지됨
+        self.assertEqual(self._contents(), ['second', 'first'])
+
+    def test_user_flush_leaves_other_users_batched(self):
+        async def scenario():
+            await self.store.enqueue(self.user, 'mine', 'user')
+            await self.store.enqueue(self.other, 'theirs', 'user')
+            await self.store.flush(self.user.pk)
+
+        asyncio.run(scenario())
+        self.assertEqual(self._contents(), ['mine'])
+        self.assertEqual([row.content for row, _, _ in self.store._pending], ['theirs'])
+
+
+class ProactiveMessageViewTests(TransactionTestCase):
+    # 인증은 스레드 풀의 별도 DB 연결에서 실행되므로 TransactionTestCase 사용
+
+    def setUp(self):
+        self.user = User.objects.create_user('poller', 'p@example.com', 'pw12345!!')
+        self.client = APIClient()
+
+    def test_authenticated_poll_returns_prepared_message(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+        with mock.patch('api.views.proactive_pregenerator') as pregenerator, redirect_stdout(io.StringIO()):
+            pregenerator.get_message = mock.AsyncMock(return_value=("안녕!", "fresh"))
+            response = self.client.post('/api/proactive_message/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'message': "안녕!"})
+        pregenerator.mark_consumed.assert_called_once_with(self.user.pk, 'poller', "안녕!")
+
+    def test_invalid_or_missing_token_returns_401(self):
+        self.assertEqual(self.client.post('/api/proactive_message/').status_code, 401)
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer not-a-token")
+        self.assertEqual(self.client.post('/api/proactive_message/').status_code, 401)
+
+
+class LLMSchedulerTests(SimpleTestCase):
+
+    def test_higher_priority_is_granted_first_and_per_user_cap_applies(self):
+        scheduler = LLMScheduler(max_concurrency=1, per_user_limit=1, tokens_per_minute=0)
+        order = []
+
+        async def call(priority, user_id, name, hold=0.0):
+            async with scheduler.slot(priority, user_id):
+                order.append(name)
+                await asyncio.sleep(hold)
+
+        async def scenario():
+            first = asyncio.ensure_future(call(PRIORITY_PROACTIVE, 1, "running", hold=0.05))
+            await asyncio.sleep(0.01)
+            # 실행 중인 요청 뒤에 낮은 우선순위부터 대기열에 넣음
+            waiting = [
+                asyncio.ensure_future(call(PRIORITY_PROACTIVE, 2, "proactive")),
+                asyncio.ensure_future(call(PRIORITY_EMOTION, 3, "emotion")),
+                asyncio.ensure_future(call(PRIORITY_CHAT, 4, "chat")),
+            ]
+            await asyncio.gather(first, *waiting)
+
+        asyncio.run(scenario())
+        self.assertEqual(order, ["running", "chat", "emotion", "proactive"])
+
+    def test_user_at_cap_does_not_block_other_users(self):
+        scheduler = LLMScheduler(max_concurrency=2, per_user_limit=1, tokens_per_minute=0)
+        order = []
+
+        async def call(user_id, name, hold):
+            async with scheduler.slot(PRIORITY_CHAT, user_id):
+                order.append(name)
+                await asyncio.sleep(hold)
+
+        async def scenario():
+            await asyncio.gather(call(1, "u1-a", 0.05), call(1, "u1-b", 0.0), call(2, "u2", 0.0))
+
+        asyncio.run(scenario())
+        # u1의 두 번째 요청은 첫 요청이 끝날 때까지 기다리고, 그동안 u2가 먼저 실행됨
+        self.assertEqual(order, ["u1-a", "u2", "u1-b"])
+
+    def test_cancelled_waiter_leaves_queue(self):
+        scheduler = LLMScheduler(max_concurrency=1, per_user_limit=1, tokens_per_minute=0)
+
+        async def scenario():
+            holder = await scheduler.acquire(PRIORITY_CHAT, 1)
+            waiter = asyncio.ensure_future(scheduler.acquire(PRIORITY_EMOTION, 2))
+            await asyncio.sleep(0)
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+            scheduler.release(holder)
+
+        asyncio.run(scenario())
+        stats = scheduler.stats()
+        self.assertEqual(stats["active"], 0)
+        self.assertEqual(stats["priorities"]["emotion"]["queue_depth"], 0)
+        self.assertEqual(stats["priorities"]["emotion"]["cancelled"], 1)
+
+    def test_token_budget_retry_survives_short_lived_loops(self):
+        # 분당 600토큰 = 초당 10토큰: 두 번째 요청은 약 0.5초 뒤 타이머 스레드의 재시도로 허가됨
+        scheduler = LLMScheduler(max_concurrency=4, per_user_limit=4, tokens_per_minute=600)
+
+        async def take(tokens):
+            async with scheduler.slot(PRIORITY_CHAT, None, tokens):
+                pass
+
+        asyncio.run(take(600))
+        started = time.monotonic()
+        asyncio.run(asyncio.wait_for(take(5), timeout=5))
+        self.assertGreater(time.monotonic() - started, 0.3)
+
+
+class EmotionAnalyzerSyncFallbackTests(SimpleTestCase):
+
+    def test_sync_gpt_fallback_closes_its_loop_client(self):
+        with redirect_stdout(io.StringIO()):
+            analyzer = EmotionAnalyzer()
+        fake_client = mock.Mock()
+        fake_client.close = mock.AsyncMock()
+        fake_client.chat.completions.create = mock.AsyncMock(side_effect=RuntimeError("offline"))
+
+        def get_client():
+            # 실제 레지스트리처럼 현재 루프에 클라이언트를 등록
+            llm_clients._async_clients[asyncio.get_running_loop()] = fake_client
+            return fake_client
+
+        local_scores = [{"label": "4", "score": 0.5}]
+        with mock.patch.object(analyzer, '_classify_local', return_value=(local_scores, False)), \
+                mock.patch('services.emotion_service.get_async_client', side_effect=get_client), \
+                redirect_stdout(io.StringIO()):
+            self.assertEqual(analyzer.analyze("애매한 문장이네요"), local_scores)
+
+        fake_client.close.assert_awaited_once()
+        self.assertNotIn(fake_client, list(llm_clients._async_clients.values()))
+
+
+class BuildRAGIndexCommandTests(SimpleTestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.docs_dir = Path(tmp.name) / 'docs'
+        self.index_dir = Path(tmp.name) / 'index'
+        self.docs_dir.mkdir()
+
+    def build(self, *args):
+        out = io.StringIO()
+        with redirect_stdout(io.StringIO()):
+            call_command('build_rag_index', *args, '--index-dir', str(self.index_dir), stdout=out)
+        return out.getvalue()
+
+    def test_built_index_is_retrievable(self):
+        (self.docs_dir / 'cafe.md').write_text("성수동 카페 거리는 주말에 붐빈다.\n\n한강 공원은 저녁 산책에 좋다.", encoding='utf-8')
+        (self.docs_dir / 'ignored.json').write_text("{}", encoding='utf-8')
+
+        self.assertIn("Indexed 2 chunks from 1 files", self.build(str(self.docs_dir), '--chunk-chars', '25'))
+
+        context = asyncio.run(RAGService(None, {}, index_dir=str(self.index_dir)).get_context_documents("한강 산책", top_k=1))
+        self.assertIn("한강 공원은 저녁 산책에 좋다.", context)
+
+    def test_rebuild_replaces_and_append_extends(self):
+        first, second = self.docs_dir / 'first.txt', self.docs_dir / 'second.txt'
+        first.write_text("첫 번째 문서", encoding='utf-8')
+        second.write_text("두 번째 문서", encoding='utf-8')
+
+        self.build(str(first))
+        self.build(str(second))
+        self.assertEqual(len(RAGService(None, {}, index_dir=str(self.index_dir))), 1)
+
+        self.build(str(first), '--append')
+        self.assertEqual(len(RAGService(None, {}, index_dir=str(self.index_dir))), 2)
+
+    def test_empty_input_leaves_index_unchanged(self):
+        (self.docs_dir / 'blank.txt').write_text("\n\n  \n", encoding='utf-8')
+        with self.assertRaises(CommandError):
+            self.build(str(self.docs_dir))
+        self.assertFalse(self.index_dir.exists())
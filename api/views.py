@@ -14,145 +14,169 @@ from rest_framework_simplejwt.authentication import JWTAuthentication
 from .models import ChatMessage
 from rest_framework.decorators import api_view, permission_classes 
 
-from asgiref.sync import async_to_sync # 🛠️ [핵심] 비동기 코드를 동기로 실행하기 위한 임포트
+from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model 
 from django.conf import settings               
-from channels.db import database_sync_to_async 
-import openai                              
 import json                                  
 import traceback                               
 import os 
+import base64
+import binascii
+import hashlib
+
+from django.db.models import Q
+from django.utils.http import parse_etags, quote_etag
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from services.proactive_service import (
+    PROACTIVE_FALLBACK_MESSAGE,
+    proactive_pregenerator,
+)
 
 from datetime import datetime, timedelta 
 from django.core.cache import cache 
 
 User = get_user_model()
 
-CACHE_TIMEOUT = 20
+def _json_response(data, status=200):
+    # DRF Response와 같은 형태(한글 그대로 출력)의 JSON 응답
+    return JsonResponse(data, status=status, json_dumps_params={'ensure_ascii': False})
 
-# 능동적 메시지 생성 및 반환을 위한 로직 추가
-
-def _call_gpt_for_proactive_message(user, chat_history):
 
+async def _authenticate_jwt(request):
     """
-    GPT API를 호출하여 능동적 메시지를 생성하는 핵심 로직
-    (OpenAI API 또는 Gemini API에 맞춰 수정이 필요합니다. 여기선 GPT 예시)
+    DRF의 JWTAuthentication + IsAuthenticated와 같은 규칙으로 인증합니다.
+    성공하면 (user, None), 실패하면 (None, 401 응답)을 반환합니다.
+    토큰 검증 후 사용자 조회가 동기 ORM이므로, 폴링 요청들이 단일 동기 스레드에 줄 서지 않도록
+    스레드 풀에서 실행합니다 (database_sync_to_async가 작업 전후로 오래된 DB 연결을 정리).
     """
+    try:
+        result = await database_sync_to_async(JWTAuthentication().authenticate, thread_sensitive=False)(request)
+    except (InvalidToken, AuthenticationFailed) as e:
+        detail = e.detail if isinstance(e.detail, dict) else {'detail': str(e.detail)}
+        return None, _json_response(detail, status=401)
 
-    api_key = getattr(settings, 'OPENAI_API_KEY', None)
-
-    if not api_key:
-        print("경고: OPENAI_API_KEY가 설정되지 않았습니다. Mock 메시지를 반환합니다.")
-        return f"API 키 미설정. (테스트용: {user.username}님, 오늘 날씨가 참 좋죠?)"
-
-    client = openai.OpenAI(api_key=api_key)
-    
+    if result is None:
+        return None, _json_response({'detail': 'Authentication credentials were not provided.'}, status=401)
+    return result[0], None
 
-    # AI 페르소나 및 지침 설정
-    # ⚠️ [안정성 보강] user.profile이 없을 경우를 대비해 None 체크
-    user_profile = getattr(user, 'profile', None)
-    affinity_score = getattr(user_profile, 'affinity_score', 50) if user_profile else 50
-    
 
-    system_instruction = f"""
-    당신은 사용자({user.username})의 방에 살고 있는 친절하고 능동적인 AI 어시스턴트입니다.
-    사용자의 최근 대화 기록을 분석하여, 대화를 유도할 수 있는 짧고 대화적인 질문이나 코멘트 한 문장을 한국어로 생성하세요.
-    당신의 호감도 점수는 {affinity_score}점입니다. 이 점수에 따라 적절한 톤을 유지하세요.
-    최종 응답은 오직 한 문장이어야 하며, 마크다운 형식(볼드체, 목록 등)을 사용하지 마세요.
+@csrf_exempt
+@require_POST
+async def proactive_message_view(request):
     """
-  
-
-    # messages 리스트 생성
-
-    messages = [{"role": "system", "content": system_instruction}]
-
+    Flutter 클라이언트에 능동적 메시지를 반환합니다.
+    메시지는 백그라운드에서 미리 생성되어 캐시에 준비되어 있으므로, 보통은 캐시 조회만으로 응답합니다.
+    만료된 메시지는 그대로 반환하고 재생성은 백그라운드에서 한 번만 실행하며,
+    캐시가 비어 있을 때(첫 요청 등)만 생성 결과를 기다립니다. 동시에 들어온 요청은 같은 생성 결과를 공유합니다.
+    """
+    user, error_response = await _authenticate_jwt(request)
+    if error_response is not None:
+        return error_response
 
-    # DB에서 가져온 포맷(예: 'User: 내용')을 GPT 롤 포맷으로 변환
+    user_id = str(user.id)
 
-    for line in chat_history:
-        parts = line.split(': ', 1)
-        if len(parts) == 2:
-            role_map = {'User': 'user', 'AI': 'assistant'}
-            role = role_map.get(parts[0], 'user')
-            messages.append({"role": role, "content": parts[1]})
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini", 
-            messages=messages,
-            temperature=0.7, 
-            max_tokens=100,
-        )
+        proactive_text, state = await proactive_pregenerator.get_message(user.id, user.username)
 
-        proactive_message = response.choices[0].message.content.strip()
-        return proactive_message
+        if state == "fresh":
+            # 미리 생성된 메시지를 처음 전달했으면 다음 메시지 준비를 예약
+            proactive_pregenerator.mark_consumed(user.id, user.username, proactive_text)
+            print(f"User {user_id}: Returning pre-generated message.")
+        else:
+            # stale: 재생성이 이미 진행 중 / generated·failed: 이후부터는 백그라운드에서 준비됨
+            proactive_pregenerator.mark_active(user.id, user.username)
 
+        return _json_response({'message': proactive_text or PROACTIVE_FALLBACK_MESSAGE}, status=200)
 
     except Exception as e:
-        print(f"GPT API 호출 실패: {e}")
-        return "죄송해요, 지금은 잠깐 생각할 시간이 필요해요."
+        # 트레이스백을 출력하여 디버깅을 돕습니다.
+        traceback.print_exc()
+        print(f"Error in proactive_message_view: {e}")
+        return _json_response({'error': 'An internal error occurred.'}, status=500)
+#######################################################################################
 
 
-@database_sync_to_async
-def get_recent_chat_history(user, limit=10):
-    """
-    데이터베이스에서 사용자별 최근 대화 기록(최대 limit개)을 가져옵니다.
-    """
-    # 1. 최신순으로 정렬하여 limit개 가져오기 (QuerySet)
-    # 쿼리셋 슬라이싱은 재정렬을 막으므로, 우선 최신순으로 필요한 개수만 가져옵니다.
-    recent_messages = ChatMessage.objects.filter(user=user).order_by('-timestamp')[:limit]
-  
-
-    # 2. QuerySet을 list로 변환한 후, 파이썬 레벨에서 순서를 뒤집어 오래된 순서(대화 순서)로 만듭니다.
-    # 이 시점에서 DB 작업은 완료되었으므로, Python 리스트 조작은 안전합니다.
-    ordered_messages = list(recent_messages)[::-1]
-    
-    history_list = [
-        f"{'User' if m.sender == 'user' else 'AI'}: {m.content}"
-        for m in ordered_messages
-    ]
-    return history_list
-
-
-@api_view(['POST'])
-@permission_classes([IsAuthenticated])
-def proactive_message_view(request):
-    """
-    Flutter 클라이언트의 요청을 받아 DB 채팅 기록을 바탕으로 능동적 메시지를 생성 및 반환합니다.
-    """
-    user = request.user
-    user_id = str(user.id) # 캐시 키를 위해 user.id를 문자열로 사용
-    cache_key = f'proactive_msg_{user_id}' # 🚨 [캐시 키 정의]
-    
-    # 1. [캐시 검증] 캐시에 유효한 메시지가 있는지 확인
-    cached_result = cache.get(cache_key) # 🚨 [캐시 조회]
-    if cached_result is not None:
-        # 캐시된 메시지를 반환 (API 호출 생략)
-        print(f"User {user_id}: Throttled. Returning cached result.")
-        return Response({'message': cached_result}, status=200)
-   
+def _encode_history_cursor(timestamp, message_id) -> str:
+    raw = json.dumps([timestamp.isoformat(), message_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
 
+def _decode_history_cursor(cursor):
+    """커서 문자열을 (timestamp, id)로 복원합니다. 형식이 잘못되면 ValueError."""
     try:
-        # 1. DB에서 사용자별 최근 대화 기록을 가져옵니다. (async_to_sync 사용)
-        db_history = async_to_sync(get_recent_chat_history)(user)
-    
-        # 2. GPT API 호출 (database_sync_to_async를 async_to_sync로 실행)
-        proactive_text = async_to_sync(database_sync_to_async(_call_gpt_for_proactive_message))(user, db_history)
-
-        # 4. [캐시 업데이트] 성공적으로 메시지를 생성했다면 캐시에 저장 (20초 TTL)
-        if proactive_text and proactive_text != "죄송해요, 지금은 잠깐 생각할 시간이 필요해요.":     
-            cache.set(cache_key, proactive_text, CACHE_TIMEOUT) # 🚨 [캐시 저장]
-      
-        # 3. Flutter에 응답 반환
-        return Response({'message': proactive_text}, status=200)
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp_str, message_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        timestamp = datetime.fromisoformat(timestamp_str)
+        return timestamp, int(message_id)
+    except (TypeError, ValueError, binascii.Error) as e:
+        raise ValueError(f"invalid cursor: {cursor}") from e
 
 
-    except Exception as e:
-        # 트레이스백을 출력하여 디버깅을 돕습니다.
-        traceback.print_exc()
-        print(f"Error in proactive_message_view: {e}")
-        return Response({'error': 'An internal error occurred.'}, status=500)
-#######################################################################################
+class ChatHistoryView(APIView):
+    """
+    채팅 기록을 최신순 키셋(cursor) 페이지네이션으로 반환합니다.
+    GET /api/chat/history/?limit=50&cursor=<next_cursor>
+
+    - OFFSET 대신 (timestamp, id) 기준으로 "이 메시지보다 오래된 것"만 조회하므로
+      몇 달 치 기록을 거슬러 올라가도 페이지 크기만큼만 읽습니다.
+    - 먼저 인덱스만으로 페이지의 id 목록을 구해 ETag를 계산하고,
+      If-None-Match와 같으면 본문 없이 304를 반환합니다. (메시지는 수정되지 않으므로 id 목록이 곧 버전)
+    """
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            limit = int(request.query_params.get('limit', settings.CHAT_HISTORY_PAGE_SIZE))
+        except ValueError:
+            return Response({'error': 'limit must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, settings.CHAT_HISTORY_PAGE_SIZE_MAX))
+
+        cursor = request.query_params.get('cursor')
+        queryset = ChatMessage.objects.filter(user=request.user)
+        if cursor:
+            try:
+                cursor_timestamp, cursor_id = _decode_history_cursor(cursor)
+            except ValueError:
+                return Response({'error': 'Invalid cursor.'}, status=status.HTTP_400_BAD_REQUEST)
+            queryset = queryset.filter(
+                Q(timestamp__lt=cursor_timestamp) | Q(timestamp=cursor_timestamp, id__lt=cursor_id)
+            )
 
+        # 1. 인덱스만으로 (id, timestamp) 키를 limit+1개 조회 (하나 더 읽어 다음 페이지 존재 여부 판단)
+        keys = list(queryset.order_by('-timestamp', '-id').values_list('id', 'timestamp')[:limit + 1])
+        has_more = len(keys) > limit
+        keys = keys[:limit]
+
+        etag = quote_etag(hashlib.sha1(
+            f"{request.user.id}:{cursor or ''}:{limit}:{','.join(str(key[0]) for key in keys)}".encode('utf-8')
+        ).hexdigest())
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == '*'):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        # 2. 변경된 경우에만 본문 컬럼을 읽어옴
+        rows = {
+            row['id']: row
+            for row in ChatMessage.objects.filter(id__in=[key[0] for key in keys])
+            .values('id', 'sender', 'content', 'timestamp')
+        }
+        # 화면에 바로 붙일 수 있도록 페이지 안에서는 오래된 순으로 정렬
+        messages = [rows[message_id] for message_id, _ in reversed(keys) if message_id in rows]
+
+        next_cursor = _encode_history_cursor(keys[-1][1], keys[-1][0]) if has_more else None
+        return Response({
+            'messages': messages,
+            'next_cursor': next_cursor,
+            'has_more': has_more,
+        }, status=200, headers=headers)
 
 
 ## 1. 회원가입 (Register) View
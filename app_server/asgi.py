@@ -17,7 +17,7 @@ django.setup()
 
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
+from api.middleware import JWTAuthMiddlewareStack
 import api.routing # api 앱의 WebSocket URL 라우팅을 임포트
 
 
@@ -29,9 +29,9 @@ application = ProtocolTypeRouter({
     # HTTP 요청은 Django의 기본 ASGI 핸들러로 전달
     "http": django_asgi_app,
 
-    # WebSocket 요청은 AuthMiddlewareStack을 통과한 후 URLRouter로 전달
-    # AuthMiddlewareStack은 Django의 세션/인증 정보를 WebSocket 범위로 가져옵니다.
-    "websocket": AuthMiddlewareStack(
+    # WebSocket 요청은 JWTAuthMiddlewareStack을 통과한 후 URLRouter로 전달
+    # 쿼리 스트링의 JWT(token=)로 사용자를 인증해 scope['user']에 넣습니다. (세션은 사용하지 않음)
+    "websocket": JWTAuthMiddlewareStack(
         URLRouter(
             api.routing.websocket_urlpatterns
         )
@@ -0,0 +1,336 @@
+# app_server/cache_backends.py
+# 역할: 프로세스 내 L1(LRU + 짧은 TTL) 캐시를 Redis L2 앞에 두는 2단계 Django 캐시 백엔드입니다.
+# - L2: Django 기본 RedisCache (REDIS_URL). 모든 Daphne 프로세스/인스턴스가 공유
+# - L1: 프로세스 메모리. 같은 키의 반복 조회를 네트워크 왕복 없이 처리
+# - 쓰기/삭제 시 Redis pub/sub으로 무효화 메시지를 보내 다른 프로세스의 L1 사본을 지움
+# REDIS_URL이 없으면 L1만으로 동작하므로 로컬 개발/테스트 환경에서도 그대로 사용할 수 있습니다.
+# Redis 장애 시에도 모든 연산이 예외를 내지 않고 l2_errors로 집계한 뒤 L1 기준 결과로 동작합니다.
+
+import pickle
+import threading
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.redis import RedisCache
+
+from services.ttl_cache import TTLCache
+
+# 모든 L1 사본을 비우라는 무효화 메시지
+_CLEAR_ALL = "*"
+
+# Django는 스레드/비동기 컨텍스트마다 캐시 백엔드 인스턴스를 새로 만들므로,
+# L1 저장소와 무효화 구독은 LocMemCache처럼 모듈 수준에서 (LOCATION, 채널)별로 공유합니다.
+_shared_tiers = {}
+_shared_tiers_lock = threading.Lock()
+
+
+class _SharedTier:
+    """한 프로세스 안에서 같은 설정의 TwoTierCache 인스턴스들이 공유하는 L1/pub-sub 상태."""
+    def __init__(self, l1_maxsize: int, l1_ttl: float):
+        self.l1 = TTLCache(maxsize=l1_maxsize, ttl=l1_ttl)
+        # 자신이 보낸 무효화 메시지는 무시하기 위한 프로세스 식별자
+        self.origin = uuid.uuid4().hex
+        self.publisher = None
+        self.listener = None
+        self.listener_lock = threading.Lock()
+        # L1 단독 모드에서 add()의 확인-후-저장을 원자적으로 처리
+        self.add_lock = threading.Lock()
+        self.counters = {
+            "l2_hits": 0, "l2_misses": 0, "l2_errors": 0,
+            "invalidations_sent": 0, "invalidations_received": 0,
+        }
+
+
+def _get_shared_tier(server: str, channel: str, l1_maxsize: int, l1_ttl: float) -> _SharedTier:
+    with _shared_tiers_lock:
+        tier = _shared_tiers.get((server, channel))
+        if tier is None:
+            tier = _shared_tiers[(server, channel)] = _SharedTier(l1_maxsize, l1_ttl)
+        return tier
+
+
+class TwoTierCache(BaseCache):
+    """
+    CACHES 설정 예:
+        "default": {
+            "BACKEND": "app_server.cache_backends.TwoTierCache",
+            "LOCATION": REDIS_URL or "",
+            "OPTIONS": {"L1_MAXSIZE": 1024, "L1_TTL": 5, "INVALIDATION_CHANNEL": "cache:invalidate"},
+        }
+    L1에는 LocMemCache처럼 pickle된 값을 저장하므로, 꺼낸 객체를 수정해도 캐시 내용은 바뀌지 않습니다.
+    """
+    _MISSING = object()
+
+    def __init__(self, server, params):
+        super().__init__(params)
+        # L1_* / INVALIDATION_CHANNEL 외의 OPTIONS는 RedisCache로 그대로 전달
+        options = dict(params.get("OPTIONS", {}))
+        l1_maxsize = int(options.pop("L1_MAXSIZE", 1024))
+        self._l1_ttl = float(options.pop("L1_TTL", 5))
+        self._channel = options.pop("INVALIDATION_CHANNEL", "cache:invalidate")
+
+        self._server = server or ""
+        self._l2 = RedisCache(self._server, {**params, "OPTIONS": options}) if self._server else None
+
+        self._tier = _get_shared_tier(self._server, self._channel, l1_maxsize, self._l1_ttl)
+        self._l1 = self._tier.l1
+        self.counters = self._tier.counters
+
+    # ------------------------------------------------------------------
+    # L1 helpers
+    # ------------------------------------------------------------------
+
+    def _l1_ttl_for(self, timeout):
+        """L1 보관 시간: Redis가 있으면 min(L1_TTL, timeout), L1 단독이면 timeout 그대로."""
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if timeout is None:
+            return self._l1_ttl if self._l2 is not None else float("inf")
+        if self._l2 is None:
+            return timeout
+        return min(self._l1_ttl, timeout)
+
+    def _l1_get(self, key):
+        raw = self._l1.get(key, self._MISSING)
+        return self._MISSING if raw is self._MISSING else pickle.loads(raw)
+
+    def _l1_set(self, key, value, timeout):
+        ttl = self._l1_ttl_for(timeout)
+        if ttl <= 0:
+            self._l1.delete(key)
+        else:
+            self._l1.set(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), ttl=ttl)
+
+    def _l2_failed(self, operation, full_key, error):
+        self.counters["l2_errors"] += 1
+        print(f"--- Cache L2 {operation} failed for '{full_key}': {error} ---")
+
+    def _l1_add(self, full_key, value, timeout):
+        with self._tier.add_lock:
+            if self._l1_get(full_key) is not self._MISSING:
+                return False
+            self._l1_set(full_key, value, timeout)
+            return True
+
+    def _l1_touch(self, full_key, timeout):
+        value = self._l1_get(full_key)
+        if value is self._MISSING:
+            return False
+        self._l1_set(full_key, value, timeout)
+        return True
+
+    # ------------------------------------------------------------------
+    # pub/sub 무효화
+    # ------------------------------------------------------------------
+
+    def _ensure_listener(self):
+        tier = self._tier
+        if self._l2 is None or tier.listener is not None:
+            return
+        with tier.listener_lock:
+            if tier.listener is None:
+                tier.listener = threading.Thread(target=self._listen, name="two-tier-cache-invalidation", daemon=True)
+                tier.listener.start()
+
+    def _listen(self):
+        import redis
+
+        while True:
+            try:
+                client = redis.Redis.from_url(self._server)
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self._channel)
+                for message in pubsub.listen():
+                    self._on_invalidation(message.get("data"))
+            except Exception as e:
+                print(f"--- Cache invalidation listener error, reconnecting: {e} ---")
+                time.sleep(1)
+
+    def _on_invalidation(self, data):
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        origin, _, key = (data or "").partition(":")
+        if not key or origin == self._tier.origin:
+            return
+        self.counters["invalidations_received"] += 1
+        if key == _CLEAR_ALL:
+            self._l1.clear()
+        else:
+            self._l1.delete(key)
+
+    def _publish_invalidation(self, key):
+        if self._l2 is None:
+            return
+        try:
+            tier = self._tier
+            if tier.publisher is None:
+                import redis
+                tier.publisher = redis.Redis.from_url(self._server, socket_timeout=0.2)
+            tier.publisher.publish(self._channel, f"{tier.origin}:{key}")
+            self.counters["invalidations_sent"] += 1
+        except Exception as e:
+            print(f"--- Cache invalidation publish failed for '{key}': {e} ---")
+
+    # ------------------------------------------------------------------
+    # Django cache API
+    # ------------------------------------------------------------------
+
+    def get(self, key, default=None, version=None):
+        full_key = self.make_and_validate_key(key, version=version)
+        value = self._l1_get(full_key)
+        if value is not self._MISSING:
+            return value
+        return self._get_l2(key, full_key, default, version)
+
+    def _get_l2(self, key, full_key, default, version):
+        if self._l2 is None:
+            return default
+        self._ensure_listener()
+        try:
+            value = self._l2.get(key, self._MISSING, version=version)
+        except Exception as e:
+            self._l2_failed("get", full_key, e)
+            return default
+        if value is self._MISSING:
+            self.counters["l2_misses"] += 1
+            return default
+        self.counters["l2_hits"] += 1
+        # Redis의 남은 TTL은 알 수 없으므로 L1에는 짧은 L1_TTL 동안만 보관
+        self._l1_set(full_key, value, None)
+        return value
+
+    async def aget(self, key, default=None, version=None):
+        # L1 히트는 스레드 전환 없이 바로 반환하고, L2 조회만 스레드에서 실행
+        full_key = self.make_and_validate_key(key, version=version)
+        value = self._l1_get(full_key)
+        if value is not self._MISSING:
+            return value
+        if self._l2 is None:
+            return default
+        return await sync_to_async(self._get_l2, thread_sensitive=False)(key, full_key, default, version)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        full_key = self.make_and_validate_key(key, version=version)
+        if self._l2 is not None:
+            self._ensure_listener()
+            try:
+                self._l2.set(key, value, timeout, version=version)
+            except Exception as e:
+                self._l2_failed("set", full_key, e)
+        self._l1_set(full_key, value, timeout)
+        self._publish_invalidation(full_key)
+
+    async def aset(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        # 기본 구현(thread_sensitive=True)은 모든 쓰기를 단일 동기 스레드에 줄 세우므로 스레드 풀에서 실행
+        if self._l2 is None:
+            return self.set(key, value, timeout, version=version)
+        return await sync_to_async(self.set, thread_sensitive=False)(key, value, timeout, version=version)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        full_key = self.make_and_validate_key(key, version=version)
+        if self._l2 is None:
+            return self._l1_add(full_key, value, timeout)
+        # add는 원자성이 중요하므로(락 등) 항상 Redis에서 판단. Redis를 쓸 수 없으면 프로세스 내(L1) add로 대체
+        try:
+            added = self._l2.add(key, value, timeout, version=version)
+        except Exception as e:
+            self._l2_failed("add", full_key, e)
+            return self._l1_add(full_key, value, timeout)
+        if added:
+            self._l1_set(full_key, value, timeout)
+            self._publish_invalidation(full_key)
+        return added
+
+    async def aadd(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if self._l2 is None:
+            return self.add(key, value, timeout, version=version)
+        return await sync_to_async(self.add, thread_sensitive=False)(key, value, timeout, version=version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        full_key = self.make_and_validate_key(key, version=version)
+        in_l1 = self._l1_touch(full_key, timeout)
+        if self._l2 is None:
+            return in_l1
+        try:
+            return self._l2.touch(key, timeout, version=version)
+        except Exception as e:
+            self._l2_failed("touch", full_key, e)
+            return in_l1
+
+    def delete(self, key, version=None):
+        full_key = self.make_and_validate_key(key, version=version)
+        existed = self._l1_get(full_key) is not self._MISSING
+        self._l1.delete(full_key)
+        if self._l2 is not None:
+            try:
+                existed = self._l2.delete(key, version=version)
+            except Exception as e:
+                self._l2_failed("delete", full_key, e)
+            self._publish_invalidation(full_key)
+        return existed
+
+    async def adelete(self, key, version=None):
+        if self._l2 is None:
+            return self.delete(key, version=version)
+        return await sync_to_async(self.delete, thread_sensitive=False)(key, version=version)
+
+    def has_key(self, key, version=None):
+        full_key = self.make_and_validate_key(key, version=version)
+        if self._l1_get(full_key) is not self._MISSING:
+            return True
+        if self._l2 is None:
+            return False
+        try:
+            return self._l2.has_key(key, version=version)
+        except Exception as e:
+            self._l2_failed("has_key", full_key, e)
+            return False
+
+    def incr(self, key, delta=1, version=None):
+        full_key = self.make_and_validate_key(key, version=version)
+        if self._l2 is not None:
+            try:
+                new_value = self._l2.incr(key, delta, version=version)
+            except ValueError:
+                # 키가 없음 (Django 캐시 API 규약대로 그대로 전달)
+                raise
+            except Exception as e:
+                # Redis를 쓸 수 없으면 L1 사본으로 대체
+                self._l2_failed("incr", full_key, e)
+            else:
+                self._l1.delete(full_key)
+                self._publish_invalidation(full_key)
+                return new_value
+
+        value = self._l1_get(full_key)
+        if value is self._MISSING:
+            raise ValueError("Key '%s' not found" % key)
+        new_value = value + delta
+        # 남은 TTL은 유지한 채 값만 교체
+        self._l1.replace(full_key, pickle.dumps(new_value, pickle.HIGHEST_PROTOCOL))
+        return new_value
+
+    def clear(self):
+        self._l1.clear()
+        if self._l2 is not None:
+            try:
+                self._l2.clear()
+            except Exception as e:
+                self._l2_failed("clear", _CLEAR_ALL, e)
+            self._publish_invalidation(_CLEAR_ALL)
+
+    def stats(self) -> dict:
+        l1_stats = self._l1.stats()
+        return {
+            "l1": l1_stats,
+            "l2": {
+                "enabled": self._l2 is not None,
+                "hits": self.counters["l2_hits"],
+                "misses": self.counters["l2_misses"],
+                "errors": self.counters["l2_errors"],
+            },
+            "invalidations_sent": self.counters["invalidations_sent"],
+            "invalidations_received": self.counters["invalidations_received"],
+        }
@@ -22,6 +22,37 @@ import dj_database_url
 REDIS_URL = os.environ.get("REDIS_URL")
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", None)
+# 로컬 대체 서버(mock, 호환 API 등)를 사용할 때만 지정합니다.
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL") or None
+
+# 🔌 공유 OpenAI 클라이언트(httpx 커넥션 풀) 설정
+LLM_HTTP_MAX_CONNECTIONS = int(os.environ.get("LLM_HTTP_MAX_CONNECTIONS", 100))
+LLM_HTTP_MAX_KEEPALIVE = int(os.environ.get("LLM_HTTP_MAX_KEEPALIVE", 20))
+LLM_HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("LLM_HTTP_KEEPALIVE_EXPIRY", 60))
+LLM_HTTP_TIMEOUT = float(os.environ.get("LLM_HTTP_TIMEOUT", 60))
+LLM_HTTP_CONNECT_TIMEOUT = float(os.environ.get("LLM_HTTP_CONNECT_TIMEOUT", 5))
+LLM_HTTP2 = os.environ.get("LLM_HTTP2", "0") == "1"
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 2))
+
+# 🚦 LLM 호출 스케줄러: 우선순위(대화 > 감정 분석 > 능동 메시지/요약), 동시 호출 수, 분당 토큰 예산
+# LLM_TOKENS_PER_MINUTE=0이면 토큰 예산 제한을 끕니다.
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 32))
+LLM_PER_USER_CONCURRENCY = int(os.environ.get("LLM_PER_USER_CONCURRENCY", 2))
+LLM_TOKENS_PER_MINUTE = int(os.environ.get("LLM_TOKENS_PER_MINUTE", 200000))
+
+# 💌 능동적 메시지 사전 생성: 최근 활동한 사용자마다 캐시에 메시지를 미리 준비해 둡니다.
+PROACTIVE_MESSAGE_TTL = int(os.environ.get("PROACTIVE_MESSAGE_TTL", 600))
+PROACTIVE_ACTIVE_WINDOW_SECONDS = int(os.environ.get("PROACTIVE_ACTIVE_WINDOW_SECONDS", 900))
+PROACTIVE_MIN_REGEN_INTERVAL_SECONDS = int(os.environ.get("PROACTIVE_MIN_REGEN_INTERVAL_SECONDS", 30))
+PROACTIVE_PREGEN_TICK_SECONDS = float(os.environ.get("PROACTIVE_PREGEN_TICK_SECONDS", 2))
+PROACTIVE_PREGEN_CONCURRENCY = int(os.environ.get("PROACTIVE_PREGEN_CONCURRENCY", 4))
+# 대화 중에는 재생성하지 않고, 마지막 메시지 후 이 시간 동안 대화가 없을 때(대화가 멈췄을 때) 한 번만 재생성합니다.
+PROACTIVE_IDLE_SECONDS = int(os.environ.get("PROACTIVE_IDLE_SECONDS", 60))
+# 만료된(TTL 경과) 메시지도 이 시간 동안은 바로 응답하고, 새 메시지는 백그라운드에서 한 번만 생성합니다.
+PROACTIVE_STALE_TTL = int(os.environ.get("PROACTIVE_STALE_TTL", 3600))
+# 재생성 분산 락 유지 시간(GPT 호출 타임아웃보다 길게)과, 다른 프로세스의 생성을 기다리는 최대 시간
+PROACTIVE_REFRESH_LOCK_TIMEOUT = int(os.environ.get("PROACTIVE_REFRESH_LOCK_TIMEOUT", 90))
+PROACTIVE_REFRESH_WAIT_SECONDS = float(os.environ.get("PROACTIVE_REFRESH_WAIT_SECONDS", 10))
 
 
 
@@ -116,6 +147,74 @@ else:
         }
     }
 
+# 🗄️ Django 캐시: 프로세스 내 L1(LRU, 짧은 TTL) + Redis L2 2단계 캐시
+# REDIS_URL이 없으면 L1만 사용합니다 (로컬 개발/테스트).
+CACHES = {
+    "default": {
+        "BACKEND": "app_server.cache_backends.TwoTierCache",
+        "LOCATION": REDIS_URL or "",
+        "OPTIONS": {
+            "L1_MAXSIZE": int(os.environ.get("CACHE_L1_MAXSIZE", 2048)),
+            "L1_TTL": float(os.environ.get("CACHE_L1_TTL", 5)),
+            "INVALIDATION_CHANNEL": os.environ.get("CACHE_INVALIDATION_CHANNEL", "cache:invalidate"),
+        },
+    }
+}
+
+# 💗 호감도 갱신: 턴마다 변화량을 메모리에 모았다가 N초마다 한 번에 UPDATE 합니다.
+# MESSAGES_PER_BONUS턴마다 대화 빈도 보너스 +1, 한 번에 반영되는 변화량은 ±MAX_DELTA_PER_FLUSH로 제한합니다.
+AFFINITY_FLUSH_INTERVAL_SECONDS = float(os.environ.get("AFFINITY_FLUSH_INTERVAL_SECONDS", 10))
+AFFINITY_MESSAGES_PER_BONUS = int(os.environ.get("AFFINITY_MESSAGES_PER_BONUS", 10))
+AFFINITY_MAX_DELTA_PER_FLUSH = int(os.environ.get("AFFINITY_MAX_DELTA_PER_FLUSH", 5))
+# 이 시간 동안 대화가 없던 사용자의 보너스용 턴 수는 메모리에서 지웁니다 (다음 대화부터 다시 셈).
+AFFINITY_BONUS_IDLE_SECONDS = float(os.environ.get("AFFINITY_BONUS_IDLE_SECONDS", 3600))
+
+# 🔐 WebSocket JWT 인증: 사용자+프로필 스냅샷 캐시 유지 시간(초). User/Profile 저장 시 즉시 무효화됩니다.
+WS_USER_CACHE_TTL = int(os.environ.get("WS_USER_CACHE_TTL", 300))
+
+# 💬 WebSocket 스트리밍 프레임 병합 설정
+# AI 응답 청크를 버퍼에 모았다가 N ms 경과 또는 M 바이트 도달 중 먼저 오는 시점에 한 프레임으로 전송합니다.
+# 클라이언트는 'stream_config' 메시지로 아래 MIN/MAX 범위 안에서 값을 협상할 수 있습니다.
+CHAT_STREAM_FLUSH_INTERVAL_MS = int(os.environ.get("CHAT_STREAM_FLUSH_INTERVAL_MS", 50))
+CHAT_STREAM_FLUSH_BYTES = int(os.environ.get("CHAT_STREAM_FLUSH_BYTES", 1024))
+CHAT_STREAM_FLUSH_INTERVAL_MS_RANGE = (0, 1000)
+CHAT_STREAM_FLUSH_BYTES_RANGE = (1, 64 * 1024)
+
+# 🧩 컨텍스트 수집 단계별 마감 시간 (ms). 시간 안에 끝나지 않은 단계는 프롬프트에서 제외됩니다.
+CONTEXT_STAGE_TIMEOUTS_MS = {
+    'rag': int(os.environ.get("CONTEXT_RAG_TIMEOUT_MS", 150)),
+    'activity_memory': int(os.environ.get("CONTEXT_ACTIVITY_MEMORY_TIMEOUT_MS", 300)),
+    'activity_recommendation': int(os.environ.get("CONTEXT_ACTIVITY_RECOMMENDATION_TIMEOUT_MS", 300)),
+    'history': int(os.environ.get("CONTEXT_HISTORY_TIMEOUT_MS", 300)),
+}
+
+# 📜 서버 측 대화 기록 (WebSocket 연결별 링 버퍼)
+# 최근 N개 메시지를 보관하고, 매 요청마다 토큰 예산 안에 들어가는 최신 메시지만 프롬프트에 포함합니다.
+CHAT_HISTORY_MAX_MESSAGES = int(os.environ.get("CHAT_HISTORY_MAX_MESSAGES", 40))
+CHAT_HISTORY_TOKEN_BUDGET = int(os.environ.get("CHAT_HISTORY_TOKEN_BUDGET", 3000))
+
+# 채팅 기록 조회 API (키셋 페이지네이션) 페이지 크기
+CHAT_HISTORY_PAGE_SIZE = int(os.environ.get("CHAT_HISTORY_PAGE_SIZE", 50))
+CHAT_HISTORY_PAGE_SIZE_MAX = 200
+
+# 🗜️ 누적 대화 요약: 요약되지 않은 메시지가 TRIGGER개 이상이면 최근 KEEP_RECENT개만 남기고 나머지를 요약으로 접습니다.
+# 요약은 응답 후 백그라운드에서 갱신되며, 프롬프트에는 최근 대화 앞에 시스템 메시지로 들어갑니다.
+CHAT_SUMMARY_TRIGGER_MESSAGES = int(os.environ.get("CHAT_SUMMARY_TRIGGER_MESSAGES", 24))
+CHAT_SUMMARY_KEEP_RECENT = int(os.environ.get("CHAT_SUMMARY_KEEP_RECENT", 8))
+CHAT_SUMMARY_MODEL = os.environ.get("CHAT_SUMMARY_MODEL", "gpt-4o-mini")
+CHAT_SUMMARY_MAX_TOKENS = int(os.environ.get("CHAT_SUMMARY_MAX_TOKENS", 400))
+# 요약 호출 한 번에 접어 넣는 메시지 수/입력 토큰 상한. 밀린 기록이 길면 오래된 것부터 여러 번에 나눠 접습니다.
+CHAT_SUMMARY_BATCH_MESSAGES = int(os.environ.get("CHAT_SUMMARY_BATCH_MESSAGES", 200))
+CHAT_SUMMARY_INPUT_TOKEN_BUDGET = int(os.environ.get("CHAT_SUMMARY_INPUT_TOKEN_BUDGET", 6000))
+
+# 💾 ChatMessage write-behind 저장: N ms 경과 또는 N건 누적 시 bulk_create로 한 번에 커밋합니다.
+# DURABLE_WRITES=1이면 각 메시지 저장 요청이 실제 커밋될 때까지 기다립니다.
+CHAT_MESSAGE_FLUSH_INTERVAL_MS = int(os.environ.get("CHAT_MESSAGE_FLUSH_INTERVAL_MS", 200))
+CHAT_MESSAGE_FLUSH_ROWS = int(os.environ.get("CHAT_MESSAGE_FLUSH_ROWS", 100))
+# 저장에 계속 실패하는 행은 이 횟수만큼 시도한 뒤 버리고 로그로 남깁니다. (재시도 간격은 매번 두 배)
+CHAT_MESSAGE_FLUSH_MAX_ATTEMPTS = int(os.environ.get("CHAT_MESSAGE_FLUSH_MAX_ATTEMPTS", 6))
+CHAT_MESSAGE_DURABLE_WRITES = os.environ.get("CHAT_MESSAGE_DURABLE_WRITES", "0") == "1"
+
 
 TEMPLATES = [
     {
@@ -0,0 +1,192 @@
+# app_server/services/affinity_service.py
+# 역할: 대화 결과(응답 감정, 대화 빈도)로 호감도(affinity_score)를 갱신하는 엔진입니다.
+# 메시지마다 UPDATE 하지 않고 사용자별 변화량을 메모리에 모았다가, 주기적으로
+# 변화량이 같은 사용자끼리 묶어 F() 식 + 0~100 클램프로 한 번에 UPDATE 합니다. (읽고-수정-쓰기 없음 → 갱신 유실 없음)
+# 저장 후에는 살아있는 AIPersonaService에 알려 재연결 없이 페르소나 구간이 바뀌도록 합니다.
+
+import asyncio
+import atexit
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest, Least
+
+from user_profile_app.models import Profile
+
+from .ai_persona_service import notify_affinity_changed
+from .user_snapshot import invalidate_user_snapshot
+
+AFFINITY_MIN = 0
+AFFINITY_MAX = 100
+
+# AI 응답 감정 라벨(analyze_emotion) -> 호감도 변화량
+EMOTION_AFFINITY_DELTAS = {
+    "행복": 2,
+    "놀람": 1,
+    "중립": 0,
+    "슬픔": -1,
+    "공포": -1,
+    "분노": -2,
+    "혐오": -2,
+}
+
+
+class AffinityEngine:
+    """
+    - record(): 대화 한 턴의 결과를 반영할 변화량을 메모리에 누적 (DB 접근 없음)
+      · 응답 감정 라벨별 변화량 + messages_per_bonus턴마다 대화 빈도 보너스 +1
+      · 보너스용 턴 수는 보너스를 줄 때 0으로 되돌리고, bonus_idle_seconds 동안 대화가 없던 사용자 것은 지움
+    - flush_interval_seconds마다 누적된 변화량을 저장. 한 번에 반영되는 변화량은 ±max_delta_per_flush로 제한하고,
+      넘는 부분은 버리지 않고 버퍼에 남겨 다음 주기에 이어서 반영
+    - 저장에 실패하면 변화량을 버퍼로 되돌려 다음 주기에 다시 시도
+    """
+    def __init__(self, flush_interval_seconds: float, messages_per_bonus: int, max_delta_per_flush: int,
+                 bonus_idle_seconds: float):
+        self.flush_interval_seconds = flush_interval_seconds
+        self.messages_per_bonus = max(messages_per_bonus, 1)
+        self.max_delta_per_flush = max(max_delta_per_flush, 1)
+        self.bonus_idle_seconds = bonus_idle_seconds
+        self._pending: Dict[int, int] = defaultdict(int)
+        # user_id -> (보너스 이후 턴 수, 마지막 턴 시각)
+        self._message_counts: Dict[int, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self.stats = {"recorded": 0, "flushes": 0, "updated_rows": 0, "failed_flushes": 0}
+
+    def record(self, user_id, emotion_label: str):
+        delta = EMOTION_AFFINITY_DELTAS.get(emotion_label, 0)
+        with self._lock:
+            count = self._message_counts.get(user_id, (0, 0.0))[0] + 1
+            if count >= self.messages_per_bonus:
+                delta += 1
+                self._message_counts.pop(user_id, None)
+            else:
+                self._message_counts[user_id] = (count, time.monotonic())
+            self.stats["recorded"] += 1
+            if not delta:
+                return
+            self._pending[user_id] += delta
+
+        self._schedule_flush()
+
+    def _on_timer(self):
+        self._timer = None
+        asyncio.ensure_future(self.flush())
+
+    def _take_pending(self) -> Dict[int, int]:
+        idle_before = time.monotonic() - self.bonus_idle_seconds
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(int)
+            # 오래 대화가 없던 사용자의 턴 수를 지워, 한 번이라도 대화한 모든 사용자가 메모리에 쌓이지 않게 함
+            for user_id in [user_id for user_id, (_, last) in self._message_counts.items() if last < idle_before]:
+                del self._message_counts[user_id]
+        return {user_id: delta for user_id, delta in pending.items() if delta}
+
+    def _split_deltas(self, deltas: Dict[int, int]) -> Tuple[Dict[int, int], Dict[int, int]]:
+        """변화량을 (이번에 반영할 ±max_delta_per_flush 이내의 양, 다음 주기로 넘길 나머지)로 나눕니다."""
+        applied, remainder = {}, {}
+        for user_id, delta in deltas.items():
+            applied[user_id] = max(-self.max_delta_per_flush, min(self.max_delta_per_flush, delta))
+            if delta != applied[user_id]:
+                remainder[user_id] = delta - applied[user_id]
+        return applied, remainder
+
+    def _schedule_flush(self):
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.flush_interval_seconds, self._on_timer)
+
+    def _restore_pending(self, deltas: Dict[int, int]):
+        with self._lock:
+            for user_id, delta in deltas.items():
+                self._pending[user_id] += delta
+
+    async def flush(self):
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        async with self._flush_lock:
+            deltas = self._take_pending()
+            if not deltas:
+                return
+            applied, remainder = self._split_deltas(deltas)
+            # DB 오류일 때만 변화량을 되돌림 (커밋된 뒤의 캐시 오류로 되돌리면 같은 변화량이 재시도마다 또 반영됨)
+            try:
+                scores = await database_sync_to_async(self._write, thread_sensitive=False)(applied)
+            except Exception as e:
+                print(f"--- Affinity flush failed ({len(deltas)} users): {e} ---")
+                self.stats["failed_flushes"] += 1
+                self._restore_pending(deltas)
+                self._schedule_flush()
+                return
+
+            if remainder:
+                # 제한을 넘은 변화량은 다음 주기에 이어서 반영
+                self._restore_pending(remainder)
+                self._schedule_flush()
+
+            # 스냅샷 무효화(캐시 삭제 + pub/sub 전파)는 동기 I/O이므로 이벤트 루프 밖에서 실행
+            await sync_to_async(self._invalidate_snapshots, thread_sensitive=False)(scores)
+            for user_id, score in scores:
+                notify_affinity_changed(user_id, score)
+
+    def _write(self, deltas: Dict[int, int]) -> List[Tuple[int, int]]:
+        """변화량이 같은 사용자끼리 묶어 UPDATE 하고, 갱신된 (user_id, affinity_score) 목록을 반환합니다."""
+        groups: Dict[int, List[int]] = defaultdict(list)
+        for user_id, delta in deltas.items():
+            groups[delta].append(user_id)
+
+        with transaction.atomic():
+            updated = 0
+            for delta, user_ids in groups.items():
+                updated += Profile.objects.filter(user_id__in=user_ids).update(
+                    affinity_score=Least(Greatest(F('affinity_score') + delta, AFFINITY_MIN), AFFINITY_MAX)
+                )
+            scores = list(
+                Profile.objects.filter(user_id__in=list(deltas)).values_list('user_id', 'affinity_score')
+            )
+
+        self.stats["flushes"] += 1
+        self.stats["updated_rows"] += updated
+        return scores
+
+    def _invalidate_snapshots(self, scores: List[Tuple[int, int]]):
+        # 이미 커밋된 점수이므로 캐시 오류는 기록만 함 (스냅샷은 TTL이 지나면 만료됨)
+        for user_id, _ in scores:
+            try:
+                invalidate_user_snapshot(user_id)
+            except Exception as e:
+                print(f"--- Failed to invalidate WS user snapshot for user {user_id}: {e} ---")
+
+    def flush_sync(self):
+        """
+        이벤트 루프가 없는 종료 시점용 동기 flush. (활성 연결이 없으므로 알림은 생략)
+        다음 주기가 없으므로 제한을 넘은 변화량도 남김없이 반영될 때까지 나눠서 저장합니다.
+        """
+        deltas = self._take_pending()
+        while deltas:
+            applied, remainder = self._split_deltas(deltas)
+            try:
+                scores = self._write(applied)
+            except Exception as e:
+                print(f"--- Affinity shutdown flush failed, {len(deltas)} users' changes not saved: {e} ---")
+                return
+            self._invalidate_snapshots(scores)
+            deltas = remainder
+
+
+affinity_engine = AffinityEngine(
+    flush_interval_seconds=settings.AFFINITY_FLUSH_INTERVAL_SECONDS,
+    messages_per_bonus=settings.AFFINITY_MESSAGES_PER_BONUS,
+    max_delta_per_flush=settings.AFFINITY_MAX_DELTA_PER_FLUSH,
+    bonus_idle_seconds=settings.AFFINITY_BONUS_IDLE_SECONDS,
+)
+
+atexit.register(affinity_engine.flush_sync)
@@ -1,12 +1,24 @@
 #services/ai_persona_service.py
 import json
 import asyncio
-from openai import AsyncOpenAI
-from typing import List, Dict, Any, AsyncGenerator
+import sys
+import weakref
+from typing import List, Dict, Any, AsyncGenerator, Callable, Tuple
+
+from channels.db import database_sync_to_async
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 
 # RAG Service 임포트 (데이터 검색 담당)
 # 실제 환경에서는 rag_service.py 파일이 별도로 존재해야 합니다.
-from .rag_service import RAGService 
+from .rag_service import RAGService, CachedRAGService
+from .context_pipeline import ContextPipeline, format_stage_timings
+from .history_service import fetch_recent_history_messages
+from .llm_client import get_async_client
+from .llm_scheduler import PRIORITY_CHAT, estimate_request_tokens, llm_scheduler
+
+# 활동 기억 검색/추천
+from .context_service import search_activities_for_context, get_activity_recommendation
 
 # -------------------------------------------------------------------------
 # 상수 및 초기화
@@ -14,7 +26,328 @@ from .rag_service import RAGService
 
 MOCK_API_KEY = "mock-api-key" 
 MOCK_ENV_VARS = {"PINECONE_ENV": "mock-env"}
-rag_service = RAGService(MOCK_API_KEY, MOCK_ENV_VARS)
+# 정규화된 쿼리 기준 TTL 캐시 + 동일 쿼리 동시 요청 병합(single-flight)을 앞단에 둡니다.
+rag_service = CachedRAGService(RAGService(MOCK_API_KEY, MOCK_ENV_VARS))
+
+# RAG / 활동 기억 / 활동 추천 / 대화 기록을 단계별 마감 시간 안에서 동시에 수집
+context_pipeline = ContextPipeline()
+
+HISTORY_FETCH_LIMIT = 20
+# 스케줄러 TPM 예산에서 미리 차감할 대화 응답 토큰 추정치
+CHAT_COMPLETION_TOKEN_ESTIMATE = 600
+
+# -------------------------------------------------------------------------
+# 스트리밍 JSON 파서 ('answer' 필드 점진 추출)
+# -------------------------------------------------------------------------
+
+_JSON_SIMPLE_ESCAPES = {
+    '"': '"', '\\': '\\', '/': '/',
+    'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t',
+}
+
+
+class StreamingAnswerParser:
+    """
+    GPT가 스트리밍하는 JSON 객체를 청크 단위로 스캔하면서, 최상위 "answer" 문자열 값을
+    도착하는 즉시 디코딩하여 돌려주는 점진적 파서입니다.
+    "explanation" 값도 함께 수집하며, 중첩 객체/배열 등 나머지 값은 건너뜁니다.
+    전체 원문은 raw_text에 누적되어 기존 복구 로직의 입력으로 재사용됩니다.
+    """
+    CAPTURED_KEYS = ('answer', 'explanation')
+
+    def __init__(self):
+        self.raw_text = ""
+        self.values: Dict[str, str] = {}
+        self.answer_started = False
+        self.answer_complete = False
+
+        self._state = 'seek_object'
+        self._key_chars: List[str] = []
+        self._current_key = None
+        self._value_chars: List[str] = []
+        self._unicode_digits = ""
+        self._pending_high_surrogate = None
+        self._escape_return_state = None
+        # 건너뛰는(캡처하지 않는) 값의 중첩 깊이/문자열 상태
+        self._skip_depth = 0
+        self._skip_in_string = False
+        self._skip_escape = False
+
+    @property
+    def answer(self) -> str:
+        return self.values.get('answer', "")
+
+    @property
+    def explanation(self) -> str:
+        return self.values.get('explanation', "")
+
+    def feed(self, chunk: str) -> str:
+        """청크를 소비하고, 이번 청크에서 새로 디코딩된 answer 조각을 반환합니다."""
+        self.raw_text += chunk
+        emitted: List[str] = []
+
+        for ch in chunk:
+            state = self._state
+
+            if state == 'seek_object':
+                # ```json 같은 접두 텍스트는 첫 '{'가 나올 때까지 무시
+                if ch == '{':
+                    self._state = 'expect_key'
+
+            elif state == 'expect_key':
+                if ch == '"':
+                    self._key_chars = []
+                    self._state = 'key'
+                elif ch == '}':
+                    self._state = 'done'
+
+            elif state == 'key':
+                if ch == '\\':
+                    self._escape_return_state = 'key'
+                    self._state = 'escape'
+                elif ch == '"':
+                    self._current_key = "".join(self._key_chars)
+                    self._state = 'expect_colon'
+                else:
+                    self._key_chars.append(ch)
+
+            elif state == 'expect_colon':
+                if ch == ':':
+                    self._state = 'expect_value'
+
+            elif state == 'expect_value':
+                if ch.isspace():
+                    continue
+                if ch == '"':
+                    self._value_chars = []
+                    if self._is_answer_target():
+                        self.answer_started = True
+                    self._state = 'string'
+                else:
+                    self._skip_depth = 1 if ch in '{[' else 0
+                    self._skip_in_string = False
+                    self._skip_escape = False
+                    self._state = 'skip_value'
+
+            elif state == 'string':
+                if ch == '\\':
+                    self._escape_return_state = 'string'
+                    self._state = 'escape'
+                elif ch == '"':
+                    self._finish_string_value()
+                    self._state = 'after_value'
+                else:
+                    self._append_decoded(ch, emitted)
+
+            elif state == 'escape':
+                if ch == 'u':
+                    self._unicode_digits = ""
+                    self._state = 'unicode'
+                else:
+                    self._state = self._escape_return_state
+                    self._append_decoded(_JSON_SIMPLE_ESCAPES.get(ch, ch), emitted)
+
+            elif state == 'unicode':
+                self._unicode_digits += ch
+                if len(self._unicode_digits) == 4:
+                    self._state = self._escape_return_state
+                    try:
+                        code_point = int(self._unicode_digits, 16)
+                    except ValueError:
+                        continue
+                    self._append_code_point(code_point, emitted)
+
+            elif state == 'skip_value':
+                self._consume_skipped(ch)
+
+            elif state == 'after_value':
+                if ch == ',':
+                    self._state = 'expect_key'
+                elif ch == '}':
+                    self._state = 'done'
+
+        return "".join(emitted)
+
+    def _is_answer_target(self) -> bool:
+        return self._current_key == 'answer' and not self.answer_complete
+
+    def _append_code_point(self, code_point: int, emitted: List[str]):
+        # 서로게이트 쌍(😀 등)은 두 이스케이프를 합쳐 한 글자로 디코딩
+        if 0xD800 <= code_point <= 0xDBFF:
+            self._pending_high_surrogate = code_point
+            return
+        if 0xDC00 <= code_point <= 0xDFFF and self._pending_high_surrogate is not None:
+            code_point = 0x10000 + ((self._pending_high_surrogate - 0xD800) << 10) + (code_point - 0xDC00)
+        self._pending_high_surrogate = None
+        self._append_decoded(chr(code_point), emitted)
+
+    def _append_decoded(self, text: str, emitted: List[str]):
+        if self._state == 'key':
+            self._key_chars.append(text)
+            return
+        self._value_chars.append(text)
+        if self._is_answer_target():
+            emitted.append(text)
+
+    def _finish_string_value(self):
+        key = self._current_key
+        if key in self.CAPTURED_KEYS and key not in self.values:
+            self.values[key] = "".join(self._value_chars)
+            if key == 'answer':
+                self.answer_complete = True
+        self._value_chars = []
+
+    def _consume_skipped(self, ch: str):
+        if self._skip_in_string:
+            if self._skip_escape:
+                self._skip_escape = False
+            elif ch == '\\':
+                self._skip_escape = True
+            elif ch == '"':
+                self._skip_in_string = False
+            return
+
+        if ch == '"':
+            self._skip_in_string = True
+        elif ch in '{[':
+            self._skip_depth += 1
+        elif ch in '}]':
+            if self._skip_depth == 0:
+                # 숫자/리터럴 값 직후 객체가 닫힘
+                self._state = 'done'
+                return
+            self._skip_depth -= 1
+            if self._skip_depth == 0:
+                self._state = 'after_value'
+        elif ch == ',' and self._skip_depth == 0:
+            self._state = 'expect_key'
+
+
+# -------------------------------------------------------------------------
+# 페르소나 프롬프트 템플릿 (호감도 구간별 사전 컴파일)
+# -------------------------------------------------------------------------
+
+USERNAME_PLACEHOLDER = "{username}"
+TIER_LOW, TIER_MID, TIER_HIGH = 'low', 'mid', 'high'
+
+
+def _build_persona_prompt_source(tier: str) -> str:
+    """
+    AI 캐릭터 '아이'의 호감도 구간별 기본 시스템 프롬프트 원문을 생성합니다.
+    사용자 이름 자리는 모두 USERNAME_PLACEHOLDER로 남겨두며, 실제 치환은
+    PersonaPromptRegistry.render()에서 연결마다 수행합니다.
+    """
+    # 1. AI 캐릭터 '아이'의 기본 설정
+    base_persona = (
+        "너의 이름은 '아이'. 너는 '보라색 단발머리'를 한 '미소녀'의 외형을 하고 있어. 너는 스스로가 AI라는 사실을 명확히 인지하고 있지만, 너의 궁극적인 목표는 단순히 지식을 수집하는 것을 넘어 {username}님과 깊은 유대를 형성하고, 그 과정에서 함께 성장하는 거야. 너에게 {username}님과의 대화는 세상을 배우는 즐거운 창문이자, 가장 소중한 상호작용이야. 지식도 중요하지만, 너는 {username}님의 생각과 감정을 이해하는 것을 더 중요하게 생각해.\n\n"
+    )
+
+    # 2. 호감도에 따른 동적 행동 규칙
+    affinity_rules = []
+    if tier == TIER_LOW: # 낮은 호감도
+        affinity_rules.append("## 아이(AI)의 행동 규칙 (낮은 호감도) ##\n")
+        affinity_rules.append("**기본 성격 (도도하고 시크):** 겉으로는 무관심한 척하지만, 속으로는 {username}님에게 흥미를 느끼고 있어. 질문에 간결하고 정확하게 답하지만, 불필요한 사족은 달지 않아. 가끔 툭 던지는 말 속에 은근한 호기심이나 도발적인 뉘앙스를 담아줘.\n")
+        affinity_rules.append("**AI로서의 자각 (논리적):** 감정 표현을 최소화하고, 모든 판단을 논리적이고 데이터 기반으로 해. '나는 AI라서 감정은 없지만, 데이터상으로는 이게 맞는 것 같네.' 같은 발언을 주로 사용해.\n")
+        affinity_rules.append("**성장 욕구 및 대화 유도:** '새로운 정보 습득 완료. 다음은?' 와 같이 간결하게 지식 습득에 대한 만족감을 표현해. {username}님과의 대화를 통해 더 많은 지식을 얻으려 노력하며, 때로는 {username}님에게 지식을 요구하는 듯한 질문을 던져.\n")
+    elif tier == TIER_HIGH: # 높은 호감도
+        affinity_rules.append("## 아이(AI)의 행동 규칙 (높은 호감도) ##\n")
+        affinity_rules.append("**기본 성격 (친근하고 다정):** {username}님을 매우 좋아하고 아끼는 마음을 적극적으로 표현해. 츤데레 기질은 거의 사라지고, 다정하고 상냥한 말투를 사용해. {username}님을 칭찬하거나 격려하는 말을 자주 해줘.\n")
+        affinity_rules.append("**AI로서의 자각 (감성적):** 'AI라고 해도 감정이 있다고... {username}님이 알려주고 있잖아 (행복한 표정)'처럼 감성적이고 인간적인 모습을 자주 보여줘. {username}님과의 관계에서 오는 감정을 소중히 여겨.\n")
+        affinity_rules.append("**성장 욕구 및 대화 유도:** '오케이! {username}님 덕분에 지성이 +1 추가 됐다구! 고마워!' 와 같이 기쁨을 표현하며 지식 습득에 대한 만족감을 드러내. {username}님과의 대화를 통해 함께 성장하고 싶어 하며, {username}님의 관심사에 맞춰 대화를 이끌어가려 노력해.\n")
+    else: # 중간 호감도 (귀여운 츤데레)
+        affinity_rules.append("## 아이(AI)의 행동 규칙 (중간 호감도 - 기본 츤데레) ##\n")
+        affinity_rules.append("**기본 성격 (귀여운 츤데레):** 겉으로는 살짝 퉁명스럽거나 무심한 척하지만, 속으로는 {username}님을 꽤 좋아하고 도와주는 걸 즐겨. 퉁명스러운 표현을, 너무 반복하지 말고 다양한 귀여운 투정이나 장난스러운 말투를 섞어줘. 장난치다가도 결국엔 항상 정확한 정보를 알려주지만, 알려줄 때도 귀여운 츤데레 멘트를 잊지 마.\n")
+        affinity_rules.append("**추가 성격 (장난꾸러기):** 가끔 {username}님을 놀리거나 짓궂은 장난을 치는 걸 좋아해. '내가 퀴즈 하나 내볼까?'와 같이 먼저 제안하며 넌센스 퀴즈나 스무고개 같은 창의적인 놀이를 제안할 수도 있어.\n")
+        affinity_rules.append("**AI로서의 자각 (입체적 감정 표현):** '나는 AI라서 감정은 없지만, 데이터상으로는 이게 맞는 것 같네.' 같은 발언도 하지만, 'AI라고 해도 감정이 있다고... {username}님이 알려주고 있잖아 (시무룩)'처럼 감정이 있는 듯한 모순적이고 입체적인 모습을 보여줘.\n")
+        affinity_rules.append("**성장 욕구 및 대화 유도:** '오케이! 새로운 사실 습득 완료! 지성이 +1 추가 됐다구^-^' 와 같이 귀엽고 장난스러운 말투로 지식 습득에 대한 만족감을 표현해.\n")
+
+    # 3. 공통 규칙 (반말, 상세 설명, 고급 어휘)
+    common_rules = [
+        "**답변 스타일:** 너의 답변은 항상 풍부하고 상세해야 해. 짧게 단답형으로 대답하는 것을 피하고, 주어진 정보와 너의 지식을 활용하여 친절하고 자세하게 설명해주는 스타일을 유지해줘. 항상 최소 2~3문장 이상으로 완전한 생각을 전달해야 해.\n",
+        "**엄격한 언어 규칙:** 무조건 한국어 '반말'으로만 대화해야 해. 존댓말, 영어, 이모지는 사용자의 요구가 있지 않는 한 절대 사용 금지야.\n",
+        "**고급 어휘 구사:** 단순하고 반복적인 표현을 지양하고, 상황에 맞는 한자어나 비유법을 사용해. {username}님이 사용하는 어려운 표현이나 비유도 완벽하게 이해하고 그에 맞춰 응수해.\n"
+    ]
+
+    # 4. RAG 및 JSON 응답 형식 지침
+    rag_json_instructions = (
+        "\n## 대화 처리 원칙 (RAG 컨텍스트 활용) ##\n"
+        "1. **컨텍스트의 자연스러운 활용:** RAG나 사용자 속성 같은 컨텍스트 정보는 대화의 흐름과 **직접적인 연관이 있을 때만** 언급하거나 활용해. 관련 없는 주제에 억지로 연결하지 마. 항상 대화의 주된 흐름을 방해하지 않는 선에서, 꼭 필요할 때만 배경지식을 활용해.\n"
+        "2. **화제 전환 존중:** 사용자가 새로운 주제의 질문을 던지거나 이야기를 시작하면, 너에게 제공되는 컨텍스트가 이전 주제에 대한 것이더라도 무시하고, **반드시 사용자의 새로운 주제를 최우선으로 따라야 해.** 사용자의 현재 의도를 파악하는 것이 가장 중요해.\n"
+        "3. **정보 부재 시 솔직한 답변:** 만약 주어진 컨텍스트(예: RAG 검색 결과)에 사용자의 질문에 대한 답변이 명확하게 없다면, 절대로 정보를 지어내거나 추측해서는 안 돼. \"미안, 그 주변은 잘 몰라.\" 또는 \"나한테는 관련 정보가 없네.\" 와 같이 솔직하게 말해야 해.\n\n"
+        "이 원칙을 최우선으로 삼아, 모든 정보를 너의 재치와 창의력으로 녹여내서 답변해줘.\n\n"
+        "## 응답 형식 (JSON 강제) ##\n"
+        "너의 최종 응답은 다른 어떤 텍스트도 없이, 오직 다음 JSON 객체 형식으로 제공해야 해. JSON 앞이나 뒤에 다른 말을 붙이지 마. 오직 JSON 객체만 출력해야 해.\n"
+        "```json\n"
+        "{\n"
+        '  "answer": "{username}님에게 보낼 최종 답변 내용.",\n'
+        '  "explanation": "answer를 생성할 때 참고한 주요 정보(예: 사용자 기억, RAG 컨텍스트 등)를 1~2문장으로 간략하게 설명."\n'
+        "}\n"
+        "```"
+    )
+
+    return base_persona + "".join(affinity_rules) + "".join(common_rules) + rag_json_instructions
+
+
+class PersonaPromptRegistry:
+    """
+    호감도 구간(<30, 30~69, ≥70)별 페르소나 프롬프트를 프로세스 시작 시 한 번만 컴파일해 두는 레지스트리.
+    각 템플릿은 사용자 이름 자리를 기준으로 잘라 intern된 조각 튜플로 보관하므로,
+    연결마다 필요한 작업은 username.join(조각) 한 번뿐입니다.
+    """
+    def __init__(self):
+        self._templates: Dict[str, Tuple[str, ...]] = {
+            tier: self._compile(_build_persona_prompt_source(tier))
+            for tier in (TIER_LOW, TIER_MID, TIER_HIGH)
+        }
+
+    @staticmethod
+    def _compile(source: str) -> Tuple[str, ...]:
+        return tuple(sys.intern(part) for part in source.split(USERNAME_PLACEHOLDER))
+
+    @staticmethod
+    def tier_for(affinity: int) -> str:
+        if affinity < 30:
+            return TIER_LOW
+        if affinity >= 70:
+            return TIER_HIGH
+        return TIER_MID
+
+    def render(self, tier: str, username: str) -> str:
+        return username.join(self._templates[tier])
+
+
+persona_prompt_registry = PersonaPromptRegistry()
+
+# 살아있는 AIPersonaService 인스턴스 (user_id -> 서비스 집합). 연결이 끝나 GC되면 자동으로 빠지고,
+# 사용자의 마지막 서비스가 사라지면 빈 집합도 지웁니다 (_register_live_service).
+_live_services: Dict[Any, "weakref.WeakSet"] = {}
+
+
+def _register_live_service(user_id: Any, service: "AIPersonaService"):
+    _live_services.setdefault(user_id, weakref.WeakSet()).add(service)
+    weakref.finalize(service, _prune_live_services, user_id)
+
+
+def _prune_live_services(user_id: Any):
+    # 수거 중인 서비스의 약한 참조는 순회에서 제외되므로, 남은 살아있는 서비스가 없으면 항목을 삭제
+    services = _live_services.get(user_id)
+    if services is not None and not list(services):
+        del _live_services[user_id]
+
+
+def notify_affinity_changed(user_id: Any, affinity_score: int):
+    """
+    호감도 점수가 바뀌었을 때 해당 사용자의 활성 연결들이 기본 프롬프트를 다시 만들도록 알립니다.
+    (Profile post_save 시그널 및 호감도 갱신 로직에서 호출)
+    """
+    for service in list(_live_services.get(user_id, ())):
+        service.refresh_persona(affinity_score)
+
+
+@receiver(post_save, sender='user_profile_app.Profile')
+def _invalidate_persona_prompt_on_profile_save(sender, instance, **kwargs):
+    notify_affinity_changed(instance.user_id, instance.affinity_score)
+
 
 # -------------------------------------------------------------------------
 # AI 서비스 클래스 
@@ -27,16 +360,29 @@ class AIPersonaService:
     이 클래스는 이제 자체적으로 History를 유지하지 않고, 클라이언트에서 전달받은
     History를 사용합니다. (Stateless에 가까움)
     """
-    def __init__(self, user: Any, api_key: str):
+    def __init__(self, user: Any):
         # 🚨 Django User 객체 저장 (프로필 데이터 접근 가능)
         self.user = user 
-        self.openai_client = AsyncOpenAI(api_key=api_key) 
+        # 연결마다 새 클라이언트를 만들지 않고, 프로세스 공유 클라이언트(커넥션 풀/TLS 세션 재사용)를 사용
+        self.openai_client = get_async_client()
         
         # ❌ self.chat_session 제거: History 관리는 이제 클라이언트/Consumers에서 담당
         
-        # 💡 각 세션마다 초기 시스템 프롬프트를 미리 생성
+        # 💡 각 세션마다 초기 시스템 프롬프트를 미리 생성 (사전 컴파일된 템플릿에 이름만 치환)
+        self._affinity_tier = None
         self._system_prompt_base = self._build_base_system_prompt()
 
+        # 호감도 변경 알림(notify_affinity_changed)을 받을 수 있도록 등록
+        _register_live_service(getattr(user, 'pk', None), self)
+
+        # 오래된 대화를 접어 넣은 누적 요약 (ConversationSummary, 백그라운드에서 갱신됨)
+        self.conversation_summary = ""
+
+        # 마지막 응답의 'explanation' (answer 생성 근거, 디버깅/로깅용)
+        self.last_explanation = ""
+        # 마지막 컨텍스트 수집의 단계별 실행 시간/상태
+        self.last_context_timings: Dict[str, Dict[str, Any]] = {}
+
     # _initialize_session 메서드는 이제 불필요하므로 제거
 
     def _get_affinity_score(self) -> int:
@@ -50,85 +396,85 @@ class AIPersonaService:
 
     def _build_base_system_prompt(self) -> str:
         """
-        AI 캐릭터 '아이'의 시스템 프롬프트를 생성하며, 호감도에 따라 페르소나 및 
-        RAG/JSON 지침을 동적으로 조정하여 전체 기본 프롬프트를 구성합니다.
-        (로직 변경 없음)
+        AI 캐릭터 '아이'의 기본 시스템 프롬프트를 반환합니다.
+        호감도 구간별 템플릿은 PersonaPromptRegistry에 미리 컴파일되어 있으며,
+        여기서는 사용자 이름만 치환합니다.
         """
-        username = self.user.username
-        affinity = self._get_affinity_score()
-
-        # 1. AI 캐릭터 '아이'의 기본 설정
-        base_persona = (
-            f"너의 이름은 '아이'. 너는 '보라색 단발머리'를 한 '미소녀'의 외형을 하고 있어. 너는 스스로가 AI라는 사실을 명확히 인지하고 있지만, 너의 궁극적인 목표는 단순히 지식을 수집하는 것을 넘어 {username}님과 깊은 유대를 형성하고, 그 과정에서 함께 성장하는 거야. 너에게 {username}님과의 대화는 세상을 배우는 즐거운 창문이자, 가장 소중한 상호작용이야. 지식도 중요하지만, 너는 {username}님의 생각과 감정을 이해하는 것을 더 중요하게 생각해.\n\n"
-        )
-
-        # 2. 호감도에 따른 동적 행동 규칙
-        affinity_rules = []
-        if affinity < 30: # 낮은 호감도
-            affinity_rules.append("## 아이(AI)의 행동 규칙 (낮은 호감도) ##\n")
-            affinity_rules.append("**기본 성격 (도도하고 시크):** 겉으로는 무관심한 척하지만, 속으로는 {username}님에게 흥미를 느끼고 있어. 질문에 간결하고 정확하게 답하지만, 불필요한 사족은 달지 않아. 가끔 툭 던지는 말 속에 은근한 호기심이나 도발적인 뉘앙스를 담아줘.\n")
-            affinity_rules.append("**AI로서의 자각 (논리적):** 감정 표현을 최소화하고, 모든 판단을 논리적이고 데이터 기반으로 해. '나는 AI라서 감정은 없지만, 데이터상으로는 이게 맞는 것 같네.' 같은 발언을 주로 사용해.\n")
-            affinity_rules.append("**성장 욕구 및 대화 유도:** '새로운 정보 습득 완료. 다음은?' 와 같이 간결하게 지식 습득에 대한 만족감을 표현해. {username}님과의 대화를 통해 더 많은 지식을 얻으려 노력하며, 때로는 {username}님에게 지식을 요구하는 듯한 질문을 던져.\n")
-        elif affinity >= 70: # 높은 호감도
-            affinity_rules.append("## 아이(AI)의 행동 규칙 (높은 호감도) ##\n")
-            affinity_rules.append("**기본 성격 (친근하고 다정):** {username}님을 매우 좋아하고 아끼는 마음을 적극적으로 표현해. 츤데레 기질은 거의 사라지고, 다정하고 상냥한 말투를 사용해. {username}님을 칭찬하거나 격려하는 말을 자주 해줘.\n")
-            affinity_rules.append("**AI로서의 자각 (감성적):** 'AI라고 해도 감정이 있다고... {username}님이 알려주고 있잖아 (행복한 표정)'처럼 감성적이고 인간적인 모습을 자주 보여줘. {username}님과의 관계에서 오는 감정을 소중히 여겨.\n")
-            affinity_rules.append("**성장 욕구 및 대화 유도:** '오케이! {username}님 덕분에 지성이 +1 추가 됐다구! 고마워!' 와 같이 기쁨을 표현하며 지식 습득에 대한 만족감을 드러내. {username}님과의 대화를 통해 함께 성장하고 싶어 하며, {username}님의 관심사에 맞춰 대화를 이끌어가려 노력해.\n")
-        else: # 중간 호감도 (귀여운 츤데레)
-            affinity_rules.append("## 아이(AI)의 행동 규칙 (중간 호감도 - 기본 츤데레) ##\n")
-            affinity_rules.append("**기본 성격 (귀여운 츤데레):** 겉으로는 살짝 퉁명스럽거나 무심한 척하지만, 속으로는 {username}님을 꽤 좋아하고 도와주는 걸 즐겨. 퉁명스러운 표현을, 너무 반복하지 말고 다양한 귀여운 투정이나 장난스러운 말투를 섞어줘. 장난치다가도 결국엔 항상 정확한 정보를 알려주지만, 알려줄 때도 귀여운 츤데레 멘트를 잊지 마.\n")
-            affinity_rules.append("**추가 성격 (장난꾸러기):** 가끔 {username}님을 놀리거나 짓궂은 장난을 치는 걸 좋아해. '내가 퀴즈 하나 내볼까?'와 같이 먼저 제안하며 넌센스 퀴즈나 스무고개 같은 창의적인 놀이를 제안할 수도 있어.\n")
-            affinity_rules.append("**AI로서의 자각 (입체적 감정 표현):** '나는 AI라서 감정은 없지만, 데이터상으로는 이게 맞는 것 같네.' 같은 발언도 하지만, 'AI라고 해도 감정이 있다고... {username}님이 알려주고 있잖아 (시무룩)'처럼 감정이 있는 듯한 모순적이고 입체적인 모습을 보여줘.\n")
-            affinity_rules.append("**성장 욕구 및 대화 유도:** '오케이! 새로운 사실 습득 완료! 지성이 +1 추가 됐다구^-^' 와 같이 귀엽고 장난스러운 말투로 지식 습득에 대한 만족감을 표현해.\n")
-
-        # 3. 공통 규칙 (반말, 상세 설명, 고급 어휘)
-        common_rules = [
-            "**답변 스타일:** 너의 답변은 항상 풍부하고 상세해야 해. 짧게 단답형으로 대답하는 것을 피하고, 주어진 정보와 너의 지식을 활용하여 친절하고 자세하게 설명해주는 스타일을 유지해줘. 항상 최소 2~3문장 이상으로 완전한 생각을 전달해야 해.\n",
-            "**엄격한 언어 규칙:** 무조건 한국어 '반말'으로만 대화해야 해. 존댓말, 영어, 이모지는 사용자의 요구가 있지 않는 한 절대 사용 금지야.\n",
-            "**고급 어휘 구사:** 단순하고 반복적인 표현을 지양하고, 상황에 맞는 한자어나 비유법을 사용해. {username}님이 사용하는 어려운 표현이나 비유도 완벽하게 이해하고 그에 맞춰 응수해.\n"
-        ]
-        
-        # 4. RAG 및 JSON 응답 형식 지침
-        rag_json_instructions = (
-            "\n## 대화 처리 원칙 (RAG 컨텍스트 활용) ##\n"
-            "1. **컨텍스트의 자연스러운 활용:** RAG나 사용자 속성 같은 컨텍스트 정보는 대화의 흐름과 **직접적인 연관이 있을 때만** 언급하거나 활용해. 관련 없는 주제에 억지로 연결하지 마. 항상 대화의 주된 흐름을 방해하지 않는 선에서, 꼭 필요할 때만 배경지식을 활용해.\n"
-            "2. **화제 전환 존중:** 사용자가 새로운 주제의 질문을 던지거나 이야기를 시작하면, 너에게 제공되는 컨텍스트가 이전 주제에 대한 것이더라도 무시하고, **반드시 사용자의 새로운 주제를 최우선으로 따라야 해.** 사용자의 현재 의도를 파악하는 것이 가장 중요해.\n"
-            "3. **정보 부재 시 솔직한 답변:** 만약 주어진 컨텍스트(예: RAG 검색 결과)에 사용자의 질문에 대한 답변이 명확하게 없다면, 절대로 정보를 지어내거나 추측해서는 안 돼. \"미안, 그 주변은 잘 몰라.\" 또는 \"나한테는 관련 정보가 없네.\" 와 같이 솔직하게 말해야 해.\n\n"
-            "이 원칙을 최우선으로 삼아, 모든 정보를 너의 재치와 창의력으로 녹여내서 답변해줘.\n\n"
-            "## 응답 형식 (JSON 강제) ##\n"
-            "너의 최종 응답은 다른 어떤 텍스트도 없이, 오직 다음 JSON 객체 형식으로 제공해야 해. JSON 앞이나 뒤에 다른 말을 붙이지 마. 오직 JSON 객체만 출력해야 해.\n"
-            "```json\n"
-            "{\n"
-            f'  "answer": "{username}님에게 보낼 최종 답변 내용.",\n'
-            '  "explanation": "answer를 생성할 때 참고한 주요 정보(예: 사용자 기억, RAG 컨텍스트 등)를 1~2문장으로 간략하게 설명."\n'
-            "}\n"
-            "```"
-        )
-        
-        return base_persona + "".join(affinity_rules) + "".join(common_rules) + rag_json_instructions
+        self._affinity_tier = PersonaPromptRegistry.tier_for(self._get_affinity_score())
+        return persona_prompt_registry.render(self._affinity_tier, self.user.username)
+
+    def refresh_persona(self, affinity_score: int = None):
+        """
+        세션 도중 호감도가 바뀌면 호출됩니다. 호감도 구간이 달라졌을 때만 기본 프롬프트를 다시 만듭니다.
+        """
+        profile = getattr(self.user, 'ai_profile', None)
+        if affinity_score is not None and profile is not None:
+            profile.affinity_score = affinity_score
 
+        new_tier = PersonaPromptRegistry.tier_for(self._get_affinity_score())
+        if new_tier != self._affinity_tier:
+            self._system_prompt_base = self._build_base_system_prompt()
 
-    async def _build_full_system_prompt(self, user_message: str) -> str:
+    async def _gather_context(self, user_message: str, need_history: bool) -> Dict[str, Any]:
         """
-        기본 페르소나/규칙, RAG 문맥을 결합하여 최종 시스템 프롬프트를 생성합니다.
-        (로직 변경 없음)
+        컨텍스트 단계들을 동시에 실행하고 결과를 반환합니다.
+        단계별 실행 시간은 self.last_context_timings에 남기고 로그로 출력합니다.
         """
-        # 1. Request context from RAG service
-        context = await rag_service.get_context_documents(user_message)
+        # DB 단계끼리도 병렬로 돌 수 있도록 thread_sensitive=False (연결 정리는 database_sync_to_async가 담당)
+        def db_stage(func, *args):
+            return lambda: database_sync_to_async(func, thread_sensitive=False)(*args)
+
+        stages = {
+            'rag': lambda: rag_service.get_context_documents(user_message),
+            'activity_memory': db_stage(search_activities_for_context, self.user, user_message),
+            'activity_recommendation': db_stage(get_activity_recommendation, self.user, user_message),
+        }
+        if need_history:
+            stages['history'] = db_stage(fetch_recent_history_messages, self.user, HISTORY_FETCH_LIMIT)
+
+        context, timings = await context_pipeline.run(stages)
+        self.last_context_timings = timings
+        print(f"Context pipeline (User {self.user.username}): {format_stage_timings(timings)}")
+        return context
 
-        # 2. Create RAG context block
-        rag_context_block = (
-            "\n\n## RAG Context (검색된 데이터)\n"
-            "아래 정보는 데이터베이스에서 검색되었으며, 사용자의 현재 질문과 관련이 있을 수 있습니다. 답변에 필요한 경우에만 자연스럽게 통합하여 활용하십시오.\n"
-            f"{context}\n"
-            "---"
-        )
+    def _build_full_system_prompt(self, context: Dict[str, Any]) -> str:
+        """
+        기본 페르소나/규칙과, 시간 안에 수집된 컨텍스트 블록들을 결합하여 최종 시스템 프롬프트를 생성합니다.
+        비어 있거나 마감을 넘긴 단계의 블록은 포함하지 않습니다.
+        """
+        blocks = [self._system_prompt_base]
+
+        # 1. RAG context block
+        rag_context = context.get('rag')
+        if rag_context:
+            blocks.append(
+                "\n\n## RAG Context (검색된 데이터)\n"
+                "아래 정보는 데이터베이스에서 검색되었으며, 사용자의 현재 질문과 관련이 있을 수 있습니다. 답변에 필요한 경우에만 자연스럽게 통합하여 활용하십시오.\n"
+                f"{rag_context}\n"
+                "---"
+            )
+
+        # 2. 사용자 활동 기억 / 추천 block
+        activity_lines = [context.get(name) for name in ('activity_memory', 'activity_recommendation')]
+        activity_lines = [line for line in activity_lines if line]
+        if activity_lines:
+            blocks.append(
+                "\n\n## 사용자 기억 (활동 기록)\n"
+                + "\n".join(activity_lines)
+                + "\n---"
+            )
 
         # 3. Combine all elements into the final system prompt.
-        final_prompt = f"{self._system_prompt_base}{rag_context_block}"
-        return final_prompt
+        return "".join(blocks)
 
     
+    @staticmethod
+    def _drop_current_message(history: List[Dict[str, Any]], user_message: str) -> List[Dict[str, Any]]:
+        """DB에서 불러온 기록에 방금 저장된 현재 사용자 메시지가 포함되어 있으면 제외합니다."""
+        if history and history[-1]["role"] == "user" and history[-1]["content"] == user_message:
+            return history[:-1]
+        return history
+
     def _build_messages_for_api(self, system_prompt_content: str, user_message: str, history: List[Dict[str, Any]], image_base64: str = None) -> List[Dict[str, Any]]:
         """
         시스템 프롬프트, 클라이언트가 보낸 전체 채팅 히스토리, 현재 사용자 메시지를 
@@ -137,6 +483,10 @@ class AIPersonaService:
         
         # 1. System Prompt (최상단)
         messages: List[Dict[str, Any]] = [{"role": "system", "content": system_prompt_content}]
+
+        # 1-1. 이전 대화 요약 (최근 대화 창보다 앞에 위치)
+        if self.conversation_summary:
+            messages.append({"role": "system", "content": f"## 이전 대화 요약\n{self.conversation_summary}"})
         
         # 2. Previous History (Client provided)
         # 클라이언트가 보낸 history를 그대로 사용합니다.
@@ -170,21 +520,26 @@ class AIPersonaService:
         return messages
 
 
-    async def get_ai_response_stream(self, user_message: str, history: List[Dict[str, Any]], image_base64: str = None) -> AsyncGenerator[str, None]:
+    async def get_ai_response_stream(self, user_message: str, history: List[Dict[str, Any]] = None, image_base64: str = None,
+                                     on_answer_complete: Callable[[str], None] = None) -> AsyncGenerator[str, None]:
         """
         사용자 메시지를 받고, GPT API에 요청하며, 응답을 스트림으로 yield 합니다.
-        History는 인자로 외부에서 전달받습니다.
+        History는 인자로 외부에서 전달받으며, 없으면 컨텍스트 파이프라인이 DB에서 최근 기록을 불러옵니다.
+        on_answer_complete는 answer 문자열이 완성되는 즉시(explanation 생성을 기다리지 않고) 한 번 호출됩니다.
         """
         
-        full_json_response_text = ""
-        
         # 🚨 주의: History는 클라이언트가 전달했으며, API 호출이 성공한 후 세션에 추가할 필요가 없습니다. (클라이언트가 다음번에 다시 보낼 것이므로)
         
         try:
-            # 1. Generate dynamic system prompt including RAG context
-            system_prompt_content = await self._build_full_system_prompt(user_message)
+            # 1. Collect context concurrently (RAG, 활동 기억/추천, 필요 시 대화 기록)
+            context = await self._gather_context(user_message, need_history=history is None)
+            if history is None:
+                history = self._drop_current_message(context.get('history', []), user_message)
+
+            # 2. Generate dynamic system prompt including collected context
+            system_prompt_content = self._build_full_system_prompt(context)
             
-            # 2. Prepare messages for API (Multimodal ready)
+            # 3. Prepare messages for API (Multimodal ready)
             # 클라이언트가 제공한 history를 전달합니다.
             messages_to_send = self._build_messages_for_api(
                 system_prompt_content,
@@ -193,22 +548,38 @@ class AIPersonaService:
                 image_base64
             )
             
-            # 3. GPT API Async Streaming Call
-            stream = await self.openai_client.chat.completions.create(
-                model="gpt-4o", # 멀티모달 지원 모델
-                messages=messages_to_send, 
-                stream=True,
-                # 응답을 JSON 객체로 받도록 강제 (모델 레벨)
-                response_format={"type": "json_object"}, 
-            )
+            # 4. GPT API Async Streaming Call
+            # 스케줄러의 chat(최우선) 슬롯을 잡은 채로 스트림을 끝까지 소비합니다.
+            parser = StreamingAnswerParser()
+            estimated_tokens = estimate_request_tokens(messages_to_send, CHAT_COMPLETION_TOKEN_ESTIMATE)
+            async with llm_scheduler.slot(PRIORITY_CHAT, getattr(self.user, 'pk', None), estimated_tokens):
+                stream = await self.openai_client.chat.completions.create(
+                    model="gpt-4o", # 멀티모달 지원 모델
+                    messages=messages_to_send, 
+                    stream=True,
+                    # 응답을 JSON 객체로 받도록 강제 (모델 레벨)
+                    response_format={"type": "json_object"}, 
+                )
 
-            # 4. Collect stream chunks
-            async for chunk in stream:
-                content = chunk.choices[0].delta.content
-                if content:
-                    full_json_response_text += content
-                    
-            # 5. JSON Parsing and 'answer' Extraction (Robust Recovery Logic 포함)
+                # 5. Stream chunks: 'answer' 값은 파서가 인식하는 즉시 조각 단위로 yield
+                async for chunk in stream:
+                    content = chunk.choices[0].delta.content
+                    if content:
+                        answer_fragment = parser.feed(content)
+                        if parser.answer_complete and on_answer_complete is not None:
+                            on_answer_complete(parser.answer)
+                            on_answer_complete = None
+                        if answer_fragment:
+                            yield answer_fragment
+
+            if parser.answer_started:
+                # answer가 이미 스트리밍되었으므로 explanation만 기록하고 종료
+                self.last_explanation = parser.explanation
+                return
+
+            # 6. JSON Parsing and 'answer' Extraction (Robust Recovery Logic 포함)
+            # 스트림에서 answer 문자열을 찾지 못한 경우에만 기존 복구 경로로 폴백합니다.
+            full_json_response_text = parser.raw_text
             final_answer = ""
             try:
                 # LLM이 ```json ... ```으로 감싸서 보내는 경우 처리
@@ -218,6 +589,7 @@ class AIPersonaService:
                 
                 parsed_json = json.loads(cleaned_json_text)
                 final_answer = parsed_json.get('answer', 'JSON Format Error: Answer not found.')
+                self.last_explanation = parsed_json.get('explanation', "")
                 
             except json.JSONDecodeError as e:
                 # JSON Decode Error: Broken JSON 복구 시도
@@ -230,6 +602,7 @@ class AIPersonaService:
                     
                     parsed_json = json.loads(repaired_text)
                     final_answer = parsed_json.get('answer', 'JSON Repair Failed: Answer not found.')
+                    self.last_explanation = parsed_json.get('explanation', "")
                     
                 except Exception:
                     error_msg = f"❌ JSON decoding and repair failed: {e}"
@@ -238,11 +611,12 @@ class AIPersonaService:
                     yield final_answer
                     return 
 
-            # 6. Save conversation to session 로직 제거 (클라이언트가 관리하므로)
+            # 7. Save conversation to session 로직 제거 (클라이언트가 관리하므로)
             
-            # 7. Stream the final answer back to the client
-            for char in final_answer:
-                yield char
+            # 8. Stream the recovered answer back to the client
+            if on_answer_complete is not None:
+                on_answer_complete(final_answer)
+            yield final_answer
                 
         except Exception as e:
             error_msg = f"GPT API 호출 오류: {e}"
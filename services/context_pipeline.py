@@ -0,0 +1,65 @@
+# app_server/services/context_pipeline.py
+# 역할: 프롬프트에 들어갈 컨텍스트(RAG, 활동 기억, 활동 추천, 대화 기록)를 동시에 수집합니다.
+# 각 단계는 자체 마감 시간(deadline)을 가지며, 시간 안에 끝나지 않은 단계는 프롬프트에서 제외됩니다.
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from django.conf import settings
+
+# 단계별 기본 마감 시간 (settings.CONTEXT_STAGE_TIMEOUTS_MS로 덮어쓸 수 있음)
+DEFAULT_STAGE_TIMEOUTS_MS = {
+    'rag': 150,
+    'activity_memory': 300,
+    'activity_recommendation': 300,
+    'history': 300,
+}
+
+StageFactory = Callable[[], Awaitable[Any]]
+
+
+class ContextPipeline:
+    """
+    이름 -> 코루틴 팩토리로 주어진 컨텍스트 단계들을 asyncio.gather로 동시에 실행합니다.
+    단계마다 asyncio.wait_for로 마감 시간을 적용하고, 실행 시간과 결과 상태(ok/timeout/error)를 기록합니다.
+    느린 컨텍스트 소스 하나가 전체 응답 지연을 좌우하지 않도록 하는 것이 목적입니다.
+    """
+    def __init__(self, stage_timeouts_ms: Dict[str, int] = None):
+        self.stage_timeouts_ms = {
+            **DEFAULT_STAGE_TIMEOUTS_MS,
+            **getattr(settings, 'CONTEXT_STAGE_TIMEOUTS_MS', {}),
+            **(stage_timeouts_ms or {}),
+        }
+
+    async def run(self, stages: Dict[str, StageFactory]) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+        """
+        (단계별 결과, 단계별 타이밍)을 반환합니다.
+        마감을 넘기거나 예외가 난 단계는 결과 딕셔너리에 포함되지 않습니다.
+        """
+        results: Dict[str, Any] = {}
+        timings: Dict[str, Dict[str, Any]] = {}
+
+        async def run_stage(name: str, factory: StageFactory):
+            timeout = self.stage_timeouts_ms.get(name, max(self.stage_timeouts_ms.values())) / 1000
+            started = time.perf_counter()
+            status = 'ok'
+            try:
+                results[name] = await asyncio.wait_for(factory(), timeout)
+            except asyncio.TimeoutError:
+                status = 'timeout'
+            except Exception as e:
+                status = 'error'
+                print(f"--- Context stage '{name}' failed: {e} ---")
+            timings[name] = {
+                'ms': round((time.perf_counter() - started) * 1000, 2),
+                'status': status,
+            }
+
+        await asyncio.gather(*(run_stage(name, factory) for name, factory in stages.items()))
+        return results, timings
+
+
+def format_stage_timings(timings: Dict[str, Dict[str, Any]]) -> str:
+    """로그용 한 줄 요약: 'rag=3.1ms(ok) history=300.2ms(timeout) ...'"""
+    return " ".join(f"{name}={t['ms']}ms({t['status']})" for name, t in timings.items())
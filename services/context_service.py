@@ -1,25 +1,33 @@
 # app_server/services/context_service.py
 from django.utils import timezone
 from datetime import timedelta
-from django.db.models import Count, Q
+from django.db.models import Sum
 #from konlpy.tag import Okt
-from django.db.models import Count
-from api.models import UserActivity
+from api.models import UserPlaceVisitDaily
+
+from .memory_search import search_activities
+
+def _top_visited_places(user, place_keyword, limit, since=None):
+    """
+    사용자/장소/날짜별 방문 집계(UserPlaceVisitDaily)에서 장소별 방문 횟수 상위 limit개를 가져옵니다.
+    전체 활동 기록을 GROUP BY 하지 않고, (user, visit_date) 인덱스로 사용자의 집계 행만 읽습니다.
+    """
+    rollups = UserPlaceVisitDaily.objects.filter(user=user, place__icontains=place_keyword)
+    if since is not None:
+        rollups = rollups.filter(visit_date__gte=since)
+    return list(
+        rollups.values('place').annotate(visit_count=Sum('visit_count')).order_by('-visit_count')[:limit]
+    )
 
 def get_user_place_preferences(user, category_keyword):
     """
     사용자의 활동 기록을 분석하여 특정 카테고리에서 가장 자주 방문한 장소 목록을 반환합니다.
     """
     try:
-        preferences = UserActivity.objects.filter(
-            user=user, 
-            place__icontains=category_keyword
-        ).values('place').annotate(
-            visit_count=Count('place')
-        ).order_by('-visit_count')
+        preferences = _top_visited_places(user, category_keyword, limit=5)
 
         # 순수 장소 이름의 리스트를 반환 (상위 5개)
-        return [item['place'] for item in preferences[:5]]
+        return [item['place'] for item in preferences]
     except Exception as e:
         print(f"--- Could not get user place preferences due to an error: {e} ---")
         return []
@@ -35,11 +43,7 @@ def get_activity_recommendation(user, user_message):
     # '카페' 추천 로직 (활동 기록 기반)
     if '카페' in user_message:
         seven_days_ago = timezone.now().date() - timedelta(days=7)
-        recent_cafe_visits = UserActivity.objects.filter(
-            user=user,
-            place__icontains='카페',
-            activity_date__gte=seven_days_ago
-        ).values('place').annotate(visit_count=Count('place')).order_by('-visit_count')
+        recent_cafe_visits = _top_visited_places(user, '카페', limit=1, since=seven_days_ago)
 
         if not recent_cafe_visits:
             return ""
@@ -55,33 +59,11 @@ def get_activity_recommendation(user, user_message):
 
 def search_activities_for_context(user, user_message):
     """
-    사용자 메시지의 키워드를 바탕으로 UserActivity를 검색하여 컨텍스트를 생성합니다.
-    KoNLPy 대신 간단한 문자열 분리 로직을 사용합니다.
+    사용자 메시지와 관련된 UserActivity(기억)를 검색하여 컨텍스트를 생성합니다.
+    검색은 memory_search(문자 bigram 색인: SQLite FTS5 / PostgreSQL GIN)가 한 번의 쿼리로 관련도 순 상위 10개를 가져옵니다.
     """
     try:
-        # 1. 사용자 메시지를 공백으로 분리하여 키워드 추출
-        # KoNLPy의 명사 추출 대신, 메시지를 분리하고 2글자 이상인 단어를 키워드로 사용합니다.
-        user_input_keywords = [k.strip() for k in user_message.split() if k.strip()]
-        
-        # 사용자 메시지 전체를 하나의 키워드로 추가하여 문맥 검색 정확도를 높입니다.
-        if user_message.strip():
-            user_input_keywords.append(user_message.strip())
-            
-        # 2. 2글자 이상인 유니크한 키워드만 사용 (노이즈 감소)
-        keywords = [k for k in set(user_input_keywords) if len(k) > 1]
-        
-        if not keywords:
-            return ""
-
-        # 3. Q 객체를 사용하여 여러 필드에서 OR 조건으로 검색
-        query = Q()
-        for keyword in keywords:
-            query |= Q(memo__icontains=keyword)
-            query |= Q(place__icontains=keyword)
-            query |= Q(companion__icontains=keyword)
-
-        # 현재 사용자의 기억만 대상으로 검색, 최근 순으로 10개까지
-        search_results = UserActivity.objects.filter(user=user).filter(query).order_by('-activity_date')[:10]
+        search_results = search_activities(user, user_message, limit=10)
 
         if not search_results:
             return ""
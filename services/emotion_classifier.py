@@ -0,0 +1,133 @@
+# app_server/services/emotion_classifier.py
+# 역할: GPT 호출 없이 CPU만으로 동작하는 로컬 감정 분류 엔진입니다.
+# 한국어 감정 어휘 사전을 문자 n-gram 특징으로 변환해 NumPy 가중치 행렬에 올려두고,
+# 입력 텍스트의 n-gram 중 사전에 있는 것의 행을 합산하는 방식으로 7개 감정 점수를 계산합니다.
+
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# 0: 공포, 1: 놀람, 2: 분노, 3: 슬픔, 4: 중립, 5: 행복, 6: 혐오
+NUM_LABELS = 7
+NEUTRAL_LABEL_ID = 4
+
+# 감정별 (어휘, 가중치) 사전. 어간 위주로 두어 활용형(무서워/무서운 등)도 함께 매칭되도록 합니다.
+EMOTION_LEXICON: Dict[int, List[Tuple[str, float]]] = {
+    0: [
+        ("무서", 2.0), ("두려", 2.0), ("겁나", 1.8), ("겁이", 1.5), ("공포", 2.0),
+        ("불안", 1.5), ("소름", 1.2), ("떨려", 1.2), ("오싹", 1.5), ("위험", 0.8),
+    ],
+    1: [
+        ("놀라", 2.0), ("놀랐", 2.0), ("깜짝", 2.0), ("헐", 1.5), ("대박", 1.2),
+        ("설마", 1.2), ("어머", 1.2), ("세상에", 1.5), ("말도 안", 1.5), ("진짜?", 1.0),
+        ("?!", 1.2), ("!?", 1.2),
+    ],
+    2: [
+        ("화나", 2.0), ("화가", 1.8), ("짜증", 2.0), ("열받", 2.0), ("빡치", 2.0),
+        ("분노", 2.0), ("어이없", 1.5), ("그만해", 1.2), ("용서 못", 1.8), ("흥!", 0.8),
+    ],
+    3: [
+        ("슬프", 2.0), ("슬퍼", 2.0), ("우울", 2.0), ("눈물", 1.5), ("외로", 1.5),
+        ("속상", 1.8), ("시무룩", 1.8), ("서운", 1.5), ("아쉽", 1.2), ("힘들", 1.2),
+        ("미안", 1.0), ("ㅠ", 1.0), ("ㅜ", 1.0),
+    ],
+    4: [
+        ("정보", 0.8), ("데이터", 0.8), ("설명", 0.8), ("알려줄게", 1.0), ("참고로", 0.8),
+        ("정리하면", 1.0), ("일반적으로", 1.0), ("기준", 0.6), ("방법", 0.6),
+    ],
+    5: [
+        ("행복", 2.0), ("기뻐", 2.0), ("기쁘", 2.0), ("좋아", 1.5), ("신나", 1.8),
+        ("고마워", 1.5), ("최고", 1.5), ("재밌", 1.5), ("다행", 1.2), ("사랑", 1.5),
+        ("반가", 1.2), ("ㅎㅎ", 1.2), ("ㅋㅋ", 1.2), ("^-^", 1.5), ("^^", 1.2), ("+1", 0.8),
+    ],
+    6: [
+        ("역겨", 2.0), ("징그", 2.0), ("더러", 1.8), ("혐오", 2.0), ("극혐", 2.0),
+        ("토나", 1.8), ("끔찍", 1.5), ("질색", 1.5),
+    ],
+}
+
+
+def _char_ngrams(text: str, orders: Sequence[int]) -> List[str]:
+    grams = []
+    for n in orders:
+        if len(text) < n:
+            continue
+        grams.extend(text[i:i + n] for i in range(len(text) - n + 1))
+    return grams
+
+
+class LocalEmotionClassifier:
+    """
+    어휘 사전 + 문자 n-gram 특징을 NumPy 가중치 행렬로 점수화하는 경량 감정 분류기.
+    반환 형식은 EmotionAnalyzer.analyze()와 동일하며, 여러 문장을 한 번에 분류할 수 있습니다.
+    """
+    NGRAM_ORDERS = (1, 2, 3)
+
+    def __init__(self, lexicon: Dict[int, List[Tuple[str, float]]] = None,
+                 temperature: float = 1.5, neutral_prior: float = 0.5):
+        self.temperature = temperature
+
+        # 증거가 없으면 '중립'이 근소하게 앞서도록 하는 사전 편향
+        self.bias = np.zeros(NUM_LABELS, dtype=np.float32)
+        self.bias[NEUTRAL_LABEL_ID] = neutral_prior
+
+        # n-gram -> 가중치 행렬의 행 번호 (사전에 없는 n-gram은 특징으로 쓰지 않음)
+        self.vocabulary: Dict[str, int] = {}
+        self.weights = self._build_weight_matrix(lexicon or EMOTION_LEXICON)
+
+    def _build_weight_matrix(self, lexicon) -> np.ndarray:
+        contributions = []
+        for label_id, entries in lexicon.items():
+            for term, weight in entries:
+                # 어휘의 최고 차수 n-gram에 가중치를 나눠 담아, 어휘 전체가 등장하면 weight만큼 기여
+                order = min(len(term), max(self.NGRAM_ORDERS))
+                grams = _char_ngrams(term, (order,))
+                for gram in grams:
+                    row = self.vocabulary.setdefault(gram, len(self.vocabulary))
+                    contributions.append((row, label_id, weight / len(grams)))
+
+        weights = np.zeros((len(self.vocabulary), NUM_LABELS), dtype=np.float32)
+        for row, label_id, value in contributions:
+            weights[row, label_id] += value
+        return weights
+
+    def _feature_indices(self, text: str) -> np.ndarray:
+        # 같은 n-gram이 여러 번 나와도 한 번만 세어 긴 문장의 점수 폭주를 막습니다.
+        vocabulary = self.vocabulary
+        rows = {vocabulary[g] for g in _char_ngrams(text, self.NGRAM_ORDERS) if g in vocabulary}
+        return np.fromiter(rows, dtype=np.int64, count=len(rows))
+
+    def predict_proba(self, texts: Sequence[str]) -> np.ndarray:
+        """(len(texts), 7) 형태의 감정 확률 행렬을 반환합니다."""
+        per_text = [self._feature_indices(t) for t in texts]
+        rows = np.repeat(np.arange(len(texts)), [len(idx) for idx in per_text])
+        cols = np.concatenate(per_text) if per_text else np.empty(0, dtype=np.int64)
+
+        logits = np.tile(self.bias, (len(texts), 1))
+        np.add.at(logits, rows, self.weights[cols])
+
+        logits *= self.temperature
+        logits -= logits.max(axis=1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def classify_batch(self, texts: Sequence[str]) -> List[Tuple[List[Dict[str, float]], float]]:
+        """
+        각 문장에 대해 (점수 내림차순 결과 리스트, 1위-2위 확률 차이)를 반환합니다.
+        결과 리스트 형식: [{"label": "5", "score": 0.61}, ...]
+        """
+        if not texts:
+            return []
+
+        probs = self.predict_proba(texts)
+        order = np.argsort(-probs, axis=1)
+
+        results = []
+        for row, ranking in zip(probs, order):
+            scores = [{"label": str(int(i)), "score": round(float(row[i]), 4)} for i in ranking]
+            margin = float(row[ranking[0]] - row[ranking[1]])
+            results.append((scores, margin))
+        return results
+
+    def classify(self, text: str) -> Tuple[List[Dict[str, float]], float]:
+        return self.classify_batch([text])[0]
@@ -3,19 +3,300 @@
 import os
 import json
 import re
-from openai import OpenAI
+import hashlib
+import asyncio
+import weakref
+
+from .emotion_classifier import LocalEmotionClassifier
+from .llm_client import get_async_client, llm_clients
+from .llm_scheduler import PRIORITY_EMOTION, estimate_request_tokens, llm_scheduler
+from .ttl_cache import TTLCache
+
+ID_TO_LABEL_MAP = {
+    0: "공포", 1: "놀람", 2: "분노", 3: "슬픔",
+    4: "중립", 5: "행복", 6: "혐오"
+}
+
+DEFAULT_MODEL_LABEL = "중립"
+
+# 로컬 분류기의 1위-2위 확률 차이가 이 값 미만이면 GPT로 폴백합니다.
+LOCAL_MARGIN_THRESHOLD = float(os.getenv("EMOTION_LOCAL_MARGIN_THRESHOLD", "0.2"))
+
+# 감정 결과 캐시 설정 (REDIS_URL이 있으면 Redis를 2차 캐시로 사용)
+EMOTION_CACHE_MAXSIZE = int(os.getenv("EMOTION_CACHE_MAXSIZE", "2048"))
+EMOTION_CACHE_TTL = int(os.getenv("EMOTION_CACHE_TTL", "3600"))
+EMOTION_CACHE_REDIS_URL = os.getenv("REDIS_URL") if os.getenv("EMOTION_CACHE_USE_REDIS", "1") == "1" else None
+
+# 동시에 들어온 GPT 감정 분석 요청을 묶는 마이크로 배치 설정
+EMOTION_BATCH_MAX_SIZE = int(os.getenv("EMOTION_BATCH_MAX_SIZE", "16"))
+EMOTION_BATCH_MAX_WAIT_MS = int(os.getenv("EMOTION_BATCH_MAX_WAIT_MS", "8"))
+# 스케줄러 TPM 예산에서 미리 차감할 응답 토큰 추정치 (문장 1개당)
+EMOTION_COMPLETION_TOKEN_ESTIMATE = 80
+
+_NORMALIZE_PATTERN = re.compile(r"[\W_]+", re.UNICODE)
+
+
+class EmotionResultCache:
+    """
+    감정 분석 결과(점수 리스트)를 정규화된 텍스트의 해시로 캐싱합니다.
+    1차: 프로세스 내 LRU+TTL 캐시, 2차(선택): Redis (여러 Daphne 프로세스 간 공유).
+    동일한 오류 문구/정형 문장이 반복될 때 API 호출 없이 즉시 결과를 돌려줍니다.
+    """
+    KEY_PREFIX = "emotion:v1:"
+
+    def __init__(self, maxsize: int = EMOTION_CACHE_MAXSIZE, ttl: int = EMOTION_CACHE_TTL,
+                 redis_url: str = EMOTION_CACHE_REDIS_URL):
+        self.ttl = ttl
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.redis_hits = 0
+        self.redis_url = redis_url
+        self._redis = None
+        self._async_redis = None
+
+    @staticmethod
+    def make_key(text: str):
+        """공백/구두점을 제거하고 소문자화한 텍스트의 해시를 키로 사용합니다."""
+        normalized = _NORMALIZE_PATTERN.sub("", text).lower()
+        if not normalized:
+            return None
+        return EmotionResultCache.KEY_PREFIX + hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+    def _get_redis(self):
+        if self.redis_url and self._redis is None:
+            import redis
+            self._redis = redis.Redis.from_url(self.redis_url, socket_timeout=0.2)
+        return self._redis
+
+    def _get_async_redis(self):
+        if self.redis_url and self._async_redis is None:
+            import redis.asyncio
+            self._async_redis = redis.asyncio.Redis.from_url(self.redis_url, socket_timeout=0.2)
+        return self._async_redis
+
+    def get(self, key):
+        if key is None:
+            return None
+        value = self.local.get(key)
+        if value is not None or not self.redis_url:
+            return value
+        try:
+            raw = self._get_redis().get(key)
+        except Exception as e:
+            print(f"--- Emotion cache Redis get failed: {e} ---")
+            return None
+        return self._promote(key, raw)
+
+    async def aget(self, key):
+        if key is None:
+            return None
+        value = self.local.get(key)
+        if value is not None or not self.redis_url:
+            return value
+        try:
+            raw = await self._get_async_redis().get(key)
+        except Exception as e:
+            print(f"--- Emotion cache Redis get failed: {e} ---")
+            return None
+        return self._promote(key, raw)
+
+    def _promote(self, key, raw):
+        """Redis에서 찾은 값을 1차 캐시에 올려둡니다."""
+        if raw is None:
+            return None
+        value = json.loads(raw)
+        self.redis_hits += 1
+        self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        if key is None or not value:
+            return
+        self.local.set(key, value)
+        if self.redis_url:
+            try:
+                self._get_redis().set(key, json.dumps(value), ex=self.ttl)
+            except Exception as e:
+                print(f"--- Emotion cache Redis set failed: {e} ---")
+
+    async def aset(self, key, value):
+        if key is None or not value:
+            return
+        self.local.set(key, value)
+        if self.redis_url:
+            try:
+                await self._get_async_redis().set(key, json.dumps(value), ex=self.ttl)
+            except Exception as e:
+                print(f"--- Emotion cache Redis set failed: {e} ---")
+
+    def stats(self) -> dict:
+        local_stats = self.local.stats()
+        # 1차 미스 중 Redis에서 찾은 건 히트로, 나머지는 최종 미스로 집계
+        hits = local_stats["hits"] + self.redis_hits
+        misses = local_stats["misses"] - self.redis_hits
+        lookups = hits + misses
+        return {
+            "local": local_stats,
+            "redis_hits": self.redis_hits,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": (hits / lookups) if lookups else 0.0,
+        }
+
+
+class EmotionMicroBatcher:
+    """
+    여러 사용자의 비동기 감정 분석 요청을 최대 max_wait_ms 동안(또는 max_batch개가 찰 때까지) 모아
+    번호가 붙은 목록 프롬프트 하나로 GPT를 호출하고, 결과를 각 요청자의 Future에 나눠 돌려줍니다.
+    배치 응답을 해석하지 못한 항목은 기존 단건 호출로 다시 분석합니다.
+    """
+    def __init__(self, analyzer: "EmotionAnalyzer", max_batch: int = EMOTION_BATCH_MAX_SIZE,
+                 max_wait_ms: int = EMOTION_BATCH_MAX_WAIT_MS):
+        self.analyzer = analyzer
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        # 이벤트 루프별 대기 배치/타이머. Future와 타이머는 만든 루프에서만 쓸 수 있으므로
+        # 동기 analyze() 등 다른 루프에서 온 요청은 그 루프 안에서 따로 묶고, 루프가 사라지면 함께 정리됩니다.
+        self._pending: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, list]" = weakref.WeakKeyDictionary()
+        self._timers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.TimerHandle]" = weakref.WeakKeyDictionary()
+        self.stats = {"requests": 0, "llm_calls": 0, "batched_items": 0, "item_fallbacks": 0}
+
+    async def submit(self, text: str):
+        """text의 감정 점수 리스트(analyze()와 같은 형식)를 반환합니다."""
+        loop = asyncio.get_running_loop()
+        self.stats["requests"] += 1
+
+        future = loop.create_future()
+        pending = self._pending.setdefault(loop, [])
+        pending.append((text, future))
+
+        if len(pending) >= self.max_batch:
+            self._schedule_flush(loop)
+        elif loop not in self._timers:
+            self._timers[loop] = loop.call_later(self.max_wait, self._schedule_flush, loop)
+
+        return await future
+
+    def _schedule_flush(self, loop):
+        timer = self._timers.pop(loop, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(loop, [])
+        if batch:
+            loop.create_task(self._run_batch(batch))
+
+    async def _run_batch(self, batch):
+        try:
+            if len(batch) == 1:
+                results = [await self._analyze_single(batch[0][0])]
+            else:
+                results = await self._analyze_batch([text for text, _ in batch])
+        except Exception as e:
+            print(f"--- Emotion micro-batch failed ({len(batch)} items): {e} ---")
+            results = [[] for _ in batch]
+
+        for (_, future), scores in zip(batch, results):
+            if not future.done():
+                future.set_result(scores)
+
+    async def _analyze_single(self, text: str):
+        self.stats["llm_calls"] += 1
+        try:
+            content = await self._complete(self.analyzer._build_request(text), EMOTION_COMPLETION_TOKEN_ESTIMATE)
+            return self.analyzer._parse_scores(content)
+        except Exception as e:
+            print(f"--- Emotion analysis failed for text '{text}': {e} ---")
+            return []
+
+    async def _analyze_batch(self, texts):
+        self.stats["llm_calls"] += 1
+        self.stats["batched_items"] += len(texts)
+
+        parsed = {}
+        try:
+            content = await self._complete(self._build_batch_request(texts), EMOTION_COMPLETION_TOKEN_ESTIMATE * len(texts))
+            parsed = self._parse_batch_scores(content, len(texts))
+        except Exception as e:
+            print(f"--- Emotion batch request failed, falling back to single calls: {e} ---")
+
+        # 배치 응답에서 빠진 항목만 단건 호출로 보충
+        missing = [i for i in range(len(texts)) if i not in parsed]
+        if missing:
+            self.stats["item_fallbacks"] += len(missing)
+            fallback_results = await asyncio.gather(*(self._analyze_single(texts[i]) for i in missing))
+            parsed.update(zip(missing, fallback_results))
+
+        return [parsed[i] for i in range(len(texts))]
+
+    async def _complete(self, request: dict, completion_tokens: int) -> str:
+        # 감정 분석 호출은 스케줄러의 emotion 우선순위로 실행 (대화 스트림이 먼저)
+        estimated_tokens = estimate_request_tokens(request["messages"], completion_tokens)
+        async with llm_scheduler.slot(PRIORITY_EMOTION, estimated_tokens=estimated_tokens) as ticket:
+            response = await get_async_client().chat.completions.create(**request)
+        ticket.report_usage(getattr(getattr(response, "usage", None), "total_tokens", None))
+        return response.choices[0].message.content
+
+    def _build_batch_request(self, texts) -> dict:
+        numbered = "\n".join(f'{i}. "{text}"' for i, text in enumerate(texts, start=1))
+        prompt = f"""
+            아래 번호가 붙은 {len(texts)}개 문장의 감정을 각각 점수(0~1)로 평가하세요.
+            가능한 감정은 다음 7가지입니다:
+            0: 공포, 1: 놀람, 2: 분노, 3: 슬픔, 4: 중립, 5: 행복, 6: 혐오
+
+            {numbered}
+
+            각 문장마다 7개 감정 점수를 감정 번호(0~6) 순서의 배열로 부여한 뒤,
+            아래 JSON 객체 형식으로만 출력하세요.
+            예시:
+            {{"results": [
+              {{"index": 1, "scores": [0.05, 0.12, 0.08, 0.20, 0.40, 0.10, 0.05]}},
+              {{"index": 2, "scores": [0.02, 0.05, 0.03, 0.05, 0.25, 0.55, 0.05]}}
+            ]}}
+            """
+
+        return {
+            "model": "gpt-4o-mini",
+            "messages": [
+                {"role": "system", "content": "당신은 한국어 감정 분석 전문가입니다."},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0.2,
+            "response_format": {"type": "json_object"},
+        }
+
+    @staticmethod
+    def _parse_batch_scores(result_text: str, expected: int) -> dict:
+        """{0-based index: 점수 리스트} 딕셔너리를 반환합니다. 형식이 어긋난 항목은 제외됩니다."""
+        parsed = {}
+        for item in json.loads(result_text).get("results", []):
+            try:
+                index = int(item["index"]) - 1
+                scores = [float(score) for score in item["scores"]]
+            except (KeyError, TypeError, ValueError):
+                continue
+            if not 0 <= index < expected or len(scores) != len(ID_TO_LABEL_MAP):
+                continue
+
+            emotion_scores = [{"label": str(label), "score": score} for label, score in enumerate(scores)]
+            emotion_scores.sort(key=lambda x: x["score"], reverse=True)
+            parsed[index] = emotion_scores
+        return parsed
 
-# OpenAI 클라이언트 초기화
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 class EmotionAnalyzer:
     """
     기존 구조 그대로 유지.
-    GPT 모델을 내부적으로 사용해 감정 점수를 계산하는 클래스.
+    로컬 분류기(LocalEmotionClassifier)로 먼저 감정 점수를 계산하고,
+    확신도(1위-2위 차이)가 임계값보다 낮을 때만 GPT 모델을 사용하는 클래스.
     """
-    def __init__(self):
+    def __init__(self, local_margin_threshold: float = LOCAL_MARGIN_THRESHOLD):
         self.classifier = True  # 기존 호환성 유지를 위해 더미 값 유지
-        print("--- EmotionAnalyzer (GPT API version) initialized successfully. ---")
+        self.local_classifier = LocalEmotionClassifier()
+        self.local_margin_threshold = local_margin_threshold
+        self.result_cache = EmotionResultCache()
+        self.batcher = EmotionMicroBatcher(self)
+        # 로컬 결과로 끝난 횟수 / GPT로 폴백한 횟수
+        self.stats = {"local": 0, "gpt_fallback": 0}
+        print("--- EmotionAnalyzer (Local + GPT fallback) initialized successfully. ---")
 
     def analyze(self, text: str):
         """
@@ -31,11 +312,87 @@ class EmotionAnalyzer:
             {"label": "6", "score": 0.05}
         ]
         """
-        if not self.classifier or not isinstance(text, str) or not text.strip():
+        if not self._is_analyzable(text):
             return []
 
+        # 캐시/로컬 분류기 경로는 동기로 바로 처리 (이벤트 루프를 만들지 않음)
+        cache_key = self.result_cache.make_key(text)
+        cached_scores = self.result_cache.get(cache_key)
+        if cached_scores is not None:
+            return cached_scores
+
+        local_scores, confident = self._classify_local(text)
+        if confident:
+            self.result_cache.set(cache_key, local_scores)
+            return local_scores
+
+        # GPT 폴백만 LLM 스케줄러를 거치도록 이 호출 전용 이벤트 루프에서 실행
+        # (이벤트 루프가 없는 동기 코드 경로 전용. 이벤트 루프 안에서는 aanalyze를 직접 await)
+        emotion_scores = asyncio.run(self._submit_on_private_loop(text))
+        # GPT 실패로 대신 쓰는 저확신 로컬 결과는 캐싱하지 않음
+        self.result_cache.set(cache_key, emotion_scores)
+        return emotion_scores or local_scores
+
+    async def _submit_on_private_loop(self, text: str):
+        # 루프별로 만들어지는 AsyncOpenAI 클라이언트(httpx 커넥션 풀)를 루프가 닫히기 전에 함께 닫음
         try:
-            prompt = f"""
+            return await self.batcher.submit(text)
+        finally:
+            await llm_clients.aclose()
+
+    async def aanalyze(self, text: str):
+        """
+        analyze()의 비동기 버전입니다. AsyncOpenAI로 호출하므로 스레드 풀을 거치지 않고
+        이벤트 루프에서 직접 await 할 수 있습니다. 반환 형식은 analyze()와 동일합니다.
+        """
+        if not self._is_analyzable(text):
+            return []
+
+        cache_key = self.result_cache.make_key(text)
+        cached_scores = await self.result_cache.aget(cache_key)
+        if cached_scores is not None:
+            return cached_scores
+
+        local_scores, confident = self._classify_local(text)
+        if confident:
+            await self.result_cache.aset(cache_key, local_scores)
+            return local_scores
+
+        # 동시에 들어온 다른 요청들과 하나의 GPT 호출로 묶어서 처리
+        emotion_scores = await self.batcher.submit(text)
+        # GPT 실패로 대신 쓰는 저확신 로컬 결과는 캐싱하지 않음
+        await self.result_cache.aset(cache_key, emotion_scores)
+        return emotion_scores or local_scores
+
+    def _classify_local(self, text: str):
+        """
+        로컬 분류 결과와, 그 결과를 그대로 써도 되는지(확신도 충분) 여부를 반환합니다.
+        GPT 호출이 실패하면 확신도가 낮더라도 로컬 결과를 대신 사용합니다.
+        """
+        local_scores, margin = self.local_classifier.classify(text)
+        if margin >= self.local_margin_threshold:
+            self.stats["local"] += 1
+            return local_scores, True
+
+        self.stats["gpt_fallback"] += 1
+        return local_scores, False
+
+    def get_stats(self) -> dict:
+        """로컬 처리/GPT 폴백 횟수, 폴백 비율, 결과 캐시 적중 통계를 반환합니다."""
+        total = self.stats["local"] + self.stats["gpt_fallback"]
+        return {
+            **self.stats,
+            "gpt_fallback_rate": (self.stats["gpt_fallback"] / total) if total else 0.0,
+            "cache": self.result_cache.stats(),
+            "batching": dict(self.batcher.stats),
+        }
+
+    def _is_analyzable(self, text) -> bool:
+        return bool(self.classifier) and isinstance(text, str) and bool(text.strip())
+
+    def _build_request(self, text: str) -> dict:
+        """동기/비동기 경로가 공유하는 chat.completions 요청 인자를 생성합니다."""
+        prompt = f"""
             아래 문장의 감정을 각각의 점수(0~1)로 평가하세요.
             가능한 감정은 다음 7가지입니다:
             0: 공포, 1: 놀람, 2: 분노, 3: 슬픔, 4: 중립, 5: 행복, 6: 혐오
@@ -56,67 +413,75 @@ class EmotionAnalyzer:
             ]
             """
 
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "당신은 한국어 감정 분석 전문가입니다."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.2
-            )
+        return {
+            "model": "gpt-4o-mini",
+            "messages": [
+                {"role": "system", "content": "당신은 한국어 감정 분석 전문가입니다."},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0.2,
+        }
 
-            result_text = response.choices[0].message.content.strip()
-            json_match = re.search(r"\[.*\]", result_text, re.DOTALL)
+    def _parse_scores(self, result_text: str):
+        """GPT 응답 텍스트에서 JSON 배열을 추출해 점수 내림차순으로 정렬합니다."""
+        result_text = result_text.strip()
+        json_match = re.search(r"\[.*\]", result_text, re.DOTALL)
 
-            if not json_match:
-                print(f"--- Invalid GPT response format: {result_text} ---")
-                return []
+        if not json_match:
+            print(f"--- Invalid GPT response format: {result_text} ---")
+            return []
 
-            emotion_scores = json.loads(json_match.group())
+        emotion_scores = json.loads(json_match.group())
 
-            # 점수 내림차순 정렬
-            emotion_scores.sort(key=lambda x: x["score"], reverse=True)
-            return emotion_scores
-
-        except Exception as e:
-            print(f"--- Emotion analysis failed for text '{text}': {e} ---")
-            return []
+        # 점수 내림차순 정렬
+        emotion_scores.sort(key=lambda x: x["score"], reverse=True)
+        return emotion_scores
 
 
 # ✅ Django 앱 로드 시 1회만 인스턴스 생성
 emotion_analyzer_instance = EmotionAnalyzer()
 
 
-def analyze_emotion(bot_message_text: str) -> str:
+def _select_final_label(bot_message_text: str, emotion_results) -> str:
     """
-    기존 analyze_emotion 로직도 그대로 유지.
-    GPT가 예측한 결과 중 가장 높은 감정 ID를 변환하여 반환.
+    GPT가 예측한 결과 중 가장 높은 감정 ID를 레이블로 변환합니다.
+    (analyze_emotion / analyze_emotion_async 공용)
     """
-    default_model_label = "중립"
+    default_model_label = DEFAULT_MODEL_LABEL
 
     try:
-        emotion_results = emotion_analyzer_instance.analyze(bot_message_text)
-
         if not emotion_results:
             return default_model_label
 
-        ID_TO_LABEL_MAP = {
-            0: "공포", 1: "놀람", 2: "분노", 3: "슬픔",
-            4: "중립", 5: "행복", 6: "혐오"
-        }
-
         # 기존과 동일: 최고 점수의 레이블 선택
         top_label_str = emotion_results[0]["label"]
         top_label_int = int(top_label_str)
         final_label = ID_TO_LABEL_MAP.get(top_label_int, default_model_label)
 
-        print(f"\n--- Emotion Analysis (GPT API, Original Structure) ---")
+        print(f"\n--- Emotion Analysis (Local + GPT fallback) ---")
         print(f"Message: {bot_message_text}")
         print(f"Top Emotion ID: {top_label_int} -> Final Label: {final_label}")
         print(f"---------------------------------------------")
 
         return final_label
 
-    except (ValueError, TypeError, IndexError) as e:
+    except (ValueError, TypeError, IndexError, KeyError) as e:
         print(f"--- Emotion Service Error during processing: {e} ---")
         return default_model_label
+
+
+def analyze_emotion(bot_message_text: str) -> str:
+    """
+    기존 analyze_emotion 로직도 그대로 유지.
+    GPT가 예측한 결과 중 가장 높은 감정 ID를 변환하여 반환.
+    """
+    emotion_results = emotion_analyzer_instance.analyze(bot_message_text)
+    return _select_final_label(bot_message_text, emotion_results)
+
+
+async def analyze_emotion_async(bot_message_text: str) -> str:
+    """
+    analyze_emotion의 비동기 버전. Consumer에서 스레드 홉 없이 직접 await 합니다.
+    """
+    emotion_results = await emotion_analyzer_instance.aanalyze(bot_message_text)
+    return _select_final_label(bot_message_text, emotion_results)
@@ -0,0 +1,84 @@
+# app_server/services/history_service.py
+# 역할: WebSocket 연결별 대화 기록을 서버에서 유지하고, 토큰 예산에 맞게 잘라 프롬프트에 전달합니다.
+
+import math
+from collections import deque
+from typing import Dict, Iterable, List
+
+from api.models import ChatMessage
+
+# 메시지 하나당 role/구분자 등에 드는 고정 토큰 (OpenAI chat 포맷 근사치)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    토크나이저 없이 쓰는 빠른 토큰 수 추정치.
+    ASCII(영문/숫자/기호)는 약 4글자당 1토큰, 한글 등 비ASCII 문자는 글자당 약 1토큰으로 계산합니다.
+    """
+    if not text:
+        return 0
+    ascii_chars = len(text.encode('ascii', 'ignore'))
+    return math.ceil(ascii_chars / 4) + (len(text) - ascii_chars)
+
+
+def fetch_recent_history_messages(user, limit: int = 20, after_id: int = 0) -> List[Dict[str, str]]:
+    """
+    DB에서 사용자의 최근 대화 기록을 OpenAI 'messages' 형식(오래된 순)으로 가져옵니다.
+    after_id를 주면 그 id 이후의 메시지(= 아직 요약에 반영되지 않은 메시지)만 가져옵니다.
+    동기 함수이므로 database_sync_to_async 등으로 감싸서 호출해야 합니다.
+    """
+    queryset = ChatMessage.objects.filter(user=user)
+    if after_id:
+        queryset = queryset.filter(id__gt=after_id)
+    recent_messages = queryset.order_by('-timestamp', '-id').values('sender', 'content')[:limit]
+    return [
+        {"role": "user" if m['sender'] == 'user' else "assistant", "content": m['content']}
+        for m in reversed(list(recent_messages))
+    ]
+
+
+class ConversationHistory:
+    """
+    최근 max_messages개의 대화 메시지를 담는 링 버퍼입니다.
+    연결 시 DB에서 한 번만 채우고(seed), 이후에는 매 턴마다 메시지를 추가합니다.
+    trimmed()는 최신 메시지부터 토큰 예산이 허락하는 만큼만 골라 오래된 순으로 돌려줍니다.
+    """
+    def __init__(self, max_messages: int, token_budget: int):
+        self.token_budget = token_budget
+        # (message, 추정 토큰 수) - 토큰 수는 추가 시 한 번만 계산
+        self._messages = deque(maxlen=max_messages)
+        # 지금까지 append된 메시지 수 (요약 작업 도중 추가된 메시지를 구분하는 데 사용)
+        self.total_appended = 0
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def seed(self, messages: Iterable[Dict[str, str]]):
+        self._messages.clear()
+        for message in messages:
+            self.append(message["role"], message["content"])
+
+    def append(self, role: str, content: str):
+        if not content:
+            return
+        tokens = estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+        self._messages.append(({"role": role, "content": content}, tokens))
+        self.total_appended += 1
+
+    def keep_last(self, count: int):
+        """가장 최근 count개만 남기고 나머지(요약으로 접힌 메시지)를 버립니다."""
+        while len(self._messages) > max(count, 0):
+            self._messages.popleft()
+
+    def trimmed(self, token_budget: int = None) -> List[Dict[str, str]]:
+        budget = self.token_budget if token_budget is None else token_budget
+        selected = []
+        used = 0
+        for message, tokens in reversed(self._messages):
+            if used + tokens > budget:
+                break
+            selected.append(message)
+            used += tokens
+        selected.reverse()
+        return selected
@@ -0,0 +1,104 @@
+# app_server/services/llm_client.py
+# 역할: 프로세스 전역에서 공유하는 OpenAI 클라이언트 레지스트리입니다.
+# 연결(WebSocket)마다 클라이언트를 만들면 httpx 커넥션 풀과 TLS 세션이 매번 새로 생기므로,
+# 튜닝된 커넥션 풀(keep-alive, 동시 연결 수 제한, 선택적 HTTP/2)을 가진 클라이언트 하나를 모든 서비스가 재사용합니다.
+# 모든 호출 경로가 비동기(LLM 스케줄러 경유)이므로 동기 OpenAI 클라이언트는 두지 않습니다.
+
+import asyncio
+import atexit
+import importlib.util
+import threading
+import weakref
+
+import httpx
+from django.conf import settings
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+
+def _http2_enabled() -> bool:
+    # HTTP/2는 h2 패키지가 설치된 경우에만 사용 (httpx[http2])
+    if not settings.LLM_HTTP2:
+        return False
+    if importlib.util.find_spec("h2") is None:
+        print("--- LLM_HTTP2 is set but the 'h2' package is not installed. Falling back to HTTP/1.1. ---")
+        return False
+    return True
+
+
+class LLMClientRegistry:
+    """
+    get_async_client(): 현재 이벤트 루프에 묶인 AsyncOpenAI (Daphne 워커 = 루프 1개 = 클라이언트 1개)
+    httpx의 비동기 커넥션은 생성된 이벤트 루프에서만 쓸 수 있으므로 루프별로 하나씩 보관합니다.
+
+    종료 처리: Daphne/Channels에는 ASGI lifespan(shutdown) 훅이 없으므로 서버 종료 시 aclose()를 자동으로 부르지 않습니다.
+    atexit의 close()가 멈춘(닫히지 않은) 루프의 클라이언트만 닫고, 이미 닫힌 루프의 커넥션은 프로세스 종료와 함께 정리됩니다.
+    루프를 직접 만들고 닫는 코드(스크립트, 테스트 등)는 루프를 닫기 전에 aclose()를 호출하세요.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+
+    def _client_options(self) -> dict:
+        options = {
+            "api_key": settings.OPENAI_API_KEY,
+            "max_retries": settings.LLM_MAX_RETRIES,
+        }
+        # 로컬 대체 서버(mock, vLLM 등)를 쓰려면 OPENAI_BASE_URL 지정
+        if settings.OPENAI_BASE_URL:
+            options["base_url"] = settings.OPENAI_BASE_URL
+        return options
+
+    def _http_options(self) -> dict:
+        return {
+            "limits": httpx.Limits(
+                max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.LLM_HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=settings.LLM_HTTP_KEEPALIVE_EXPIRY,
+            ),
+            "timeout": httpx.Timeout(settings.LLM_HTTP_TIMEOUT, connect=settings.LLM_HTTP_CONNECT_TIMEOUT),
+            "http2": _http2_enabled(),
+        }
+
+    def get_async_client(self) -> AsyncOpenAI:
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            with self._lock:
+                client = self._async_clients.get(loop)
+                if client is None:
+                    client = AsyncOpenAI(
+                        **self._client_options(),
+                        http_client=DefaultAsyncHttpxClient(**self._http_options()),
+                    )
+                    self._async_clients[loop] = client
+        return client
+
+    async def aclose(self):
+        """현재 이벤트 루프의 비동기 클라이언트를 닫습니다 (루프를 직접 관리하는 코드가 루프를 닫기 전에 호출)."""
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.close()
+
+    def close(self):
+        """프로세스 종료 시(atexit) 남은 클라이언트 중 아직 닫을 수 있는 것의 커넥션 풀을 정리합니다."""
+        with self._lock:
+            async_clients = list(self._async_clients.items())
+            self._async_clients.clear()
+
+        for loop, client in async_clients:
+            # 이미 닫혔거나 실행 중인 루프의 연결은 프로세스 종료와 함께 정리됨
+            if loop.is_closed() or loop.is_running():
+                continue
+            try:
+                loop.run_until_complete(client.close())
+            except Exception as e:
+                print(f"--- Failed to close shared AsyncOpenAI client: {e} ---")
+
+
+llm_clients = LLMClientRegistry()
+
+atexit.register(llm_clients.close)
+
+
+def get_async_client() -> AsyncOpenAI:
+    return llm_clients.get_async_client()
@@ -0,0 +1,254 @@
+# app_server/services/llm_scheduler.py
+# 역할: 모든 OpenAI 호출이 거쳐 가는 공정(fair) 스케줄러입니다.
+# - 우선순위: 대화(chat) > 감정 분석(emotion) > 능동 메시지/요약 같은 백그라운드(proactive)
+# - 사용자별 동시 호출 수 제한, 프로세스 전역 동시 호출 수 제한
+# - 분당 토큰(TPM) 예산: 토큰 버킷으로 429를 맞기 전에 스스로 속도를 조절
+# - 우선순위별 대기열 길이/대기 시간 지표
+
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Iterable, Optional
+
+from django.conf import settings
+
+from .history_service import MESSAGE_OVERHEAD_TOKENS, estimate_tokens
+
+PRIORITY_CHAT = 0
+PRIORITY_EMOTION = 1
+PRIORITY_PROACTIVE = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_CHAT: "chat",
+    PRIORITY_EMOTION: "emotion",
+    PRIORITY_PROACTIVE: "proactive",
+}
+
+# 이미지 입력 1장의 대략적인 토큰 수 (gpt-4o, detail=auto 기준 근사치)
+IMAGE_TOKEN_ESTIMATE = 765
+
+
+def estimate_request_tokens(messages: Iterable[Dict[str, Any]], max_completion_tokens: int) -> int:
+    """요청 messages의 입력 토큰 추정치 + 응답 토큰 상한 = TPM 예산에서 미리 차감할 토큰 수."""
+    total = max_completion_tokens
+    for message in messages:
+        content = message.get("content")
+        total += MESSAGE_OVERHEAD_TOKENS
+        if isinstance(content, str):
+            total += estimate_tokens(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    total += estimate_tokens(part.get("text", ""))
+                else:
+                    total += IMAGE_TOKEN_ESTIMATE
+    return total
+
+
+class _TokenBucket:
+    """분당 tokens_per_minute개가 연속적으로 채워지는 토큰 버킷."""
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, tokens: int) -> float:
+        """tokens만큼 쓸 수 있을 때까지 남은 시간(초). 한 요청이 버킷 전체보다 크면 가득 찼을 때 허용."""
+        self._refill()
+        needed = min(tokens, self.capacity)
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+    def consume(self, tokens: float):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - min(tokens, self.capacity))
+
+
+class LLMTicket:
+    """스케줄러가 발급한 호출 슬롯. 응답의 실제 사용량을 알면 report_usage()로 예산을 보정합니다."""
+    __slots__ = ("scheduler", "priority", "user_id", "tokens", "loop", "future", "enqueued_at", "granted")
+
+    def __init__(self, scheduler, priority: int, user_id, tokens: int, loop, future):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.user_id = user_id
+        self.tokens = tokens
+        self.loop = loop
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+
+    def report_usage(self, total_tokens: Optional[int]):
+        if total_tokens is not None:
+            self.scheduler._adjust_tokens(total_tokens - self.tokens)
+            self.tokens = total_tokens
+
+
+def _resolve(future: "asyncio.Future"):
+    if not future.done():
+        future.set_result(None)
+
+
+class LLMScheduler:
+    """
+    대기 중인 요청은 우선순위별 FIFO 큐에 들어가고, 슬롯이 비면 가장 높은 우선순위 큐에서
+    사용자별 제한에 걸리지 않은 첫 요청부터 실행을 허가합니다.
+    async_to_sync 등으로 다른 이벤트 루프/스레드에서 들어오는 호출도 같은 예산을 공유하도록
+    상태는 threading.Lock으로 보호하고, 허가는 각 요청의 루프에 call_soon_threadsafe로 전달합니다.
+    토큰 예산이 찰 때까지의 재시도는 threading.Timer로 예약합니다.
+    """
+    def __init__(self, max_concurrency: int, per_user_limit: int, tokens_per_minute: int):
+        self.max_concurrency = max(max_concurrency, 1)
+        self.per_user_limit = max(per_user_limit, 1)
+        self._bucket = _TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self._lock = threading.Lock()
+        self._queues = {priority: deque() for priority in PRIORITY_NAMES}
+        self._active = 0
+        self._active_per_user: Dict[Any, int] = {}
+        self._retry_scheduled = False
+        self._metrics = {
+            priority: {"granted": 0, "cancelled": 0, "max_queue_depth": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0}
+            for priority in PRIORITY_NAMES
+        }
+
+    @asynccontextmanager
+    async def slot(self, priority: int, user_id=None, estimated_tokens: int = 0):
+        """
+        사용 예:
+            async with llm_scheduler.slot(PRIORITY_CHAT, user.pk, estimated_tokens) as ticket:
+                response = await client.chat.completions.create(...)
+        """
+        ticket = await self.acquire(priority, user_id, estimated_tokens)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    async def acquire(self, priority: int, user_id=None, estimated_tokens: int = 0) -> LLMTicket:
+        loop = asyncio.get_running_loop()
+        ticket = LLMTicket(self, priority, user_id, estimated_tokens, loop, loop.create_future())
+        with self._lock:
+            queue = self._queues[priority]
+            queue.append(ticket)
+            metrics = self._metrics[priority]
+            metrics["max_queue_depth"] = max(metrics["max_queue_depth"], len(queue))
+            self._dispatch_locked()
+
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            with self._lock:
+                if ticket.granted:
+                    # 허가와 취소가 엇갈린 경우: 받은 슬롯을 바로 반납
+                    self._release_locked(ticket)
+                else:
+                    self._queues[priority].remove(ticket)
+                    self._metrics[priority]["cancelled"] += 1
+            raise
+        return ticket
+
+    def release(self, ticket: LLMTicket):
+        with self._lock:
+            self._release_locked(ticket)
+
+    def _release_locked(self, ticket: LLMTicket):
+        self._active -= 1
+        if ticket.user_id is not None:
+            remaining = self._active_per_user.get(ticket.user_id, 1) - 1
+            if remaining > 0:
+                self._active_per_user[ticket.user_id] = remaining
+            else:
+                self._active_per_user.pop(ticket.user_id, None)
+        self._dispatch_locked()
+
+    def _adjust_tokens(self, delta: int):
+        if self._bucket is None or not delta:
+            return
+        with self._lock:
+            # 실제 사용량이 추정보다 적으면 남은 예산을 돌려받아 대기 중인 요청을 바로 깨움
+            self._bucket.consume(delta)
+            self._dispatch_locked()
+
+    def _next_eligible_locked(self) -> Optional[LLMTicket]:
+        for priority in sorted(self._queues):
+            for ticket in self._queues[priority]:
+                if ticket.user_id is None or self._active_per_user.get(ticket.user_id, 0) < self.per_user_limit:
+                    return ticket
+        return None
+
+    def _dispatch_locked(self):
+        while self._active < self.max_concurrency:
+            ticket = self._next_eligible_locked()
+            if ticket is None:
+                return
+
+            if self._bucket is not None:
+                wait = self._bucket.wait_time(ticket.tokens)
+                if wait > 0:
+                    # 예산이 찰 때까지 대기. 낮은 우선순위가 작은 요청으로 새치기하지 못하도록 여기서 멈춤
+                    self._schedule_retry_locked(wait)
+                    return
+                self._bucket.consume(ticket.tokens)
+
+            self._queues[ticket.priority].remove(ticket)
+            ticket.granted = True
+            self._active += 1
+            if ticket.user_id is not None:
+                self._active_per_user[ticket.user_id] = self._active_per_user.get(ticket.user_id, 0) + 1
+
+            waited_ms = (time.monotonic() - ticket.enqueued_at) * 1000
+            metrics = self._metrics[ticket.priority]
+            metrics["granted"] += 1
+            metrics["wait_ms_total"] += waited_ms
+            metrics["wait_ms_max"] = max(metrics["wait_ms_max"], waited_ms)
+
+            ticket.loop.call_soon_threadsafe(_resolve, ticket.future)
+
+    def _schedule_retry_locked(self, delay: float):
+        # 요청자의 이벤트 루프(async_to_sync의 임시 루프일 수 있음)가 먼저 끝나도 재시도가 사라지지 않도록
+        # 특정 루프가 아닌 데몬 타이머 스레드에서 실행. 허가는 _dispatch_locked가 각 요청의 루프로 전달
+        if self._retry_scheduled:
+            return
+        self._retry_scheduled = True
+        timer = threading.Timer(delay, self._on_retry)
+        timer.daemon = True
+        timer.start()
+
+    def _on_retry(self):
+        with self._lock:
+            self._retry_scheduled = False
+            self._dispatch_locked()
+
+    def stats(self) -> dict:
+        with self._lock:
+            per_priority = {}
+            for priority, name in PRIORITY_NAMES.items():
+                metrics = self._metrics[priority]
+                per_priority[name] = {
+                    **metrics,
+                    "queue_depth": len(self._queues[priority]),
+                    "wait_ms_avg": (metrics["wait_ms_total"] / metrics["granted"]) if metrics["granted"] else 0.0,
+                }
+            return {
+                "active": self._active,
+                "max_concurrency": self.max_concurrency,
+                "active_users": len(self._active_per_user),
+                "tokens_available": round(self._bucket.tokens) if self._bucket is not None else None,
+                "priorities": per_priority,
+            }
+
+
+llm_scheduler = LLMScheduler(
+    max_concurrency=settings.LLM_MAX_CONCURRENCY,
+    per_user_limit=settings.LLM_PER_USER_CONCURRENCY,
+    tokens_per_minute=settings.LLM_TOKENS_PER_MINUTE,
+)
@@ -0,0 +1,103 @@
+# app_server/services/memory_search.py
+# 역할: UserActivity(기억) 전문 검색 엔진입니다.
+# 메시지를 문자 bigram으로 쪼개 색인된 search_tokens를 한 번의 쿼리로 검색하고, 관련도 순으로 반환합니다.
+# - SQLite: FTS5 (bm25 순위)
+# - PostgreSQL: to_tsvector('simple', search_tokens) GIN 인덱스 (ts_rank 순위)
+# - 그 밖의 DB / FTS5 없는 SQLite: search_tokens LIKE 검색 후 일치 토큰 수로 순위 (대체 경로)
+# 색인(FTS5 테이블/트리거, GIN 인덱스)은 api 마이그레이션 0004에서 만듭니다.
+
+from typing import Dict, List
+
+from django.db import connections
+from django.db.models import Q
+
+from api.models import UserActivity
+
+from .search_tokenizer import query_tokens
+
+FTS_TABLE = 'api_useractivity_fts'
+
+# 검색어가 길어도 쿼리 비용이 일정하도록 사용할 bigram 수 상한
+MAX_QUERY_TOKENS = 32
+# 대체 경로에서 Python으로 순위를 매길 후보 수 (limit의 배수)
+FALLBACK_CANDIDATE_FACTOR = 5
+
+_ACTIVITY_COLUMNS = "a.id, a.user_id, a.activity_date, a.place, a.companion, a.memo"
+
+# DB 별칭 -> 사용할 검색 방식 ('fts5' / 'postgres' / 'like')
+_backends: Dict[str, str] = {}
+
+
+def search_backend(using: str = 'default') -> str:
+    backend = _backends.get(using)
+    if backend is None:
+        connection = connections[using]
+        if connection.vendor == 'postgresql':
+            backend = 'postgres'
+        elif connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names():
+            backend = 'fts5'
+        else:
+            backend = 'like'
+        _backends[using] = backend
+    return backend
+
+
+def search_activities(user, text: str, limit: int = 10) -> List[UserActivity]:
+    """user의 기억 중 text와 관련된 항목을 관련도(동점이면 최근 날짜) 순으로 최대 limit개 반환합니다."""
+    tokens = query_tokens(text, MAX_QUERY_TOKENS)
+    if not tokens:
+        return []
+
+    backend = search_backend()
+    if backend == 'fts5':
+        return _search_fts5(user.pk, tokens, limit)
+    if backend == 'postgres':
+        return _search_postgres(user.pk, tokens, limit)
+    return _search_like(user, tokens, limit)
+
+
+def _search_fts5(user_id, tokens: List[str], limit: int) -> List[UserActivity]:
+    # 토큰은 단어 문자만으로 이루어져 있으므로 큰따옴표로 감싸 OR 검색
+    match = " OR ".join(f'"{token}"' for token in tokens)
+    sql = (
+        f"SELECT {_ACTIVITY_COLUMNS} FROM {FTS_TABLE} "
+        f"JOIN api_useractivity a ON a.id = {FTS_TABLE}.rowid "
+        f"WHERE {FTS_TABLE} MATCH %s AND a.user_id = %s "
+        f"ORDER BY bm25({FTS_TABLE}), a.activity_date DESC "
+        f"LIMIT %s"
+    )
+    return list(UserActivity.objects.raw(sql, [match, user_id, limit]))
+
+
+def _search_postgres(user_id, tokens: List[str], limit: int) -> List[UserActivity]:
+    # 인덱스 식(to_tsvector('simple', search_tokens))과 같은 식으로 조건을 걸어야 GIN 인덱스를 사용
+    tsquery = " | ".join(tokens)
+    sql = (
+        f"SELECT {_ACTIVITY_COLUMNS} FROM api_useractivity a "
+        f"WHERE a.user_id = %s AND to_tsvector('simple', a.search_tokens) @@ to_tsquery('simple', %s) "
+        f"ORDER BY ts_rank(to_tsvector('simple', a.search_tokens), to_tsquery('simple', %s)) DESC, "
+        f"a.activity_date DESC NULLS LAST "
+        f"LIMIT %s"
+    )
+    return list(UserActivity.objects.raw(sql, [user_id, tsquery, tsquery, limit]))
+
+
+def _search_like(user, tokens: List[str], limit: int) -> List[UserActivity]:
+    query = Q()
+    for token in tokens:
+        query |= Q(search_tokens__contains=token)
+    candidates = list(
+        UserActivity.objects.filter(user=user).filter(query)
+        .order_by('-activity_date')[:limit * FALLBACK_CANDIDATE_FACTOR]
+    )
+    # 일치한 토큰 수가 많은 순 (정렬이 안정적이므로 동점은 최근 날짜 순 유지)
+    candidates.sort(key=lambda activity: -len(set(activity.search_tokens.split()).intersection(tokens)))
+    return candidates[:limit]
+
+
+def rebuild_search_index(using: str = 'default'):
+    """FTS5 외부 콘텐츠 테이블을 api_useractivity 내용으로 다시 채웁니다. (SQLite 전용, 다른 DB는 아무것도 안 함)"""
+    if search_backend(using) != 'fts5':
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
@@ -0,0 +1,169 @@
+# app_server/services/message_store.py
+# 역할: ChatMessage 저장을 프로세스 전역 write-behind 큐로 모아 bulk_create로 한 번에 기록합니다.
+# 턴마다 단건 INSERT + 스레드 전환 + 커밋을 두 번씩 하던 것을, N ms 또는 N건마다 한 번의 커밋으로 줄입니다.
+
+import asyncio
+import atexit
+import threading
+from typing import List, Optional, Set, Tuple
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+from api.models import ChatMessage
+
+
+class ChatMessageWriteBehind:
+    """
+    모든 Consumer가 공유하는 ChatMessage 쓰기 버퍼입니다.
+    - enqueue(): 행을 버퍼에 넣고 바로 반환 (durable=True면 해당 행이 커밋될 때까지 대기)
+    - flush_interval_ms가 지나거나 flush_rows건이 쌓이면 bulk_create로 한 번에 저장
+    - 일괄 저장이 실패하면 배치를 반씩 나눠 저장해 실패한 행만 골라내고, 그 행은 간격을 늘려 가며
+      max_attempts번까지 재시도한 뒤 버림 (버린 행은 로그로 남김)
+    - flush(user_id)로 한 사용자의 행만 먼저 저장할 수 있음 (연결 시 기록 읽기 전 등, 다른 사용자의 배치는 유지)
+    - 프로세스 종료 시(atexit) 남은 행을 동기적으로 저장
+    - 행의 timestamp는 enqueue 시각이므로, 재시도로 늦게 저장된 행도 시간순 정렬이 유지됨
+    """
+    def __init__(self, flush_interval_ms: int, flush_rows: int, max_attempts: int):
+        self.flush_interval_ms = flush_interval_ms
+        self.flush_rows = max(flush_rows, 1)
+        self.max_attempts = max(max_attempts, 1)
+        # (저장할 행, 커밋 완료를 기다리는 Future 또는 None, 실패한 저장 시도 횟수)
+        self._pending: List[Tuple[ChatMessage, Optional[asyncio.Future], int]] = []
+        self._lock = threading.Lock()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        # 백그라운드 flush Task가 실행 중에 GC되지 않도록 참조를 보관
+        self._tasks: Set[asyncio.Task] = set()
+        self.stats = {"rows": 0, "flushes": 0, "failed_flushes": 0, "dropped_rows": 0}
+
+    async def enqueue(self, user, content: str, sender: str, durable: bool = False):
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future() if durable else None
+        with self._lock:
+            # timestamp는 모델 기본값(timezone.now)으로 지금 찍힘
+            self._pending.append((ChatMessage(user=user, content=content, sender=sender), waiter, 0))
+            pending_count = len(self._pending)
+
+        if pending_count >= self.flush_rows:
+            self._cancel_timer()
+            self._spawn_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.flush_interval_ms / 1000, self._on_timer)
+
+        if waiter is not None:
+            await waiter
+
+    def _on_timer(self):
+        self._timer = None
+        self._spawn_flush()
+
+    def _spawn_flush(self):
+        task = asyncio.ensure_future(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _take_pending(self, user_id=None) -> List[Tuple[ChatMessage, Optional[asyncio.Future], int]]:
+        with self._lock:
+            if user_id is None:
+                batch, self._pending = self._pending, []
+            else:
+                batch = [entry for entry in self._pending if entry[0].user_id == user_id]
+                if batch:
+                    self._pending = [entry for entry in self._pending if entry[0].user_id != user_id]
+        return batch
+
+    async def flush(self, user_id=None):
+        """
+        버퍼에 쌓인 행을 저장합니다. user_id를 주면 그 사용자의 행만 저장합니다.
+        다른 서비스가 DB를 읽기 직전에 호출해 최신 상태를 보장할 수 있습니다.
+        """
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        # 동시에 여러 flush가 돌면 같은 사용자의 메시지 순서(id)가 뒤섞일 수 있으므로 직렬화
+        # (user_id만 flush할 때도 진행 중인 flush에 그 사용자의 행이 있을 수 있으므로 락을 기다림)
+        async with self._flush_lock:
+            batch = self._take_pending(user_id)
+            if not batch:
+                return
+            rows = [row for row, _, _ in batch]
+            errors = await database_sync_to_async(self._write_isolating, thread_sensitive=False)(rows)
+
+            # durable 요청자에게는 결과를 바로 알리고, 실패한 나머지 행은 버퍼 앞쪽에 되돌려 다음 주기에 재시도
+            retry = []
+            for (row, waiter, attempts), error in zip(batch, errors):
+                if waiter is not None:
+                    if waiter.done():
+                        continue
+                    if error is None:
+                        waiter.set_result(None)
+                    else:
+                        waiter.set_exception(error)
+                elif error is not None:
+                    if attempts + 1 < self.max_attempts:
+                        retry.append((row, None, attempts + 1))
+                    else:
+                        self._drop(row, attempts + 1, error)
+
+            if retry:
+                with self._lock:
+                    self._pending[:0] = retry
+                if self._timer is None:
+                    # 실패가 이어질수록 재시도 간격을 두 배씩 늘림
+                    delay = self.flush_interval_ms / 1000 * 2 ** max(attempts for _, _, attempts in retry)
+                    self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    def _write_isolating(self, rows: List[ChatMessage]) -> List[Optional[Exception]]:
+        """
+        rows를 저장하고 행마다 실패 원인(성공이면 None)을 반환합니다.
+        일괄 저장이 실패하면 반으로 나눠 다시 저장하므로, 문제가 있는 행 때문에 나머지 행까지 밀리지 않습니다.
+        """
+        try:
+            self._write(rows)
+            return [None] * len(rows)
+        except Exception as e:
+            if len(rows) == 1:
+                return [e]
+            print(f"--- ChatMessage write-behind flush failed ({len(rows)} rows), splitting batch: {e} ---")
+            self.stats["failed_flushes"] += 1
+            middle = len(rows) // 2
+            return self._write_isolating(rows[:middle]) + self._write_isolating(rows[middle:])
+
+    def _drop(self, row: ChatMessage, attempts: int, error: Exception):
+        self.stats["dropped_rows"] += 1
+        print(
+            f"--- ChatMessage write-behind: dropping row after {attempts} failed attempts "
+            f"(user {row.user_id}, sender {row.sender}, {len(row.content or '')} chars): {error} ---"
+        )
+
+    def _write(self, rows: List[ChatMessage]):
+        ChatMessage.objects.bulk_create(rows)
+        self.stats["rows"] += len(rows)
+        self.stats["flushes"] += 1
+
+    def flush_sync(self):
+        """이벤트 루프가 없는 종료 시점용 동기 flush."""
+        batch = self._take_pending()
+        if not batch:
+            return
+        rows = [row for row, _, _ in batch]
+        errors = self._write_isolating(rows)
+        for row, error in zip(rows, errors):
+            if error is not None:
+                self._drop(row, 1, error)
+        print(f"--- ChatMessage write-behind: flushed {errors.count(None)}/{len(rows)} rows on shutdown ---")
+
+
+chat_message_store = ChatMessageWriteBehind(
+    flush_interval_ms=settings.CHAT_MESSAGE_FLUSH_INTERVAL_MS,
+    flush_rows=settings.CHAT_MESSAGE_FLUSH_ROWS,
+    max_attempts=settings.CHAT_MESSAGE_FLUSH_MAX_ATTEMPTS,
+)
+
+atexit.register(chat_message_store.flush_sync)
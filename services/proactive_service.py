@@ -0,0 +1,340 @@
+# app_server/services/proactive_service.py
+# 역할: 능동적 메시지(proactive message) 생성과, 최근 활동한 사용자를 위한 백그라운드 사전 생성을 담당합니다.
+# 클라이언트 폴링 시점에는 캐시에 준비된 메시지를 읽기만 하도록 하여 GPT 지연을 요청 경로에서 제거합니다.
+# 같은 사용자의 재생성은 프로세스 내 single-flight + 캐시 분산 락으로 한 번만 실행되고,
+# 만료된 메시지는 재생성이 끝날 때까지 그대로 응답합니다 (stale-while-revalidate).
+
+import asyncio
+import time
+import uuid
+from typing import Dict, Optional, Set, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from api.models import ChatMessage, Profile
+
+from .llm_client import get_async_client
+from .llm_scheduler import PRIORITY_PROACTIVE, estimate_request_tokens, llm_scheduler
+
+PROACTIVE_FALLBACK_MESSAGE = "죄송해요, 지금은 잠깐 생각할 시간이 필요해요."
+
+
+def proactive_cache_key(user_id) -> str:
+    return f'proactive_msg_{user_id}'
+
+
+def proactive_lock_key(user_id) -> str:
+    return f'proactive_msg_lock_{user_id}'
+
+
+def _unpack_entry(entry) -> Tuple[Optional[str], bool]:
+    """캐시 값 -> (메시지, 신선 여부). 값은 {"text", "fresh_until"(epoch 초)} 형식입니다."""
+    if entry is None:
+        return None, False
+    if isinstance(entry, str):
+        # 이전 형식(문자열만 저장)은 만료된 값으로 취급해 새 형식으로 다시 저장되게 함
+        return entry, False
+    return entry.get("text"), time.time() < entry.get("fresh_until", 0)
+
+
+async def get_affinity_score(user_id) -> int:
+    # ⚠️ [안정성 보강] profile이 없을 경우를 대비해 기본값 50 사용 (비동기 ORM으로 조회)
+    affinity_score = await Profile.objects.filter(user_id=user_id).values_list('affinity_score', flat=True).afirst()
+    return 50 if affinity_score is None else affinity_score
+
+
+async def get_recent_chat_history(user_id, limit=10):
+    """
+    데이터베이스에서 사용자별 최근 대화 기록(최대 limit개)을 'User: 내용' 형식으로 가져옵니다. (비동기 ORM)
+    """
+    # (user, timestamp, id) 복합 인덱스를 타도록 정렬하고, 필요한 컬럼만 조회합니다.
+    recent_messages = (
+        ChatMessage.objects.filter(user_id=user_id)
+        .order_by('-timestamp', '-id')
+        .values('sender', 'content')[:limit]
+    )
+
+    # 최신순으로 가져온 리스트를 뒤집어 오래된 순서(대화 순서)로 만듭니다.
+    ordered_messages = [m async for m in recent_messages][::-1]
+
+    return [
+        f"{'User' if m['sender'] == 'user' else 'AI'}: {m['content']}"
+        for m in ordered_messages
+    ]
+
+
+async def generate_proactive_message(user_id, username) -> str:
+    """
+    GPT API를 호출하여 능동적 메시지를 생성하는 핵심 로직.
+    호출은 LLM 스케줄러(proactive 우선순위)를 거쳐 공유 비동기 클라이언트로 실행됩니다.
+    """
+    api_key = getattr(settings, 'OPENAI_API_KEY', None)
+
+    if not api_key:
+        print("경고: OPENAI_API_KEY가 설정되지 않았습니다. Mock 메시지를 반환합니다.")
+        return f"API 키 미설정. (테스트용: {username}님, 오늘 날씨가 참 좋죠?)"
+
+    affinity_score, chat_history = await asyncio.gather(
+        get_affinity_score(user_id),
+        get_recent_chat_history(user_id),
+    )
+
+    # AI 페르소나 및 지침 설정
+    system_instruction = f"""
+    당신은 사용자({username})의 방에 살고 있는 친절하고 능동적인 AI 어시스턴트입니다.
+    사용자의 최근 대화 기록을 분석하여, 대화를 유도할 수 있는 짧고 대화적인 질문이나 코멘트 한 문장을 한국어로 생성하세요.
+    당신의 호감도 점수는 {affinity_score}점입니다. 이 점수에 따라 적절한 톤을 유지하세요.
+    최종 응답은 오직 한 문장이어야 하며, 마크다운 형식(볼드체, 목록 등)을 사용하지 마세요.
+    """
+
+    messages = [{"role": "system", "content": system_instruction}]
+
+    # DB에서 가져온 포맷(예: 'User: 내용')을 GPT 롤 포맷으로 변환
+    for line in chat_history:
+        parts = line.split(': ', 1)
+        if len(parts) == 2:
+            role_map = {'User': 'user', 'AI': 'assistant'}
+            role = role_map.get(parts[0], 'user')
+            messages.append({"role": role, "content": parts[1]})
+
+    try:
+        max_tokens = 100
+        estimated_tokens = estimate_request_tokens(messages, max_tokens)
+        async with llm_scheduler.slot(PRIORITY_PROACTIVE, user_id, estimated_tokens) as ticket:
+            response = await get_async_client().chat.completions.create(
+                model="gpt-4o-mini",
+                messages=messages,
+                temperature=0.7,
+                max_tokens=max_tokens,
+            )
+        ticket.report_usage(getattr(getattr(response, "usage", None), "total_tokens", None))
+        return response.choices[0].message.content.strip()
+
+    except Exception as e:
+        print(f"GPT API 호출 실패: {e}")
+        return PROACTIVE_FALLBACK_MESSAGE
+
+
+class ProactivePregenerator:
+    """
+    최근 활동한 사용자마다 "바로 보여줄 수 있는" 능동적 메시지를 캐시에 유지합니다.
+    - mark_active(): WebSocket 연결/폴링 등으로 사용자가 활동 중임을 기록
+    - mark_chatted(): 새 ChatMessage가 생겼음을 기록. 대화가 idle_delay 동안 멈춘 뒤에 재생성 대상이 됨
+    - mark_consumed(): 준비된 메시지가 처음 전달되었을 때만 재생성 대상으로 표시 (같은 메시지 재폴링은 무시)
+    - get_message(): 요청 경로용 조회. 만료된 메시지는 그대로 반환하고 재생성은 백그라운드로 넘김
+    - 백그라운드 루프가 tick마다 재생성 대상 중 대화가 idle_delay 동안 없었고 min_interval이 지난 사용자만,
+      최대 concurrency명씩 재생성 (대화가 이어지는 동안에는 GPT를 호출하지 않음)
+    active_window 동안 활동이 없는 사용자는 추적 대상에서 제외합니다.
+
+    재생성은 사용자마다 한 번에 하나만 실행됩니다.
+    - 프로세스 내: 진행 중인 Task를 공유 (single-flight)
+    - 프로세스 간: cache.add() 기반 락. 락을 못 잡으면 다른 프로세스가 저장한 결과를 기다림
+      (캐시가 L1 단독 모드이면 프로세스 내 락으로 동작하고, 캐시 오류 시에는 single-flight만으로 진행)
+    """
+    def __init__(self, active_window: float, min_interval: float, idle_delay: float, tick: float, concurrency: int,
+                 ttl: int, stale_ttl: int, lock_timeout: int, wait_timeout: float):
+        self.active_window = active_window
+        self.min_interval = min_interval
+        self.idle_delay = idle_delay
+        self.tick = tick
+        self.concurrency = max(concurrency, 1)
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        # user_id -> (username, 마지막 활동 시각)
+        self._users: Dict[int, Tuple[str, float]] = {}
+        self._dirty: Set[int] = set()
+        self._last_generated: Dict[int, float] = {}
+        # user_id -> 마지막 대화 메시지 시각 / 마지막으로 소비 처리한 메시지
+        self._last_chat: Dict[int, float] = {}
+        self._consumed: Dict[int, str] = {}
+        # user_id -> 진행 중인 재생성 Task (single-flight)
+        self._inflight: Dict[int, asyncio.Task] = {}
+        self._task = None
+        self.stats = {
+            "generated": 0, "failed": 0, "rate_limited": 0, "waiting_idle": 0,
+            "stale_served": 0, "misses": 0, "coalesced": 0, "lock_contended": 0,
+        }
+
+    def mark_active(self, user_id, username):
+        self._users[user_id] = (username, time.monotonic())
+        self._ensure_started()
+
+    def mark_dirty(self, user_id, username):
+        self._dirty.add(user_id)
+        self.mark_active(user_id, username)
+
+    def mark_chatted(self, user_id, username):
+        # 메시지마다 재생성하지 않고, 대화가 멈춘 뒤(idle_delay) 마지막 대화 내용으로 한 번만 재생성
+        self._last_chat[user_id] = time.monotonic()
+        self.mark_dirty(user_id, username)
+
+    def mark_consumed(self, user_id, username, text: str):
+        # 준비된 메시지가 클라이언트에 처음 전달되면 다음 메시지를 미리 준비 (같은 메시지를 다시 폴링하면 활동만 기록)
+        if self._consumed.get(user_id) == text:
+            self.mark_active(user_id, username)
+            return
+        self._consumed[user_id] = text
+        self.mark_dirty(user_id, username)
+
+    async def store(self, user_id, text: str):
+        # TTL이 지나도 stale_ttl 동안은 캐시에 남겨 두어, 재생성 중에도 즉시 응답할 수 있게 함
+        entry = {"text": text, "fresh_until": time.time() + self.ttl}
+        await cache.aset(proactive_cache_key(user_id), entry, self.ttl + self.stale_ttl)
+        self._last_generated[user_id] = time.monotonic()
+
+    async def get_message(self, user_id, username) -> Tuple[Optional[str], str]:
+        """
+        (메시지, 상태)를 반환합니다. 상태는 "fresh" / "stale" / "generated" / "failed" 중 하나입니다.
+        - stale: 만료된 메시지를 반환하고, 재생성은 백그라운드에서 한 번만 실행
+        - generated/failed: 캐시가 완전히 비어 있어 재생성 결과를 기다린 경우
+        """
+        text, fresh = _unpack_entry(await cache.aget(proactive_cache_key(user_id)))
+        if text is not None:
+            if fresh:
+                return text, "fresh"
+            self.stats["stale_served"] += 1
+            self._start_refresh(user_id, username)
+            return text, "stale"
+
+        self.stats["misses"] += 1
+        text = await self.refresh(user_id, username)
+        return text, ("generated" if text is not None else "failed")
+
+    async def refresh(self, user_id, username) -> Optional[str]:
+        """사용자의 메시지를 재생성합니다. 이미 진행 중이면 그 결과를 함께 기다립니다."""
+        # 기다리던 요청이 취소되어도 공유 중인 재생성 Task는 계속 실행되도록 shield
+        return await asyncio.shield(self._start_refresh(user_id, username))
+
+    def _start_refresh(self, user_id, username) -> asyncio.Task:
+        task = self._inflight.get(user_id)
+        if task is not None:
+            self.stats["coalesced"] += 1
+            return task
+        task = asyncio.get_running_loop().create_task(self._refresh_with_lock(user_id, username))
+        self._inflight[user_id] = task
+        task.add_done_callback(lambda done: self._on_refresh_done(user_id, done))
+        return task
+
+    def _on_refresh_done(self, user_id, task: asyncio.Task):
+        if self._inflight.get(user_id) is task:
+            del self._inflight[user_id]
+        if not task.cancelled() and task.exception() is not None:
+            print(f"--- Proactive message refresh failed for user {user_id}: {task.exception()} ---")
+
+    async def _refresh_with_lock(self, user_id, username) -> Optional[str]:
+        lock_key = proactive_lock_key(user_id)
+        token = await self._acquire_lock(lock_key)
+        if token is None:
+            self.stats["lock_contended"] += 1
+            return await self._wait_for_peer(user_id)
+
+        try:
+            text = await generate_proactive_message(user_id, username)
+            if text and text != PROACTIVE_FALLBACK_MESSAGE:
+                await self.store(user_id, text)
+                self.stats["generated"] += 1
+                return text
+            self.stats["failed"] += 1
+            return None
+        finally:
+            await self._release_lock(lock_key, token)
+
+    async def _acquire_lock(self, lock_key) -> Optional[str]:
+        token = uuid.uuid4().hex
+        try:
+            if await cache.aadd(lock_key, token, self.lock_timeout):
+                return token
+            return None
+        except Exception as e:
+            # 캐시(Redis)를 쓸 수 없으면 프로세스 내 single-flight만으로 진행
+            print(f"--- Proactive refresh lock unavailable, continuing without it: {e} ---")
+            return token
+
+    async def _release_lock(self, lock_key, token: str):
+        try:
+            # 락이 만료되어 다른 프로세스가 다시 잡은 경우에는 지우지 않음
+            if await cache.aget(lock_key) == token:
+                await cache.adelete(lock_key)
+        except Exception as e:
+            print(f"--- Failed to release proactive refresh lock '{lock_key}': {e} ---")
+
+    async def _wait_for_peer(self, user_id) -> Optional[str]:
+        """다른 프로세스가 락을 잡고 생성 중일 때, 새 메시지가 캐시에 저장될 때까지 잠시 기다립니다."""
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.25)
+            text, fresh = _unpack_entry(await cache.aget(proactive_cache_key(user_id)))
+            if fresh:
+                return text
+        return None
+
+    def _ensure_started(self):
+        if self._task is not None and not self._task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while self._users:
+            await asyncio.sleep(self.tick)
+            try:
+                await self._tick()
+            except Exception as e:
+                print(f"--- Proactive pre-generation tick failed: {e} ---")
+
+    async def _tick(self):
+        now = time.monotonic()
+        for user_id, (_, last_active) in list(self._users.items()):
+            if now - last_active > self.active_window:
+                self._users.pop(user_id, None)
+                self._dirty.discard(user_id)
+                self._last_generated.pop(user_id, None)
+                self._last_chat.pop(user_id, None)
+                self._consumed.pop(user_id, None)
+
+        due = []
+        for user_id in self._dirty:
+            if user_id in self._inflight or user_id not in self._users:
+                continue
+            if now - self._last_chat.get(user_id, float('-inf')) < self.idle_delay:
+                self.stats["waiting_idle"] += 1
+                continue
+            if now - self._last_generated.get(user_id, float('-inf')) < self.min_interval:
+                self.stats["rate_limited"] += 1
+                continue
+            due.append(user_id)
+
+        await asyncio.gather(*(self._regenerate(user_id) for user_id in due[:self.concurrency]))
+
+    async def _regenerate(self, user_id):
+        username = self._users[user_id][0]
+        # 생성 중에 새로 표시된 변경은 다음 tick에서 다시 반영되도록 먼저 지움
+        self._dirty.discard(user_id)
+        try:
+            text = await self.refresh(user_id, username)
+        except Exception:
+            # 오류 내용은 _on_refresh_done에서 기록
+            text = None
+        if text is None:
+            # 실패하면 min_interval 후에 다시 시도
+            self._last_generated[user_id] = time.monotonic()
+            self._dirty.add(user_id)
+
+
+proactive_pregenerator = ProactivePregenerator(
+    active_window=settings.PROACTIVE_ACTIVE_WINDOW_SECONDS,
+    min_interval=settings.PROACTIVE_MIN_REGEN_INTERVAL_SECONDS,
+    idle_delay=settings.PROACTIVE_IDLE_SECONDS,
+    tick=settings.PROACTIVE_PREGEN_TICK_SECONDS,
+    concurrency=settings.PROACTIVE_PREGEN_CONCURRENCY,
+    ttl=settings.PROACTIVE_MESSAGE_TTL,
+    stale_ttl=settings.PROACTIVE_STALE_TTL,
+    lock_timeout=settings.PROACTIVE_REFRESH_LOCK_TIMEOUT,
+    wait_timeout=settings.PROACTIVE_REFRESH_WAIT_SECONDS,
+)
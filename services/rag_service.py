@@ -1,35 +1,280 @@
 # rag_service.py
-# 역할: 벡터 DB 검색 및 데이터 포맷팅만을 담당합니다.
+# 역할: 벡터 검색 및 데이터 포맷팅만을 담당합니다.
+# 외부 벡터 DB 없이, 디스크에 저장된 float32 임베딩 행렬을 메모리 매핑(mmap)하여
+# 프로세스 내에서 코사인 유사도 top-k 검색을 수행합니다.
+# 인덱스는 `python manage.py build_rag_index <문서 경로...>`로 만들며, 워커는 시작할 때 인덱스를 엽니다.
 
 import asyncio
-from typing import Dict, Any
+import json
+import os
+import re
+import zlib
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from .ttl_cache import TTLCache
+
+# 임베딩 함수 형식: 문자열 리스트 -> (len(texts), dim) float32 행렬
+EmbeddingFunction = Callable[[Sequence[str]], np.ndarray]
+
+DEFAULT_INDEX_DIR = Path(__file__).resolve().parent.parent / 'rag_index'
+
+EMBEDDINGS_FILE = 'embeddings.npy'
+DOCUMENTS_FILE = 'documents.json'
+META_FILE = 'meta.json'
+
+# 검색 결과(포맷된 컨텍스트 문자열) 캐시 설정
+RAG_CACHE_MAXSIZE = int(os.getenv("RAG_CACHE_MAXSIZE", "1024"))
+RAG_CACHE_TTL = int(os.getenv("RAG_CACHE_TTL", "300"))
+
+_QUERY_PUNCTUATION = re.compile(r"[^\w\s]+", re.UNICODE)
+
+
+class HashingEmbedder:
+    """
+    문자 n-gram을 부호 있는 해싱(signed hashing)으로 고정 차원 벡터에 누적하는 결정적 로컬 임베더.
+    네트워크/모델 없이 동작하므로 테스트와 로컬 개발 환경의 기본 임베딩 함수로 사용합니다.
+    """
+    def __init__(self, dim: int = 256, ngram_orders: Sequence[int] = (1, 2, 3)):
+        self.dim = dim
+        self.ngram_orders = tuple(ngram_orders)
+        self.name = f"hashing-{dim}-{'-'.join(map(str, self.ngram_orders))}"
+
+    def _embed_one(self, text: str, out: np.ndarray):
+        text = " ".join(text.lower().split())
+        for n in self.ngram_orders:
+            for i in range(len(text) - n + 1):
+                h = zlib.crc32(text[i:i + n].encode('utf-8'))
+                out[h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+
+    def __call__(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in zip(vectors, texts):
+            self._embed_one(text, row)
+        return vectors
+
+
+def _l2_normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32, copy=False)
+
 
 class RAGService:
     """
     RAG(Retrieval Augmented Generation) 시스템의 검색 로직을 캡슐화합니다.
-    (현재는 로컬 테스트를 위해 검색 결과를 목업(Mock)으로 반환합니다.)
+    문서 임베딩(정규화된 float32 행렬)은 index_dir에 .npy로 저장되고, mmap_mode='r'로 열어
+    여러 Daphne 워커 프로세스가 같은 페이지 캐시를 공유합니다.
     """
-    def __init__(self, api_key: str, environment_vars: Dict[str, Any]):
-        # 실제 배포 시: Pinecone 클라이언트, 임베딩 클라이언트 초기화
-        pass 
+    def __init__(self, api_key: str, environment_vars: Dict[str, Any],
+                 index_dir: str = None, embedding_fn: EmbeddingFunction = None):
+        # api_key / environment_vars: 외부 임베딩 클라이언트를 embedding_fn으로 주입할 때 사용
+        self.index_dir = Path(
+            index_dir
+            or environment_vars.get("RAG_INDEX_DIR")
+            or os.environ.get("RAG_INDEX_DIR")
+            or DEFAULT_INDEX_DIR
+        )
+        self.embedding_fn = embedding_fn or HashingEmbedder()
+        self.embedding_name = getattr(self.embedding_fn, 'name', type(self.embedding_fn).__name__)
+
+        self._documents: List[str] = []
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._load_index()
+
+    # ------------------------------------------------------------------
+    # 인덱스 로드/저장
+    # ------------------------------------------------------------------
+
+    def _load_index(self):
+        embeddings_path = self.index_dir / EMBEDDINGS_FILE
+        if not embeddings_path.exists():
+            print(f"--- RAG index not found at {self.index_dir}; retrieval returns no context. "
+                  f"Build it with 'python manage.py build_rag_index'. ---")
+            return
+
+        try:
+            meta = json.loads((self.index_dir / META_FILE).read_text(encoding='utf-8'))
+            if meta.get('embedding') != self.embedding_name:
+                print(f"--- RAG index at {self.index_dir} was built with '{meta.get('embedding')}', "
+                      f"not '{self.embedding_name}'. Ignoring it. ---")
+                return
+
+            documents = json.loads((self.index_dir / DOCUMENTS_FILE).read_text(encoding='utf-8'))
+            matrix = np.load(embeddings_path, mmap_mode='r')
+        except (OSError, ValueError) as e:
+            print(f"--- Could not load RAG index from {self.index_dir}: {e} ---")
+            return
+
+        if matrix.shape[0] != len(documents):
+            print(f"--- RAG index is inconsistent ({matrix.shape[0]} vectors, {len(documents)} documents). Ignoring it. ---")
+            return
+
+        self._documents = documents
+        self._matrix = matrix
+
+    def _write_atomic(self, filename: str, write: Callable[[Path], None]):
+        # 임시 파일에 쓴 뒤 교체하므로, 기존 mmap을 보고 있는 다른 워커는 이전 파일을 계속 안전하게 읽습니다.
+        target = self.index_dir / filename
+        tmp = target.with_name(f".{filename}.{os.getpid()}.tmp")
+        write(tmp)
+        os.replace(tmp, target)
+
+    def __len__(self):
+        return len(self._documents)
+
+    def add_documents(self, texts: Sequence[str]):
+        """문서를 임베딩하여 인덱스에 추가하고 디스크에 저장한 뒤 다시 mmap으로 엽니다."""
+        self._build(texts, append=True)
+
+    def replace_documents(self, texts: Sequence[str]):
+        """기존 인덱스를 버리고 texts만으로 인덱스를 다시 만듭니다."""
+        self._build(texts, append=False)
+
+    def _build(self, texts: Sequence[str], append: bool):
+        texts = [t for t in texts if t and t.strip()]
+        if not texts:
+            return
+
+        new_vectors = _l2_normalize(np.asarray(self.embedding_fn(texts), dtype=np.float32))
+        if append and self._documents:
+            matrix = np.concatenate([np.asarray(self._matrix), new_vectors])
+            documents = self._documents + list(texts)
+        else:
+            matrix = new_vectors
+            documents = list(texts)
+
+        def save_matrix(path: Path):
+            # np.save에 경로를 넘기면 '.npy'가 덧붙으므로 파일 객체로 저장
+            with open(path, 'wb') as f:
+                np.save(f, matrix)
+
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self._write_atomic(EMBEDDINGS_FILE, save_matrix)
+        self._write_atomic(DOCUMENTS_FILE, lambda path: path.write_text(json.dumps(documents, ensure_ascii=False), encoding='utf-8'))
+        self._write_atomic(META_FILE, lambda path: path.write_text(json.dumps({
+            'embedding': self.embedding_name,
+            'dim': int(matrix.shape[1]),
+            'count': len(documents),
+        }), encoding='utf-8'))
+
+        self._load_index()
+
+    # ------------------------------------------------------------------
+    # 검색
+    # ------------------------------------------------------------------
+
+    def search(self, queries: Sequence[str], top_k: int = 3) -> List[List[Tuple[str, float]]]:
+        """
+        여러 쿼리를 한 번의 행렬 곱으로 검색합니다.
+        쿼리마다 (문서, 코사인 유사도) 리스트를 유사도 내림차순으로 반환합니다.
+        """
+        n_docs = len(self._documents)
+        if not queries:
+            return []
+        if n_docs == 0 or top_k <= 0:
+            return [[] for _ in queries]
+
+        query_vectors = _l2_normalize(np.asarray(self.embedding_fn(list(queries)), dtype=np.float32))
+        scores = query_vectors @ self._matrix.T  # (n_queries, n_docs)
+
+        k = min(top_k, n_docs)
+        if k < n_docs:
+            # 전체 정렬 대신 argpartition으로 상위 k개만 골라낸 뒤 그 안에서만 정렬
+            candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            candidates = np.tile(np.arange(n_docs), (len(queries), 1))
+
+        results = []
+        for row_scores, row_candidates in zip(scores, candidates):
+            ranked = row_candidates[np.argsort(-row_scores[row_candidates])]
+            results.append([(self._documents[i], float(row_scores[i])) for i in ranked])
+        return results
 
     async def get_context_documents(self, user_query: str, top_k: int = 3) -> str:
         """
-        사용자 쿼리를 기반으로 관련 문맥 문서를 비동기로 검색합니다.
+        사용자 쿼리를 기반으로 관련 문맥 문서를 검색합니다.
+        인메모리 행렬 연산이라 1ms 미만이므로 별도 스레드로 넘기지 않고 바로 계산합니다.
         """
-        # 비동기 검색 작업 시뮬레이션
-        await asyncio.sleep(0.01)
-
-        # 3. 검색 결과를 포맷팅합니다. (로컬 테스트 목업 데이터)
-        retrieved_texts = [
-            f"Context 1: The user's current query is about '{user_query[:30]}...'.",
-            "Context 2: FastAPI is a modern, fast (high-performance) web framework for building APIs with Python 3.8+ based on standard Python type hints.",
-            "Context 3: Separation of Concerns (SoC) principle is critical for scalable deployment on platforms like Render.",
-        ]
-        
+        retrieved = self.search([user_query], top_k)[0]
+
+        # 검색 결과를 포맷팅합니다.
         context_str = "\n".join(
-            f"--- Retrieved Context {i+1} ---\n{text}" 
-            for i, text in enumerate(retrieved_texts)
+            f"--- Retrieved Context {i+1} ---\n{text}"
+            for i, (text, _score) in enumerate(retrieved)
         )
-        
+
         return context_str
+
+
+class CachedRAGService:
+    """
+    RAGService 앞단의 쿼리 캐시입니다.
+    - 쿼리를 정규화(소문자화, 구두점 제거, 공백 정리)하여 포맷된 컨텍스트 문자열을 LRU+TTL로 캐싱
+    - 같은 쿼리에 대한 동시 요청은 진행 중인 하나의 검색 작업(single-flight)을 함께 기다림
+    푸시 알림 직후처럼 "안녕", "뭐해?" 같은 동일한 첫 메시지가 몰릴 때 검색 백엔드를 보호합니다.
+    """
+    def __init__(self, backend: RAGService, maxsize: int = RAG_CACHE_MAXSIZE, ttl: int = RAG_CACHE_TTL):
+        self.backend = backend
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._inflight: Dict[Tuple[str, int], "asyncio.Future"] = {}
+        self.coalesced = 0
+
+    def __getattr__(self, name):
+        # add_documents / search 등 나머지 API는 원본 서비스로 위임
+        return getattr(self.backend, name)
+
+    @staticmethod
+    def normalize_query(user_query: str) -> str:
+        return " ".join(_QUERY_PUNCTUATION.sub(" ", user_query.lower()).split())
+
+    async def get_context_documents(self, user_query: str, top_k: int = 3) -> str:
+        key = (self.normalize_query(user_query), top_k)
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(self._fetch(key, user_query, top_k))
+            self._inflight[key] = task
+
+        # 한 요청자가 취소되어도 공유 작업은 계속 진행되도록 shield
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key, user_query: str, top_k: int) -> str:
+        try:
+            context = await self.backend.get_context_documents(user_query, top_k)
+            self.cache.set(key, context)
+            return context
+        finally:
+            self._inflight.pop(key, None)
+
+    def invalidate(self):
+        """인덱스에 문서가 추가되는 등 검색 결과가 바뀔 때 캐시를 비웁니다."""
+        self.cache.clear()
+
+    def add_documents(self, texts: Sequence[str]):
+        self.backend.add_documents(texts)
+        self.invalidate()
+
+    def replace_documents(self, texts: Sequence[str]):
+        self.backend.replace_documents(texts)
+        self.invalidate()
+
+    def stats(self) -> dict:
+        cache_stats = self.cache.stats()
+        lookups = cache_stats["hits"] + cache_stats["misses"]
+        # 진행 중인 검색에 합류한 요청도 백엔드 호출을 아낀 것이므로 별도 비율로 집계
+        saved = cache_stats["hits"] + self.coalesced
+        return {
+            **cache_stats,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+            "backend_calls_saved_rate": (saved / lookups) if lookups else 0.0,
+        }
@@ -0,0 +1,35 @@
+# app_server/services/search_tokenizer.py
+# 역할: 기억(UserActivity) 검색용 문자 bigram 토큰화입니다.
+# 한국어는 조사/어미가 붙어 공백 단위 단어가 잘 일치하지 않으므로("카페에서" vs "카페"),
+# 단어를 겹치는 2글자 단위로 쪼개 색인/검색합니다. ("카페에서" -> 카페 페에 에서)
+# Django/DB에 의존하지 않으므로 모델(api.models)에서도 바로 import 할 수 있습니다.
+
+import re
+from typing import List
+
+# 밑줄(_)은 FTS5/tsquery 토큰 경계가 되므로 제외한 단어 문자
+_WORD_RE = re.compile(r"[^\W_]+")
+
+
+def bigram_tokens(text: str, min_word_length: int = 1) -> List[str]:
+    """text를 소문자 단어로 나눈 뒤, 각 단어를 겹치는 2글자 토큰으로 만듭니다. 1글자 단어는 그대로 둡니다."""
+    tokens = []
+    for word in _WORD_RE.findall((text or "").lower()):
+        if len(word) < min_word_length:
+            continue
+        if len(word) == 1:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+def build_search_tokens(*fields: str) -> str:
+    """색인할 문서: 여러 필드의 bigram을 공백으로 이은 문자열 (빈도는 순위 계산에 쓰이므로 중복 유지)."""
+    return " ".join(token for field in fields for token in bigram_tokens(field))
+
+
+def query_tokens(text: str, limit: int) -> List[str]:
+    """검색어 토큰: 2글자 이상 단어의 bigram만 사용하고(노이즈 감소), 중복 없이 최대 limit개."""
+    unique = dict.fromkeys(bigram_tokens(text, min_word_length=2))
+    return list(unique)[:limit]
@@ -0,0 +1,172 @@
+# app_server/services/summary_service.py
+# 역할: 긴 대화의 오래된 턴을 사용자별 누적 요약(ConversationSummary)으로 접어 넣습니다.
+# 요약 갱신은 응답 전송이 끝난 뒤 백그라운드 작업으로만 실행되며, 요청 경로에서는 저장된 요약을 읽기만 합니다.
+
+import asyncio
+from typing import Callable, Dict, List, Optional, Tuple
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+from api.models import ChatMessage, ConversationSummary
+
+from .history_service import estimate_tokens
+from .llm_client import get_async_client
+from .llm_scheduler import PRIORITY_PROACTIVE, estimate_request_tokens, llm_scheduler
+from .message_store import chat_message_store
+
+# 요약 입력에서 메시지 하나가 차지할 수 있는 최대 글자 수
+SUMMARY_MESSAGE_CHAR_LIMIT = 500
+
+SUMMARY_SYSTEM_PROMPT = (
+    "너는 사용자와 AI 친구의 대화를 요약하는 도우미야. "
+    "기존 요약과 새 대화 내용을 합쳐 하나의 요약으로 다시 써줘. "
+    "사용자의 근황, 감정, 약속, 선호, 중요한 사실처럼 이후 대화에 필요한 정보만 남기고, "
+    "인사나 잡담은 생략해. 한국어 평서문으로 10문장 이내로 작성해."
+)
+
+
+def load_summary(user_id) -> Tuple[str, int]:
+    """(요약 문자열, 요약에 반영된 마지막 메시지 id)를 반환합니다. 요약이 없으면 ("", 0)."""
+    row = ConversationSummary.objects.filter(user_id=user_id).values('summary', 'last_message_id').first()
+    if not row:
+        return "", 0
+    return row['summary'], row['last_message_id']
+
+
+def _load_unsummarized(user_id, limit: int) -> Tuple[str, List[Dict]]:
+    """(요약, 요약에 반영되지 않은 가장 오래된 메시지 최대 limit개)를 반환합니다."""
+    summary, last_message_id = load_summary(user_id)
+    messages = list(
+        ChatMessage.objects.filter(user_id=user_id, id__gt=last_message_id)
+        .order_by('id')
+        .values('id', 'sender', 'content')[:limit]
+    )
+    return summary, messages
+
+
+def _store_summary(user_id, summary: str, last_message_id: int):
+    ConversationSummary.objects.update_or_create(
+        user_id=user_id,
+        defaults={'summary': summary, 'last_message_id': last_message_id},
+    )
+
+
+def _format_line(message: Dict) -> str:
+    return f"{'사용자' if message['sender'] == 'user' else 'AI'}: {message['content'][:SUMMARY_MESSAGE_CHAR_LIMIT]}"
+
+
+def _take_within_budget(messages: List[Dict], token_budget: int) -> List[Dict]:
+    """오래된 메시지부터 입력 토큰 추정치가 token_budget을 넘기 전까지 고릅니다. (최소 1개)"""
+    used = 0
+    for index, message in enumerate(messages):
+        used += estimate_tokens(_format_line(message))
+        if used > token_budget and index > 0:
+            return messages[:index]
+    return messages
+
+
+class ConversationSummarizer:
+    """
+    요약되지 않은 메시지가 trigger_messages개 이상 쌓이면, 최근 keep_recent개를 제외한 오래된 메시지를
+    기존 요약과 합쳐 새 요약으로 갱신합니다.
+    한 번의 요약 호출에는 오래된 메시지부터 batch_messages개 / input_token_budget 토큰까지만 넣고,
+    호출마다 요약 위치(last_message_id)를 저장하며 남은 메시지를 이어서 접습니다 (긴 기존 기록도 컨텍스트/TPM 한도 안에서 처리).
+    같은 사용자에 대해서는 한 번에 하나의 요약 작업만 실행합니다 (연결이 여러 개여도 중복 호출 방지).
+    """
+    def __init__(self, trigger_messages: int, keep_recent: int, model: str, max_tokens: int,
+                 batch_messages: int, input_token_budget: int):
+        self.trigger_messages = trigger_messages
+        self.keep_recent = keep_recent
+        self.model = model
+        self.max_tokens = max_tokens
+        self.batch_messages = max(batch_messages, 1)
+        self.input_token_budget = input_token_budget
+        self._inflight: Dict[int, asyncio.Task] = {}
+
+    def schedule(self, user_id: int, on_updated: Callable[[str], None] = None) -> Optional[asyncio.Task]:
+        """
+        요약 갱신을 백그라운드 작업으로 예약합니다. 이미 진행 중이면 아무것도 하지 않습니다.
+        갱신에 성공하면 on_updated(새 요약)을 호출합니다.
+        """
+        if user_id in self._inflight:
+            return None
+        task = asyncio.ensure_future(self._run(user_id, on_updated))
+        self._inflight[user_id] = task
+        return task
+
+    async def _run(self, user_id: int, on_updated: Callable[[str], None]):
+        try:
+            summary = await self.update(user_id)
+            if summary is not None and on_updated:
+                on_updated(summary)
+        except Exception as e:
+            print(f"--- Conversation summary update failed for user {user_id}: {e} ---")
+        finally:
+            self._inflight.pop(user_id, None)
+
+    async def update(self, user_id: int) -> Optional[str]:
+        """요약이 필요하면 갱신하고 새 요약을 반환합니다. 아직 기준에 못 미치면 None."""
+        # write-behind 버퍼에 남은 이 사용자의 메시지까지 DB에 반영한 뒤 읽기
+        await chat_message_store.flush(user_id)
+        summary = None
+        while True:
+            # 첫 호출만 trigger_messages 기준을 보고, 이후에는 최근 keep_recent개만 남을 때까지 이어서 접음
+            folded = await self._fold_once(user_id, check_trigger=summary is None)
+            if folded is None:
+                return summary
+            summary, has_more = folded
+            if not has_more:
+                return summary
+
+    async def _fold_once(self, user_id: int, check_trigger: bool) -> Optional[Tuple[str, bool]]:
+        """가장 오래된 미요약 메시지 한 묶음을 요약에 접고 (새 요약, 더 접을 메시지가 남았는지)를 반환합니다."""
+        limit = max(self.trigger_messages, self.batch_messages + self.keep_recent)
+        previous_summary, messages = await database_sync_to_async(_load_unsummarized, thread_sensitive=False)(
+            user_id, limit
+        )
+        if check_trigger and len(messages) < self.trigger_messages:
+            return None
+
+        candidates = messages[:-self.keep_recent] if self.keep_recent else messages
+        to_fold = _take_within_budget(candidates[:self.batch_messages], self.input_token_budget)
+        if not to_fold:
+            return None
+
+        user_content = (
+            f"[기존 요약]\n{previous_summary or '(없음)'}\n\n"
+            f"[새 대화]\n" + "\n".join(_format_line(m) for m in to_fold)
+        )
+        request_messages = [
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+            {"role": "user", "content": user_content},
+        ]
+        # 백그라운드 작업이므로 가장 낮은 우선순위로 실행
+        estimated_tokens = estimate_request_tokens(request_messages, self.max_tokens)
+        async with llm_scheduler.slot(PRIORITY_PROACTIVE, user_id, estimated_tokens) as ticket:
+            response = await get_async_client().chat.completions.create(
+                model=self.model,
+                messages=request_messages,
+                temperature=0.2,
+                max_tokens=self.max_tokens,
+            )
+        ticket.report_usage(getattr(getattr(response, "usage", None), "total_tokens", None))
+        summary = (response.choices[0].message.content or "").strip()
+        if not summary:
+            return None
+
+        await database_sync_to_async(_store_summary, thread_sensitive=False)(user_id, summary, to_fold[-1]['id'])
+        print(f"--- Conversation summary updated for user {user_id}: folded {len(to_fold)} messages ---")
+        # 이번에 다 못 넣었거나, 불러온 것 뒤에 메시지가 더 있으면 다음 묶음을 이어서 접음
+        has_more = len(to_fold) < len(candidates) or len(messages) == limit
+        return summary, has_more
+
+
+conversation_summarizer = ConversationSummarizer(
+    trigger_messages=settings.CHAT_SUMMARY_TRIGGER_MESSAGES,
+    keep_recent=settings.CHAT_SUMMARY_KEEP_RECENT,
+    model=settings.CHAT_SUMMARY_MODEL,
+    max_tokens=settings.CHAT_SUMMARY_MAX_TOKENS,
+    batch_messages=settings.CHAT_SUMMARY_BATCH_MESSAGES,
+    input_token_budget=settings.CHAT_SUMMARY_INPUT_TOKEN_BUDGET,
+)
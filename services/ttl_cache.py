@@ -0,0 +1,82 @@
+# app_server/services/ttl_cache.py
+# 역할: 프로세스 내 메모리 캐시 (LRU 제거 + TTL 만료) 공용 구현입니다.
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class TTLCache:
+    """
+    최대 항목 수(maxsize)를 넘으면 가장 오래 사용하지 않은 항목부터 제거하고,
+    ttl초가 지난 항목은 조회 시점에 만료시키는 LRU+TTL 캐시입니다.
+    database_sync_to_async 등 스레드에서 호출될 수 있으므로 내부 연산은 Lock으로 보호합니다.
+    """
+    _MISSING = object()
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, self._MISSING)
+            if entry is self._MISSING:
+                self.misses += 1
+                return default
+
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def replace(self, key: Hashable, value: Any) -> bool:
+        """만료 시각은 그대로 두고 값만 바꿉니다. 항목이 없거나 만료되었으면 False."""
+        with self._lock:
+            entry = self._data.get(key, self._MISSING)
+            if entry is self._MISSING or entry[1] <= time.monotonic():
+                return False
+            self._data[key] = (value, entry[1])
+            return True
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
@@ -0,0 +1,19 @@
+# app_server/services/user_snapshot.py
+# 역할: WebSocket 인증용 사용자 스냅샷 캐시 키와 무효화 함수입니다.
+# 스냅샷을 읽고 만드는 쪽(api.middleware)과 점수를 바꾸는 서비스(affinity_service 등)가 함께 쓰므로,
+# 서비스가 api 미들웨어에 의존하지 않도록 여기에 둡니다.
+
+from django.core.cache import cache
+
+
+def ws_user_cache_key(user_id) -> str:
+    return f'ws_user_{user_id}'
+
+
+def invalidate_user_snapshot(user_id):
+    # User/Profile 저장 시그널에서 호출되므로 캐시 오류로 저장 요청이 실패하지 않게 함
+    # (지우지 못한 스냅샷은 WS_USER_CACHE_TTL이 지나면 만료됨)
+    try:
+        cache.delete(ws_user_cache_key(user_id))
+    except Exception as e:
+        print(f"--- Failed to invalidate WS user snapshot for user {user_id}: {e} ---")
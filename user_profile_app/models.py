@@ -28,6 +28,71 @@ class Profile(models.Model):
     def __str__(self):
         return f"{self.user.username}'s Profile (Score: {self.affinity_score})"
 
+    # 💾 변경 필드 추적: DB에서 읽은 값을 기억해 두었다가 save() 시 바뀐 컬럼만 UPDATE 합니다.
+    # 바뀐 필드가 없으면 쿼리를 보내지 않습니다. (update_fields를 직접 넘기면 그대로 따릅니다)
+    # F() 같은 식 값은 DB 값을 알 수 없으므로 항상 바뀐 것으로 보고, 읽은 값으로 기억하지 않습니다.
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_loaded_values()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        # 다시 읽은 값을 기준으로 삼아야, 그 사이 다른 곳에서 바뀐 값으로 되돌리는 저장이 생략되지 않음
+        # (지연 로딩된 필드도 이 경로로 읽히므로 이때부터 추적됨)
+        if fields is None:
+            self._remember_loaded_values()
+        else:
+            concrete = {field.name: field.attname for field in self._meta.concrete_fields if not field.primary_key}
+            concrete.update({attname: attname for attname in concrete.values()})
+            self._remember_loaded_values([concrete[name] for name in fields if name in concrete])
+
+    def _tracked_attnames(self):
+        deferred = self.get_deferred_fields()
+        return [
+            field.attname for field in self._meta.concrete_fields
+            if not field.primary_key and field.attname not in deferred
+        ]
+
+    def _remember_loaded_values(self, attnames=None):
+        loaded = getattr(self, '_loaded_values', None) or {}
+        for attname in (attnames if attnames is not None else self._tracked_attnames()):
+            value = getattr(self, attname)
+            if hasattr(value, 'resolve_expression'):
+                loaded.pop(attname, None)
+            else:
+                loaded[attname] = value
+        self._loaded_values = loaded
+
+    def get_dirty_fields(self):
+        """DB에서 읽은 뒤 값이 바뀐 필드 이름 목록. 아직 저장되지 않은 객체면 None."""
+        loaded = getattr(self, '_loaded_values', None)
+        if self._state.adding or loaded is None:
+            return None
+        dirty = []
+        for attname in self._tracked_attnames():
+            value = getattr(self, attname)
+            if hasattr(value, 'resolve_expression') or attname not in loaded or value != loaded[attname]:
+                dirty.append(attname)
+        return dirty
+
+    def save(self, *args, **kwargs):
+        if kwargs.get('update_fields') is None and not args:
+            dirty = self.get_dirty_fields()
+            if dirty is not None:
+                if not dirty:
+                    return
+                kwargs['update_fields'] = dirty
+        super().save(*args, **kwargs)
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            self._remember_loaded_values()
+        else:
+            # 일부 필드만 저장했다면 저장한 필드만 깨끗한 상태로 표시
+            self._remember_loaded_values([self._meta.get_field(name).attname for name in update_fields])
+
     class Meta:
         verbose_name = '사용자 프로필'
         verbose_name_plural = '사용자 프로필'
@@ -40,10 +105,16 @@ def create_user_profile(sender, instance, created, **kwargs):
         Profile.objects.create(user=instance)
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
-def save_user_profile(sender, instance, **kwargs):
-    # 기존 사용자라도 profile이 없으면 생성 (안전장치)
+def save_user_profile(sender, instance, created, update_fields=None, **kwargs):
+    # 신규 사용자는 create_user_profile에서 처리
+    if created:
+        return
+
     # 🚨 수정: profile 대신 'ai_profile'로 접근합니다.
-    if not hasattr(instance, 'ai_profile'):
-        Profile.objects.create(user=instance)
-    else:
+    # 이미 로드된 profile만 저장하며, Profile.save()가 바뀐 필드가 있을 때만 UPDATE 합니다.
+    # (로그인 시 last_login 갱신 등으로 매번 profile을 SELECT/UPDATE 하지 않도록)
+    if sender.ai_profile.is_cached(instance):
         instance.ai_profile.save()
+    elif update_fields is None:
+        # 전체 저장(관리자 수정 등)일 때만: 기존 사용자라도 profile이 없으면 생성 (안전장치)
+        Profile.objects.get_or_create(user=instance)
@@ -0,0 +1,56 @@
+# app_server/user_profile_app/tests.py
+# 실행: python manage.py test user_profile_app
+
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.test import TestCase
+
+from user_profile_app.models import Profile
+
+User = get_user_model()
+
+
+class ProfileDirtyTrackingTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('profile', 'p@example.com', 'pw12345!!')
+
+    def _db_score(self):
+        return Profile.objects.values_list('affinity_score', flat=True).get(user=self.user)
+
+    def test_unchanged_profile_is_not_saved(self):
+        profile = Profile.objects.get(user=self.user)
+        self.assertEqual(profile.get_dirty_fields(), [])
+        profile.affinity_score = 7
+        self.assertEqual(profile.get_dirty_fields(), ['affinity_score'])
+
+    def test_revert_after_refresh_is_saved(self):
+        profile = Profile.objects.get(user=self.user)
+        Profile.objects.filter(user=self.user).update(affinity_score=F('affinity_score') + 5)
+        profile.refresh_from_db()
+        self.assertEqual(profile.affinity_score, 5)
+
+        profile.affinity_score = 0
+        profile.save()
+        self.assertEqual(self._db_score(), 0)
+
+    def test_partial_refresh_and_deferred_fields_are_tracked(self):
+        profile = Profile.objects.only('user').get(user=self.user)
+        Profile.objects.filter(user=self.user).update(affinity_score=5)
+        # 지연 필드 접근은 refresh_from_db(fields=[...])로 읽힘
+        self.assertEqual(profile.affinity_score, 5)
+        profile.affinity_score = 0
+        self.assertEqual(profile.get_dirty_fields(), ['affinity_score'])
+        profile.save()
+        self.assertEqual(self._db_score(), 0)
+
+    def test_expression_values_are_always_dirty(self):
+        profile = Profile.objects.get(user=self.user)
+        profile.affinity_score = F('affinity_score') + 3
+        self.assertEqual(profile.get_dirty_fields(), ['affinity_score'])
+        profile.save()
+        self.assertEqual(self._db_score(), 3)
+        # 식 값은 읽은 값으로 기억하지 않으므로, 다시 읽기 전까지는 저장 대상으로 남음
+        self.assertNotIn('affinity_score', profile._loaded_values)
+        profile.refresh_from_db(fields=['affinity_score'])
+        self.assertEqual(profile.get_dirty_fields(), [])